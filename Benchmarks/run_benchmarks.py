@@ -0,0 +1,308 @@
+"""Time and memory-profile each pipeline stage on synthetic ERA5-shaped data.
+
+    python Benchmarks/run_benchmarks.py [--resolution 1 0.25] [--days 31] [--repeat 3]
+                                        [--stages daily cdd ...] [--output results.json]
+                                        [--compare baseline.json]
+
+Every measurement runs in a fresh process: the stage's inputs are prepared
+first (untimed), then the stage itself is timed while a background thread
+samples the process's resident memory. Results go to a JSON file, and
+``--compare`` reports the change against an earlier one and exits with
+status 1 if any stage became slower or larger than ``--tolerance`` allows.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synthetic_era5 import build_fixtures  # noqa: E402
+
+DATE = '2010-07-01'
+
+
+def _daily_file(fixture, product):
+    from climdrivers.daily import daily_output_path
+    return daily_output_path(fixture['daily_folder'], product, fixture['year'], fixture['month'])
+
+
+def _loaded(fixture, product):
+    import xarray as xr
+    with xr.open_dataset(_daily_file(fixture, product)) as ds:
+        return ds.load()
+
+
+def _warm_kernel():
+    """Run the degree-day kernel once so its first-call overhead is not timed."""
+    import numpy as np
+    import xarray as xr
+    from climdrivers.degree_days import degree_days_dataarray
+    for dtype in (np.float32, np.float64):
+        one = xr.DataArray(np.ones((1, 1), dtype=dtype), dims=('latitude', 'longitude'))
+        degree_days_dataarray(one, one, one, [0]).load()
+
+
+# Each stage prepares its inputs and returns the function that is timed
+
+def stage_daily(fixture, workdir):
+    """Hourly 2t/2d -> every daily product, written to disk (process_month)."""
+    from climdrivers.config import DEFAULTS
+    from climdrivers.daily import PRODUCTS, process_month
+    return lambda: process_month(fixture['dew_path'], fixture['temp_path'], workdir,
+                                 products=tuple(PRODUCTS), cdh_bases=[19], qdh_bases=[22],
+                                 sweep=(DEFAULTS['sweep_W_refs'], DEFAULTS['sweep_T_thresholds']))
+
+
+def stage_cdd(fixture, workdir):
+    """Daily cooling degree days at base 19 °C from in-memory T_max/T_mean/T_min."""
+    from climdrivers.degree_days import degree_days_dataarray
+    ds = _loaded(fixture, 'temp')
+    _warm_kernel()
+    return lambda: degree_days_dataarray(ds['T_max'], ds['T_mean'], ds['T_min'], [19]).values
+
+
+def stage_qdd(fixture, workdir):
+    """Daily enthalpy degree days at base 22 kJ/kg from in-memory Q_max/Q_mean/Q_min."""
+    from climdrivers.degree_days import degree_days_dataarray
+    ds = _loaded(fixture, 'q')
+    _warm_kernel()
+    return lambda: degree_days_dataarray(ds['Q_max'], ds['Q_mean'], ds['Q_min'], [22]).values
+
+
+def stage_cell_stats(fixture, workdir):
+    """Per-cell monthly CDD statistics (the old per-cell loop) from an open daily file."""
+    from climdrivers.catalog import open_file
+    from climdrivers.cell_stats import monthly_cell_stats
+    from climdrivers.degree_days import degree_days_dataarray
+    from climdrivers.monthly import METRICS
+
+    _warm_kernel()
+
+    def run():
+        ds = open_file(_daily_file(fixture, 'temp'))
+        ds['cdd'] = degree_days_dataarray(ds['T_max'], ds['T_mean'], ds['T_min'], [19])
+        return monthly_cell_stats(ds, METRICS['cdd']['stats']).load()
+    return run
+
+
+def _stage_country_index(mode):
+    def stage(fixture, workdir):
+        import geopandas as gpd
+        from climdrivers.country_index import build_country_index
+        from synthetic_era5 import grid
+        lat, lon = grid(fixture['resolution'])
+        countries = gpd.read_file(fixture['shapefile'])
+        return lambda: build_country_index(lat, lon, countries, mode=mode)
+    stage.__doc__ = f"Grid-to-country index in {mode} mode (the old sjoin)"
+    return stage
+
+
+def stage_aggregate(fixture, workdir):
+    """Country means and sums of the CDD statistics (the old groupby) with a point index."""
+    import geopandas as gpd
+    from climdrivers.cell_stats import monthly_cell_stats
+    from climdrivers.country_index import build_country_index
+    from climdrivers.degree_days import degree_days_dataarray
+    from climdrivers.monthly import METRICS
+    from synthetic_era5 import grid
+
+    ds = _loaded(fixture, 'temp')
+    ds['cdd'] = degree_days_dataarray(ds['T_max'], ds['T_mean'], ds['T_min'], [19])
+    stats = monthly_cell_stats(ds, METRICS['cdd']['stats']).sel(base=19).load()
+    lat, lon = grid(fixture['resolution'])
+    index = build_country_index(lat, lon, gpd.read_file(fixture['shapefile']))
+    columns = [(column, stats[stat].values, how) for column, stat, how in METRICS['cdd']['columns']]
+    return lambda: index.aggregate(DATE, columns)
+
+
+def stage_monthly(fixture, workdir):
+    """One month of the CDD country table end to end (extract_year), with a cached index."""
+    from climdrivers.catalog import Catalog
+    from climdrivers.config import load_config
+    from climdrivers.country_index import load_country_index
+    from climdrivers.monthly import extract_year
+    from synthetic_era5 import grid
+
+    config = load_config(daily_folder=fixture['daily_folder'], output_folder=workdir,
+                         shapefile=fixture['shapefile'], cache_folder=os.path.join(workdir, 'cache'),
+                         manifest=os.path.join(workdir, 'manifest.json'), panel_folder='')
+    catalog = Catalog(fixture['daily_folder'], index_file=os.path.join(workdir, 'catalog.json')).scan()
+    lat, lon = grid(fixture['resolution'])
+    load_country_index(lat, lon, config['shapefile'], config['cache_folder'])
+    return lambda: extract_year('cdd', fixture['year'], config, months=[fixture['month']], catalog=catalog)
+
+
+def stage_climatology(fixture, workdir):
+    """Seasonal and monthly ELD climatology accumulators over the daily file."""
+    from climdrivers.climatology import accumulate_files
+    return lambda: accumulate_files([_daily_file(fixture, 'eld')], groupings=('season', 'month'))
+
+
+STAGES = {
+    'daily': stage_daily,
+    'cdd': stage_cdd,
+    'qdd': stage_qdd,
+    'cell_stats': stage_cell_stats,
+    'country_index_point': _stage_country_index('point'),
+    'country_index_area': _stage_country_index('area'),
+    'aggregate': stage_aggregate,
+    'monthly': stage_monthly,
+    'climatology': stage_climatology,
+}
+
+
+class PeakMemory:
+    """Samples this process's resident memory in a background thread; ``peak`` in bytes."""
+
+    def __init__(self, interval=0.005):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def measure(stage, fixture, workdir, threads):
+    """Prepare and run one stage in this process; returns its timings and memory use."""
+    import dask
+    dask.config.set(scheduler='threads', num_workers=threads)
+    run = STAGES[stage](fixture, workdir)
+    gc.collect()
+    with PeakMemory() as memory:
+        before = memory.peak
+        cpu_start, start = time.process_time(), time.perf_counter()
+        run()
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+    return {'seconds': seconds, 'cpu_seconds': cpu_seconds,
+            'rss_before_mb': before / 2 ** 20, 'peak_rss_mb': memory.peak / 2 ** 20,
+            'peak_increase_mb': (memory.peak - before) / 2 ** 20}
+
+
+def run_stage(stage, fixture, work_folder, repeat, threads):
+    """``repeat`` measurements of a stage, each in a new process and a clean work folder."""
+    runs = []
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp(prefix=f"{stage}_", dir=work_folder)
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                runs.append(pool.submit(measure, stage, fixture, workdir, threads).result())
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    seconds = [run['seconds'] for run in runs]
+    return {'stage': stage, 'resolution': fixture['resolution'], 'days': fixture['days'],
+            'grid': fixture['grid'], 'repeat': repeat, 'seconds': seconds,
+            'best_seconds': min(seconds), 'median_seconds': statistics.median(seconds),
+            'cpu_seconds': min(run['cpu_seconds'] for run in runs),
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'peak_increase_mb': max(run['peak_increase_mb'] for run in runs)}
+
+
+def environment(threads):
+    """Versions and machine details recorded with the results."""
+    import dask
+    import numpy as np
+    import psutil
+    import xarray as xr
+    from climdrivers import __version__
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'climdrivers': __version__, 'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'host': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'xarray': xr.__version__, 'dask': dask.__version__, 'numba': numba_version,
+            'cpus': os.cpu_count(), 'memory_gb': round(psutil.virtual_memory().total / 2 ** 30, 1),
+            'threads': threads}
+
+
+def compare(results, baseline_file, tolerance):
+    """Print each stage against ``baseline_file``; returns the (stage, resolution) pairs that regressed."""
+    with open(baseline_file) as f:
+        baseline = {(r['stage'], r['resolution'], r['days']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        old = baseline.get((result['stage'], result['resolution'], result['days']))
+        if old is None:
+            continue
+        time_ratio = result['best_seconds'] / old['best_seconds']
+        memory_ratio = result['peak_increase_mb'] / max(old['peak_increase_mb'], 1)
+        slower = time_ratio > tolerance or memory_ratio > tolerance
+        print(f"{result['stage']:>20} {result['resolution']:g}°: time ×{time_ratio:.2f}, "
+              f"memory ×{memory_ratio:.2f}{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append((result['stage'], result['resolution']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolution', type=float, nargs='+', default=[1.0],
+                        help="grid spacing in degrees, e.g. 1 0.25")
+    parser.add_argument('--days', type=int, default=31, help="days in the synthetic month")
+    parser.add_argument('--stages', nargs='+', choices=tuple(STAGES), default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="dask threads per stage")
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'climdrivers_benchmarks'),
+                        help="folder for the fixtures (kept between runs)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.1,
+                        help="time or memory ratio above which a stage counts as a regression")
+    args = parser.parse_args(argv)
+
+    work_folder = os.path.join(args.data, 'work')
+    os.makedirs(work_folder, exist_ok=True)
+    results = []
+    for resolution in args.resolution:
+        fixture = build_fixtures(args.data, resolution, args.days)
+        for stage in args.stages:
+            result = run_stage(stage, fixture, work_folder, args.repeat, args.threads)
+            results.append(result)
+            print(f"{stage:>20} {resolution:g}°: {result['best_seconds']:8.3f} s "
+                  f"(median {result['median_seconds']:.3f} s), +{result['peak_increase_mb']:.0f} MB "
+                  f"(peak {result['peak_rss_mb']:.0f} MB)")
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(args.threads), 'results': results}, f, indent=1)
+    print(f"Saved {len(results)} results → {args.output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Synthetic ERA5-shaped inputs for the benchmarks.
+
+Hourly ``VAR_2T``/``VAR_2D`` files are written one day at a time, with the
+raw archive's file names, grid orientation (latitude 90 to -90, longitude
+0-360), dtype and compression, so every stage reads them as it reads ERA5.
+Temperatures follow a latitude profile with a diurnal cycle and noise, so
+degree days and ELD are zero over a realistic share of the grid. Daily files
+are made from the hourly ones by the real daily pass. Countries are a
+jittered tiling of polygons, so nothing has to be downloaded.
+"""
+import json
+import os
+
+import netCDF4
+import numpy as np
+import pandas as pd
+
+# Bump when the generated data changes, so cached fixtures are rebuilt
+FIXTURE_VERSION = 2
+
+
+def grid(resolution):
+    """ERA5 latitudes (90 to -90) and longitudes (0 to 360 - resolution) at ``resolution`` degrees."""
+    n_lat = int(round(180 / resolution)) + 1
+    n_lon = int(round(360 / resolution))
+    return np.linspace(90, -90, n_lat), np.arange(n_lon) * resolution
+
+
+def hourly_day(lat, lon, day, rng):
+    """24 hours of 2 m temperature and dew point (K, float32) for one day."""
+    hours = np.arange(24)[:, None, None]
+    # Warm tropics, a seasonal north-south tilt and a diurnal cycle peaking at 14 h local time
+    profile = 300 - 45 * np.sin(np.deg2rad(lat)) ** 2 + 6 * np.sin(np.deg2rad(lat)) * np.cos(2 * np.pi * day / 365)
+    local_hour = hours + lon[None, None, :] / 15
+    T = profile[None, :, None] + 5 * np.cos(2 * np.pi * (local_hour - 14) / 24)
+    T = T + rng.normal(0, 2, size=(24, len(lat), len(lon)))
+    Td = T - np.abs(rng.normal(6, 3, size=T.shape))
+    return T.astype(np.float32), Td.astype(np.float32)
+
+
+def hourly_file_names(year, month, days):
+    """(dew point, temperature) names in the raw archive's convention."""
+    stamp = f"{year}{month:02d}0100_{year}{month:02d}{days:02d}23"
+    return (f"e5.oper.an.sfc.128_168_2d.ll025sc.{stamp}.nc",
+            f"e5.oper.an.sfc.128_167_2t.ll025sc.{stamp}.nc")
+
+
+def _create_hourly(path, name, lat, lon, complevel):
+    nc = netCDF4.Dataset(path, 'w')
+    nc.createDimension('time', None)
+    nc.createDimension('latitude', len(lat))
+    nc.createDimension('longitude', len(lon))
+    time = nc.createVariable('time', 'i4', ('time',))
+    time.units = 'hours since 1900-01-01 00:00:00'
+    time.calendar = 'gregorian'
+    nc.createVariable('latitude', 'f8', ('latitude',))[:] = lat
+    nc.createVariable('longitude', 'f8', ('longitude',))[:] = lon
+    var = nc.createVariable(name, 'f4', ('time', 'latitude', 'longitude'), zlib=complevel > 0,
+                            complevel=max(complevel, 1), chunksizes=(1, len(lat), len(lon)))
+    var.units = 'K'
+    return nc
+
+
+def write_hourly_month(folder, year, month, resolution, days, complevel=1, seed=0):
+    """Write one month of hourly files; returns (dew point path, temperature path)."""
+    os.makedirs(folder, exist_ok=True)
+    lat, lon = grid(resolution)
+    dew_path, temp_path = (os.path.join(folder, name) for name in hourly_file_names(year, month, days))
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp('1900-01-01')
+    dew = _create_hourly(dew_path + '.tmp', 'VAR_2D', lat, lon, complevel)
+    temp = _create_hourly(temp_path + '.tmp', 'VAR_2T', lat, lon, complevel)
+    try:
+        for day in range(days):
+            start = pd.Timestamp(year=year, month=month, day=1) + pd.Timedelta(days=day)
+            hours = int((start - base) / pd.Timedelta(hours=1)) + np.arange(24)
+            T, Td = hourly_day(lat, lon, start.dayofyear, rng)
+            for nc, name, values in ((temp, 'VAR_2T', T), (dew, 'VAR_2D', Td)):
+                nc['time'][day * 24:(day + 1) * 24] = hours
+                nc[name][day * 24:(day + 1) * 24] = values
+    finally:
+        dew.close()
+        temp.close()
+    os.replace(dew_path + '.tmp', dew_path)
+    os.replace(temp_path + '.tmp', temp_path)
+    return dew_path, temp_path
+
+
+def _edge(start, end, n_points, jitter, rng):
+    """Points strictly between ``start`` and ``end``, jittered across the edge."""
+    t = np.linspace(0, 1, n_points + 2)[1:-1, None]
+    points = start + t * (end - start)
+    normal = np.array([-(end - start)[1], (end - start)[0]])
+    normal = normal / (np.hypot(*normal) or 1)
+    return points + rng.uniform(-jitter, jitter, size=(n_points, 1)) * normal
+
+
+def make_countries(path, n_lon=20, n_lat=8, land_fraction=0.6, vertices_per_edge=8, seed=0):
+    """Shapefile of jittered polygons tiling 56°S-72°N, with an ``ADMIN`` name column.
+
+    Neighbouring polygons share their edges, as real borders do, and a
+    random ``1 - land_fraction`` of them is left out as ocean.
+    """
+    import geopandas as gpd
+    from shapely.geometry import Polygon
+
+    rng = np.random.default_rng(seed)
+    lons = np.linspace(-180, 180, n_lon + 1)
+    lats = np.linspace(-56, 72, n_lat + 1)
+    dlon, dlat = lons[1] - lons[0], lats[1] - lats[0]
+    # Lattice corners, jittered except on the outer boundary
+    corners = np.stack(np.meshgrid(lons, lats), axis=-1)
+    inner = (slice(1, -1), slice(1, -1))
+    corners[inner] += rng.uniform(-0.3, 0.3, size=corners[inner].shape) * [dlon, dlat]
+    jitter = 0.15 * min(dlon, dlat)
+    east = {(i, j): _edge(corners[i, j], corners[i, j + 1], vertices_per_edge, jitter, rng)
+            for i in range(n_lat + 1) for j in range(n_lon)}
+    north = {(i, j): _edge(corners[i, j], corners[i + 1, j], vertices_per_edge, jitter, rng)
+             for i in range(n_lat) for j in range(n_lon + 1)}
+
+    names, polygons = [], []
+    for i in range(n_lat):
+        for j in range(n_lon):
+            if rng.random() > land_fraction:
+                continue
+            ring = np.concatenate([[corners[i, j]], east[i, j],
+                                   [corners[i, j + 1]], north[i, j + 1],
+                                   [corners[i + 1, j + 1]], east[i + 1, j][::-1],
+                                   [corners[i + 1, j]], north[i, j][::-1]])
+            names.append(f"Country {len(names):03d}")
+            polygons.append(Polygon(ring).buffer(0))
+    gpd.GeoDataFrame({'ADMIN': names}, geometry=polygons, crs='EPSG:4326').to_file(path)
+    return path
+
+
+def build_fixtures(data_folder, resolution, days, year=2010, month=7, complevel=1):
+    """Hourly, daily and country fixtures for one grid, reused when already built.
+
+    Returns a dict of paths and grid details (also saved as ``fixture.json``).
+    """
+    from climdrivers.config import DEFAULTS
+    from climdrivers.daily import PRODUCTS, process_month
+
+    folder = os.path.join(data_folder, f"res{resolution:g}_days{days}")
+    spec_file = os.path.join(folder, 'fixture.json')
+    spec = {'version': FIXTURE_VERSION, 'resolution': resolution, 'days': days, 'year': year,
+            'month': month, 'complevel': complevel}
+    if os.path.exists(spec_file):
+        with open(spec_file) as f:
+            fixture = json.load(f)
+        if all(fixture.get(key) == value for key, value in spec.items()):
+            return fixture
+
+    print(f"Building {resolution:g}° fixtures ({days} days) in {folder}")
+    raw_folder = os.path.join(folder, 'raw')
+    daily_folder = os.path.join(folder, 'daily')
+    os.makedirs(daily_folder, exist_ok=True)
+    dew_path, temp_path = write_hourly_month(raw_folder, year, month, resolution, days, complevel)
+    process_month(dew_path, temp_path, daily_folder, products=tuple(PRODUCTS),
+                  cdh_bases=[19], qdh_bases=[22],
+                  sweep=(DEFAULTS['sweep_W_refs'], DEFAULTS['sweep_T_thresholds']))
+    shapefile = make_countries(os.path.join(folder, 'countries.shp'))
+
+    lat, lon = grid(resolution)
+    fixture = dict(spec, raw_folder=raw_folder, daily_folder=daily_folder, dew_path=dew_path,
+                   temp_path=temp_path, shapefile=shapefile, grid=[len(lat), len(lon)])
+    with open(spec_file, 'w') as f:
+        json.dump(fixture, f, indent=1)
+    return fixture
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from climdrivers.cli import main
+
+sys.stdout = open(sys.stdout.fileno(), mode='w', buffering=1)
+
+# The default daily products (temp, q, eld and dh; see products in
+# climdrivers/config.py) from one read of each hourly file pair, 2000–2024.
+# Paths, thresholds, workers and chunking come from climdrivers/config.py and
+# can be changed with --config run.json or options, e.g. --years 2015 --workers 8.
+# Same as: python -m climdrivers daily --years 2000-2024
+if __name__ == "__main__":
+    sys.exit(main(['daily', '--years', '2000-2024'] + sys.argv[1:]))
@@ -0,0 +1,6 @@
+"""Shared building blocks for the ERA5 climate-driver extractions."""
+
+# Recorded in the output manifest and the daily files' attributes; bump when
+# a change alters extracted values (0.2.0: daily Q_mean is no longer
+# overwritten by Q_max)
+__version__ = "0.2.0"
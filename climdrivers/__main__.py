@@ -0,0 +1,5 @@
+import sys
+
+from climdrivers.cli import main
+
+sys.exit(main())
@@ -0,0 +1,140 @@
+"""Analysis panel: monthly climate metrics joined with World Bank and AC data.
+
+The World Development Indicators exports (wide, four preamble rows) are
+melted into long ``(code, year)`` tables, AC_saturation.csv is cleaned (year
+typos, non-numeric years) and everything is keyed on ISO alpha-3 codes from
+``climdrivers.countries``. The merged panel is indexed by (code, Date),
+stored with categorical text columns, and cached as Parquet next to its
+inputs' fingerprints so later sessions load it directly.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from climdrivers import __version__
+from climdrivers.countries import crosswalk, to_codes
+from climdrivers.manifest import atomic_path, fingerprint
+from climdrivers.panel import load_panels
+
+# Known data-entry errors in AC_saturation.csv's Year column
+AC_YEAR_FIXES = {2918: 2018}
+
+CACHE_KEY = b'climdrivers_inputs'
+
+
+def read_wdi(path, value_name='value'):
+    """Long table (code, year) -> ``value_name`` (plus ``name``) from a WDI wide-format export."""
+    wide = pd.read_csv(path, skiprows=4, encoding='utf-8-sig')
+    wide = wide.loc[:, [c for c in wide.columns if not str(c).startswith('Unnamed')]]
+    year_columns = [c for c in wide.columns if str(c).isdigit()]
+    long = wide.melt(id_vars=['Country Name', 'Country Code'], value_vars=year_columns,
+                     var_name='year', value_name=value_name)
+    long = long.rename(columns={'Country Name': 'name', 'Country Code': 'code'})
+    long['year'] = long['year'].astype('int16')
+    long[value_name] = long[value_name].astype('float64')
+    return long.set_index(['code', 'year']).sort_index()
+
+
+def read_ac_saturation(path):
+    """AC_saturation.csv with numeric ``AC_year`` and ``AC_population`` columns.
+
+    Years are taken from the first four-digit number in the Year column
+    (``"IEA (2019)"`` -> 2019); known typos are corrected via
+    ``AC_YEAR_FIXES`` and anything else outside 1900–2100 becomes missing.
+    """
+    ac = pd.read_csv(path, encoding='utf-8-sig')
+    year = pd.to_numeric(ac['Year'].astype(str).str.extract(r'(\d{4})')[0], errors='coerce')
+    year = year.replace(AC_YEAR_FIXES)
+    ac['AC_year'] = year.where(year.between(1900, 2100)).astype('Int16')
+    return ac.rename(columns={'Country': 'name', 'Source': 'AC_source', 'Notes': 'AC_notes',
+                              'Population': 'AC_population'}).drop(columns=['Year'])
+
+
+class AnalysisPanel:
+    """Merged panel indexed by (code, Date), with constant-time country and year slices."""
+
+    def __init__(self, frame):
+        self.frame = frame.sort_index()
+        codes = self.frame.index.get_level_values('code')
+        # Rows of one country are contiguous once sorted
+        unique, starts = np.unique(np.asarray(codes), return_index=True)
+        stops = np.append(starts[1:], len(codes))
+        self._country_rows = {code: slice(start, stop) for code, start, stop in zip(unique, starts, stops)}
+        self._codes_by_name = dict(zip(self.frame['Country'].astype(str), np.asarray(codes)))
+        years = self.frame.index.get_level_values('Date').year
+        self._year_rows = {int(year): rows for year, rows in pd.Series(np.arange(len(years))).groupby(
+            np.asarray(years)).indices.items()}
+
+    def countries(self):
+        return list(self._country_rows)
+
+    def years(self):
+        return sorted(self._year_rows)
+
+    def country(self, country):
+        """All months of one country, by ISO code or panel (Natural Earth) name."""
+        code = self._codes_by_name.get(country, country)
+        return self.frame.iloc[self._country_rows[code]]
+
+    def year(self, year):
+        """All countries for one calendar year."""
+        return self.frame.iloc[self._year_rows[int(year)]]
+
+
+def build_panel(panel_folder, gdp_path, population_path, ac_path,
+                metrics=('cdd_base19', 'eld', 'qdd')):
+    """Join the monthly metrics with annual GDP and population and the AC table."""
+    gdp = read_wdi(gdp_path, 'gdp')
+    population = read_wdi(population_path, 'population')
+    ac = read_ac_saturation(ac_path)
+    names = pd.concat([gdp.reset_index()[['name', 'code']], population.reset_index()[['name', 'code']]])
+    lookup = crosswalk(names.drop_duplicates())
+
+    monthly = load_panels(panel_folder, metrics=metrics)
+    monthly['code'] = to_codes(monthly['Country'].astype(str), lookup).values
+    monthly['year'] = monthly['Date'].dt.year.astype('int16')
+
+    ac['code'] = to_codes(ac['name'], lookup).values
+    panel = (monthly
+             .merge(gdp[['gdp']], left_on=['code', 'year'], right_index=True, how='left')
+             .merge(population[['population']], left_on=['code', 'year'], right_index=True, how='left')
+             .merge(ac.drop(columns=['name']), on='code', how='left'))
+    for column in ('code', 'AC_source', 'AC_notes', 'Hemisphere'):
+        panel[column] = panel[column].astype('category')
+    return panel.drop(columns=['year']).set_index(['code', 'Date']).sort_index()
+
+
+def _input_fingerprints(panel_folder, paths, metrics):
+    inputs = {}
+    for metric in metrics:
+        folder = os.path.join(panel_folder, f"metric={metric}")
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if name.endswith('.parquet'):
+                    path = os.path.join(root, name)
+                    inputs[os.path.relpath(path, panel_folder)] = fingerprint(path)
+    for path in paths:
+        inputs[os.path.abspath(path)] = fingerprint(path)
+    return {'version': __version__, 'metrics': list(metrics), 'inputs': inputs}
+
+
+def load_analysis_panel(panel_folder, gdp_path, population_path, ac_path, cache_file,
+                        metrics=('cdd_base19', 'eld', 'qdd')):
+    """``AnalysisPanel`` from ``cache_file``, rebuilt (and re-cached) when any input changed."""
+    key = _input_fingerprints(panel_folder, [gdp_path, population_path, ac_path], metrics)
+    if os.path.exists(cache_file):
+        metadata = pq.read_schema(cache_file).metadata or {}
+        if metadata.get(CACHE_KEY) == json.dumps(key, sort_keys=True).encode():
+            return AnalysisPanel(pq.read_table(cache_file).to_pandas())
+
+    frame = build_panel(panel_folder, gdp_path, population_path, ac_path, metrics=metrics)
+    table = pa.Table.from_pandas(frame)
+    table = table.replace_schema_metadata({**table.schema.metadata,
+                                           CACHE_KEY: json.dumps(key, sort_keys=True).encode()})
+    with atomic_path(cache_file) as tmp_path:
+        pq.write_table(table, tmp_path, compression='zstd')
+    return AnalysisPanel(frame)
@@ -0,0 +1,176 @@
+"""Catalog of the daily archive, opened as one lazy dataset per product.
+
+The archive folder is scanned once and the metadata of every
+``era5_daily_{product}_{year}_{month}`` file (variables, time range, grid) is
+cached in ``catalog.json``. Later scans only reopen files whose size or
+mtime changed. Whole products, or any time range of them, can then be opened
+as a single chunk-aligned dataset without building filenames by hand or
+reading every file's metadata again.
+"""
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from climdrivers.cell_stats import day_dim
+from climdrivers.country_index import grid_hash
+from climdrivers.manifest import atomic_path, fingerprint
+from climdrivers.output import DEFAULT_CHUNKS, FORMATS, packed_as_float32
+
+FILE_PATTERN = re.compile(r'^era5_daily_(?P<product>[a-z0-9]+)_(?P<year>\d{4})_(?P<month>\d{2})'
+                          r'(?P<ext>\.nc|\.zarr)$')
+
+
+def open_file(path):
+    """Open one daily file, NetCDF or Zarr."""
+    if path.endswith('.zarr'):
+        return packed_as_float32(xr.open_zarr(path))
+    return xr.open_dataset(path)
+
+
+def _describe(path):
+    """Catalog metadata for one daily file."""
+    with open_file(path) as ds:
+        time_dim = day_dim(ds)
+        times = ds[time_dim].values
+        return {
+            'variables': sorted(ds.data_vars),
+            'time_dim': time_dim,
+            'time_start': str(pd.Timestamp(times.min())),
+            'time_end': str(pd.Timestamp(times.max())),
+            'n_time': int(times.size),
+            'n_lat': int(ds.sizes['latitude']),
+            'n_lon': int(ds.sizes['longitude']),
+            'grid': grid_hash(ds['latitude'].values, ds['longitude'].values),
+        }
+
+
+def _normalise(ds):
+    """Give every file the same ``time`` day axis (and packed fields float32) before concatenation."""
+    time_dim = day_dim(ds)
+    if time_dim != 'time':
+        ds = ds.rename({time_dim: 'time'})
+    return packed_as_float32(ds)
+
+
+class Catalog:
+    """Consolidated index of the daily archive in ``folder``."""
+
+    def __init__(self, folder, index_file=None):
+        self.folder = folder
+        self.index_file = index_file or os.path.join(folder, 'catalog.json')
+        self.entries = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.entries = json.load(f)
+
+    def scan(self):
+        """Refresh the index, reopening only new or changed files."""
+        seen = {}
+        changed = False
+        for name in sorted(os.listdir(self.folder)):
+            match = FILE_PATTERN.match(name)
+            if match is None:
+                continue
+            path = os.path.join(self.folder, name)
+            stat = fingerprint(path)
+            entry = self.entries.get(name)
+            if entry is None or entry['size'] != stat['size'] or entry['mtime'] != stat['mtime']:
+                entry = {'product': match['product'], 'year': int(match['year']),
+                         'month': int(match['month']),
+                         'format': 'zarr' if match['ext'] == '.zarr' else 'netcdf',
+                         **stat, **_describe(path)}
+                changed = True
+            seen[name] = entry
+        if changed or set(seen) != set(self.entries):
+            self.entries = seen
+            self.save()
+        return self
+
+    def save(self):
+        with atomic_path(self.index_file) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+    def frame(self):
+        """The index as a DataFrame, one row per file."""
+        df = pd.DataFrame([{'file': name, **entry} for name, entry in self.entries.items()])
+        if len(df):
+            df['time_start'] = pd.to_datetime(df['time_start'])
+            df['time_end'] = pd.to_datetime(df['time_end'])
+        return df
+
+    def products(self):
+        return sorted({entry['product'] for entry in self.entries.values()})
+
+    def path(self, product, year, month, fmt=None):
+        """Path of one monthly file, or None if it is not in the archive."""
+        for ext_fmt in ([fmt] if fmt else list(FORMATS)):
+            name = f"era5_daily_{product}_{year}_{int(month):02d}{FORMATS[ext_fmt]}"
+            if name in self.entries:
+                return os.path.join(self.folder, name)
+        return None
+
+    def files(self, product, start=None, end=None, years=None):
+        """Sorted paths of a product's files overlapping [start, end] and/or in ``years``."""
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        years = set(years) if years is not None else None
+        selected = []
+        for name, entry in self.entries.items():
+            if entry['product'] != product:
+                continue
+            if years is not None and entry['year'] not in years:
+                continue
+            if start is not None and pd.Timestamp(entry['time_end']) < start:
+                continue
+            if end is not None and pd.Timestamp(entry['time_start']) > end:
+                continue
+            selected.append((entry['year'], entry['month'], name))
+        return [os.path.join(self.folder, name) for _, _, name in sorted(selected)]
+
+    def open(self, product, start=None, end=None, variables=None, chunks=None, **kwargs):
+        """Lazily open a product's files overlapping [start, end] as one dataset.
+
+        Files are concatenated along ``time`` without comparing their
+        coordinates (the catalog already records one grid per file), and dask
+        chunks follow the on-disk chunking of the daily writer by default.
+        """
+        paths = self.files(product, start=start, end=end)
+        if not paths:
+            raise FileNotFoundError(f"no '{product}' files in {self.folder} for {start}–{end}")
+        grids = {self.entries[os.path.basename(p)]['grid'] for p in paths}
+        if len(grids) > 1:
+            raise ValueError(f"'{product}' files in {self.folder} are on {len(grids)} different grids")
+
+        chunks = chunks or {dim: size for dim, size in DEFAULT_CHUNKS.items() if dim != 'time'}
+        engine = 'zarr' if paths[0].endswith('.zarr') else None
+        ds = xr.open_mfdataset(paths, engine=engine, preprocess=_normalise, combine='nested',
+                               concat_dim='time', data_vars='minimal', coords='minimal',
+                               compat='override', join='override', chunks=chunks, **kwargs)
+        if variables is not None:
+            ds = ds[list(variables)]
+        if start is not None or end is not None:
+            ds = ds.sel(time=slice(start, end))
+        return ds
+
+    def select(self, product, variables=None, start=None, end=None, lat=None, lon=None, **kwargs):
+        """Time and space slice of a product; ``lat``/``lon`` are (min, max) pairs."""
+        ds = self.open(product, start=start, end=end, variables=variables, **kwargs)
+        if lat is not None:
+            lat_values = ds['latitude'].values
+            descending = lat_values[0] > lat_values[-1]
+            ds = ds.sel(latitude=slice(max(lat), min(lat)) if descending else slice(min(lat), max(lat)))
+        if lon is not None:
+            lon_values = np.asarray(ds['longitude'].values)
+            lo, hi = lon
+            if lon_values.max() > 180:
+                lo, hi = lo % 360, hi % 360
+            if lo <= hi:
+                ds = ds.sel(longitude=slice(lo, hi))
+            else:
+                ds = ds.isel(longitude=(lon_values >= lo) | (lon_values <= hi))
+        return ds
@@ -0,0 +1,72 @@
+"""Monthly per-cell statistics computed as whole-array reductions over time.
+
+Replaces the nested ``for lat_index ... for lon_index ...`` loops that built
+one Python dict per grid cell. Each statistic is a single xarray reduction
+over the ``time`` axis of a monthly file of daily fields.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from climdrivers.country_index import convert_longitudes
+
+# statistic name -> (daily variable it is computed from, reduction over time)
+CELL_STATS = {
+    'cdd_sum': ('cdd', 'sum'),
+    'avg_temp': ('T_mean', 'mean'),
+    'avg_max_temp': ('T_max', 'mean'),
+    'avg_min_temp': ('T_min', 'mean'),
+    'avg_ELD': ('ELD', 'mean'),
+    'avg_Q': ('Q_mean', 'mean'),
+    'avg_Qb': ('Qb_mean', 'mean'),
+    'avg_RH': ('RH_mean', 'mean'),
+    'avg_HI': ('HI_mean', 'mean'),
+    'avg_HI_max': ('HI_max', 'mean'),
+    'avg_Tw_max': ('Tw_max', 'mean'),
+    'avg_humidex_max': ('humidex_max', 'mean'),
+    'avg_ELD_sweep': ('ELD_sweep', 'mean'),
+    'avg_Qb_sweep': ('Qb_sweep', 'mean'),
+    'qdd': ('qdd', 'sum'),
+    'cdh_sum': ('CDH', 'sum'),
+    'qdh_sum': ('QDH', 'sum'),
+}
+
+
+def day_dim(obj):
+    """Name of the day axis; temperature files from getting_daily_T.py call it ``floor``."""
+    for name in ('time', 'floor'):
+        if name in obj.dims:
+            return name
+    return next(iter(obj.dims))
+
+
+def monthly_cell_stats(ds, stats):
+    """Reduce the daily fields in ``ds`` over time to the requested per-cell statistics.
+
+    NaN propagates, as it did with ``ndarray.mean()``/``.sum()`` on each cell.
+    Extra dimensions (e.g. ``base`` from a degree-day sweep, or ``W_ref`` and
+    ``T_threshold`` from an ELD sweep) are kept.
+    """
+    out = {}
+    for name in stats:
+        if name not in CELL_STATS:
+            raise KeyError(f"unknown cell statistic '{name}'")
+        source, how = CELL_STATS[name]
+        da = ds[source]
+        if how == 'sum':
+            out[name] = da.sum(day_dim(da), skipna=False)
+        else:
+            out[name] = da.mean(day_dim(da), skipna=False)
+    return xr.Dataset(out)
+
+
+def cell_frame(stats, date):
+    """Columnar per-cell DataFrame (Date, lat, lon, statistics...) built straight from the arrays."""
+    lat_values = stats['latitude'].values
+    lon_values = convert_longitudes(stats['longitude'].values)
+    lon2d, lat2d = np.meshgrid(lon_values, lat_values)
+
+    data = {'Date': pd.Timestamp(date), 'lat': lat2d.ravel(), 'lon': lon2d.ravel()}
+    for name, da in stats.data_vars.items():
+        data[name] = da.transpose('latitude', 'longitude').values.ravel()
+    return pd.DataFrame(data)
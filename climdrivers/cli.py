@@ -0,0 +1,255 @@
+"""Command line for the extractions: ``python -m climdrivers daily|monthly|panel|rechunk|climatology|update``.
+
+Every setting in ``climdrivers.config.DEFAULTS`` can come from a JSON file
+(``--config``), a dedicated option or ``--set key=value``. ``--shard i/n``
+(or ``--shard auto`` inside a SLURM/SGE array job) runs only this task's
+slice: (year, month) pairs for ``daily``, whole years for ``monthly``.
+``panel`` loads monthly tables into the Parquet panel store. ``update``
+runs every pass on new or changed raw months only.
+"""
+import argparse
+import json
+import sys
+
+from climdrivers.config import DEFAULTS, load_config, parse_range, parse_shard, shard
+
+# Monthly metrics (climdrivers.monthly.METRICS, listed here to keep start-up light)
+METRIC_NAMES = ('cdd', 'qdd', 'eld', 'cdh', 'qdh', 'eld_sweep', 'heat')
+
+
+def parse_chunks(spec):
+    """``"time=31,latitude=145"`` -> {'time': 31, 'latitude': 145} (``auto`` is kept as a string)."""
+    chunks = {}
+    for part in spec.split(','):
+        dim, size = part.split('=')
+        chunks[dim.strip()] = size.strip() if size.strip() == 'auto' else int(size)
+    return chunks
+
+
+def parse_setting(spec):
+    """``key=value`` -> (key, value), with the value read as JSON where possible."""
+    key, value = spec.split('=', 1)
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help="JSON file of settings (see climdrivers/config.py)")
+    common.add_argument('--set', dest='settings', action='append', type=parse_setting, default=[],
+                        metavar='KEY=VALUE', help="override any setting, e.g. --set complevel=6")
+    common.add_argument('--years', help="e.g. 2000-2024 or 2001,2003")
+    common.add_argument('--months', help="e.g. 6-8")
+    common.add_argument('--shard', help="i/n (0-based) or 'auto' to take the array job task's slice")
+    common.add_argument('--dry-run', action='store_true', help="list this shard's work and exit")
+    common.add_argument('--workers', type=int)
+    common.add_argument('--backend', choices=('serial', 'process', 'dask'))
+    common.add_argument('--threads-per-worker', dest='threads_per_worker', type=int)
+    common.add_argument('--memory-limit', dest='memory_limit', help="resident memory per dask worker, e.g. 16GB")
+    common.add_argument('--address-space-limit', dest='address_space_limit',
+                        help="virtual memory cap per process worker, e.g. 64GB (off by default)")
+    common.add_argument('--raw-folder', dest='raw_folder')
+    common.add_argument('--daily-folder', dest='daily_folder')
+    common.add_argument('--output-folder', dest='output_folder')
+    common.add_argument('--shapefile')
+    common.add_argument('--cache-folder', dest='cache_folder')
+    common.add_argument('--manifest')
+    common.add_argument('--land-mask', dest='land_mask', action='store_true', default=None,
+                        help="only read and compute cells that overlap a country")
+    common.add_argument('--bbox', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                        help="limit the run to a latitude/longitude box")
+    common.add_argument('--countries', nargs='+', metavar='COUNTRY', help="limit the run to these countries")
+    common.add_argument('--region', help="name for the outputs of a --bbox/--countries run")
+    common.add_argument('--metrics-log', dest='metrics_log', help="append per-stage JSON lines here")
+    common.add_argument('--prometheus-file', dest='prometheus_file',
+                        help="write the run's stage totals here in the Prometheus textfile format")
+    common.add_argument('--profile', choices=('cprofile', 'dask'),
+                        help="cProfile every task, or write the dask performance report (dask backend)")
+
+    parser = argparse.ArgumentParser(prog='climdrivers', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    daily = commands.add_parser('daily', parents=[common],
+                                help="daily temperature/enthalpy/ELD files from hourly ERA5")
+    daily.add_argument('--products', nargs='+', choices=('temp', 'q', 'eld', 'heat', 'dh', 'eldsweep'))
+    daily.add_argument('--W-ref', dest='W_ref', type=float, help="reference humidity ratio for Qb")
+    daily.add_argument('--T-threshold', dest='T_threshold', type=float, help="ELD temperature threshold (°C)")
+    daily.add_argument('--cdh-base', dest='cdh_bases', type=float, action='append',
+                       help="cooling degree-hour base (°C) for the 'dh' product; repeat for several")
+    daily.add_argument('--qdh-base', dest='qdh_bases', type=float, action='append',
+                       help="enthalpy degree-hour base (kJ/kg) for the 'dh' product; repeat for several")
+    daily.add_argument('--sweep-W-ref', dest='sweep_W_refs', type=float, action='append',
+                       help="W_ref of the 'eldsweep' product; repeat for several")
+    daily.add_argument('--sweep-T-threshold', dest='sweep_T_thresholds', type=float, action='append',
+                       help="T_threshold (°C) of the 'eldsweep' product; repeat for several")
+    daily.add_argument('--read-chunks', dest='read_chunks', type=parse_chunks, help="e.g. time=24")
+    daily.add_argument('--disk-chunks', dest='disk_chunks', type=parse_chunks,
+                       help="e.g. time=31,latitude=145,longitude=288")
+    daily.add_argument('--format', dest='output_format', choices=('netcdf', 'zarr'))
+    daily.add_argument('--dtype', choices=('float32', 'int16'),
+                       help="storage type; int16 packs each field with a fixed scale and offset")
+    daily.add_argument('--compression', choices=('none', 'zlib', 'blosc_lz4', 'blosc_zstd'))
+
+    monthly = commands.add_parser('monthly', parents=[common], help="monthly country tables")
+    # No choices= here: argparse checks the empty default against them
+    monthly.add_argument('metrics', nargs='*', metavar='METRIC',
+                         help="cdd, qdd, eld, cdh, qdh, eld_sweep and/or heat (default: config metrics)")
+    monthly.add_argument('--t-base', dest='t_bases', type=float, action='append',
+                         help="CDD base temperature (°C); repeat for a sweep")
+    monthly.add_argument('--q-base', dest='q_bases', type=float, action='append',
+                         help="QDD base enthalpy (kJ/kg); repeat for a sweep")
+    monthly.add_argument('--cdh-base', dest='cdh_bases', type=float, action='append',
+                         help="degree-hour bases to aggregate (must be in the daily 'dh' files)")
+    monthly.add_argument('--qdh-base', dest='qdh_bases', type=float, action='append')
+    monthly.add_argument('--aggregation-mode', dest='aggregation_mode',
+                         choices=('point', 'area', 'population'))
+    monthly.add_argument('--population-raster', dest='population_rasters',
+                         help="population-count GeoTIFF/NetCDF for all years (per-year rasters "
+                              "go in the config file)")
+    monthly.add_argument('--panel-folder', dest='panel_folder', help="Parquet store to add the tables to")
+    monthly.add_argument('--monthly-memory', dest='monthly_memory',
+                         help="read and reduce each file in latitude bands within this memory, e.g. 4GB")
+
+    panel = commands.add_parser('panel', parents=[common],
+                                help="load monthly CSV tables into the Parquet panel store")
+    panel.add_argument('metrics', nargs='*', metavar='METRIC',
+                       help="cdd, qdd, eld, cdh, qdh, eld_sweep and/or heat (default: config metrics)")
+    panel.add_argument('--csv', dest='csv_files', action='append', default=[], metavar='METRIC=PATH',
+                       type=lambda spec: tuple(spec.split('=', 1)),
+                       help="import a whole panel CSV instead, e.g. "
+                            "cdd_base19=Temporary_FinalDatasets/monthly_cdd.csv")
+    panel.add_argument('--panel-folder', dest='panel_folder')
+    panel.add_argument('--t-base', dest='t_bases', type=float, action='append')
+    panel.add_argument('--q-base', dest='q_bases', type=float, action='append')
+    panel.add_argument('--aggregation-mode', dest='aggregation_mode',
+                       choices=('point', 'area', 'population'))
+
+    rechunk = commands.add_parser('rechunk', parents=[common],
+                                  help="copy daily products into time-series Zarr stores")
+    rechunk.add_argument('--products', nargs='+', choices=('temp', 'q', 'eld', 'heat', 'dh', 'eldsweep'))
+    rechunk.add_argument('--dtype', choices=('float32', 'int16'))
+    rechunk.add_argument('--timeseries-folder', dest='timeseries_folder')
+    rechunk.add_argument('--timeseries-chunks', dest='timeseries_chunks', type=parse_chunks,
+                         help="e.g. time=-1,latitude=32,longitude=32")
+    rechunk.add_argument('--max-memory', dest='rechunk_memory', help="per tile, e.g. 2GB")
+
+    climatology = commands.add_parser('climatology', parents=[common],
+                                      help="climatologies of a daily product over the whole grid")
+    climatology.add_argument('--product', dest='climatology_product', choices=('temp', 'q', 'eld', 'heat'))
+    climatology.add_argument('--groupings', nargs='+', choices=('season', 'month', 'dayofyear'))
+    climatology.add_argument('--variance', action='store_true', default=None)
+    update = commands.add_parser('update', parents=[common],
+                                 help="process new or changed raw months through every pass (append mode)")
+    update.add_argument('metrics', nargs='*', metavar='METRIC',
+                        help="monthly tables to update (default: config metrics)")
+    update.add_argument('--products', nargs='+', choices=('temp', 'q', 'eld', 'heat', 'dh', 'eldsweep'))
+    update.add_argument('--panel-folder', dest='panel_folder')
+    update.add_argument('--settle-seconds', dest='settle_seconds', type=float,
+                        help="leave raw files changed more recently than this for the next round")
+    update.add_argument('--watch', action='store_true',
+                        help="keep running, checking for new downloads every watch_interval seconds")
+    update.add_argument('--interval', dest='watch_interval', type=float, help="seconds between checks")
+    update.add_argument('--climatology-years', dest='climatology_years',
+                        help="base period of the climatologies kept up to date, e.g. 2001-2023")
+    return parser
+
+
+def config_from_args(args):
+    """Settings from the config file, then ``--set``, then the dedicated options."""
+    overrides = dict(args.settings)
+    overrides.update({key: value for key, value in vars(args).items()
+                      if key in DEFAULTS and value is not None})
+    # The metrics positional is empty (not None) when omitted
+    if not overrides.get('metrics', True):
+        del overrides['metrics']
+    config = load_config(args.config, **overrides)
+    if config['compression'] == 'none':
+        config['compression'] = None
+    return config
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = sorted(set(getattr(args, 'metrics', None) or []) - set(METRIC_NAMES))
+    if unknown:
+        parser.error(f"unknown metric(s): {', '.join(unknown)} (choose from {', '.join(METRIC_NAMES)})")
+    config = config_from_args(args)
+    years = parse_range(config['years'])
+    months = parse_range(config['months'])
+    index, count = parse_shard(args.shard)
+
+    if args.command == 'daily':
+        units = shard([(year, month) for year in years for month in months], index, count)
+        description = ', '.join(f"{year}-{month:02d}" for year, month in units)
+    elif args.command == 'monthly':
+        units = shard(years, index, count)
+        description = ', '.join(str(year) for year in units)
+    elif args.command == 'panel':
+        if count > 1:
+            raise SystemExit("panel imports run as a single task; drop --shard")
+        units = args.csv_files or years
+        description = (', '.join(path for _, path in args.csv_files) if args.csv_files
+                       else f"{years[0]}–{years[-1]}" if years else '')
+    elif args.command == 'update':
+        if count > 1:
+            raise SystemExit("update runs as a single task; drop --shard")
+        units = years
+        description = f"{years[0]}–{years[-1]}" if years else ''
+    elif args.command == 'rechunk':
+        if count > 1:
+            raise SystemExit("rechunk runs as a single task; drop --shard")
+        units = years
+        description = f"{years[0]}–{years[-1]}" if years else ''
+    else:
+        if count > 1:
+            raise SystemExit("climatology runs as a single task; drop --shard")
+        # --years picks the base period here; otherwise the configured one
+        units = parse_range(args.years or config['climatology_years'])
+        description = f"{units[0]}–{units[-1]}" if units else ''
+    print(f"climdrivers {args.command} (shard {index + 1}/{count}): {description or 'nothing to do'}")
+    if args.dry_run or not units:
+        return 0
+
+    from climdrivers import instrument
+    instrument.configure(config, args.command)
+    try:
+        run_command(args, config, units, years, months)
+    finally:
+        instrument.finish(config['prometheus_file'])
+    print("Done!")
+    return 0
+
+
+def run_command(args, config, units, years, months):
+    if args.command == 'daily':
+        from climdrivers.daily import run_daily
+        run_daily(config, units)
+    elif args.command == 'monthly':
+        from climdrivers.monthly import run_monthly
+        run_monthly(config, config['metrics'], units, months)
+    elif args.command == 'panel':
+        from climdrivers.panel import PanelStore, read_panel_csv
+        if args.csv_files:
+            store = PanelStore(config['panel_folder'])
+            for metric, path in args.csv_files:
+                store.write(metric, read_panel_csv(path))
+                print(f"Imported {path} as '{metric}'")
+        else:
+            from climdrivers.monthly import import_tables
+            print(f"Imported {', '.join(import_tables(config, config['metrics'], years)) or 'nothing'}")
+    elif args.command == 'update':
+        from climdrivers.update import run_update, watch
+        (watch if args.watch else run_update)(config, years, months)
+    elif args.command == 'rechunk':
+        from climdrivers.rechunk import run_rechunk
+        run_rechunk(config, units)
+    else:
+        from climdrivers.climatology import build_climatologies
+        build_climatologies(config, units)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
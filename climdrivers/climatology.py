@@ -0,0 +1,311 @@
+"""Streaming climatologies from the daily archive in constant memory.
+
+Rather than concatenating every daily file and calling ``groupby().mean()``,
+each monthly file is folded into per-group running sums and counts (and,
+optionally, sums of squared deviations for the variance, merged with Chan's
+parallel form of Welford's algorithm). Partial accumulators built from
+disjoint sets of files can be merged, so the reduction can be split over a
+process pool and combined at the end.
+
+Sums are kept in float32 with int16 counts, and each file is reduced in
+blocks of latitude rows. The state still holds a full grid per group and
+variable, so the day-of-year grouping (366 groups, over 10 GB for the ELD
+fields on the 0.25° grid) is only built when asked for.
+
+The running state is saved next to each climatology
+(``climatologies*_state.nc``). When new months arrive, only their files are
+folded into it. A full rebuild is only needed when a file that was already
+folded in has changed or is gone, e.g. an ERA5T month replaced by final
+ERA5.
+"""
+import os
+import time
+from functools import partial
+
+import numpy as np
+import xarray as xr
+
+from climdrivers.instrument import count, stage
+
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+# grouping name -> (label coordinate values, function from a time index to 0-based group positions)
+GROUPINGS = {
+    'season': (SEASONS, lambda time: (time.month.values % 12) // 3),
+    'month': (list(range(1, 13)), lambda time: time.month.values - 1),
+    'dayofyear': (list(range(1, 367)), lambda time: time.dayofyear.values - 1),
+}
+
+
+# Latitude rows read and reduced at a time, so the float64 temporaries stay small
+BLOCK_ROWS = 64
+# Days a single group can hold in its int16 counts (about 350 years of a season)
+COUNT_MAX = np.iinfo(np.int16).max
+
+
+class ClimatologyAccumulator:
+    """Running per-group sums and counts for every variable of a daily dataset.
+
+    State is held as arrays of shape (group, *spatial) per variable: int16
+    ``counts`` of valid (non-NaN) days, float32 ``sums`` and, with
+    ``variance=True``, float32 ``m2`` (sum of squared deviations from the
+    group mean). Each batch is reduced in float64 before it is folded in.
+    """
+
+    def __init__(self, by='season', variance=False):
+        if by not in GROUPINGS:
+            raise ValueError(f"unknown grouping '{by}', expected one of {tuple(GROUPINGS)}")
+        self.by = by
+        self.variance = variance
+        self.labels = GROUPINGS[by][0]
+        self.counts = {}
+        self.sums = {}
+        self.m2 = {}
+        self.dims = None
+        self.coords = None
+
+    def _init_variable(self, name, spatial_shape):
+        shape = (len(self.labels),) + spatial_shape
+        self.counts[name] = np.zeros(shape, dtype=np.int16)
+        self.sums[name] = np.zeros(shape, dtype=np.float32)
+        if self.variance:
+            self.m2[name] = np.zeros(shape, dtype=np.float32)
+
+    def _fold(self, name, key, n_b, s_b, m2_b):
+        """Merge one batch (count, sum, M2) into ``key`` (a group, or a group and rows) of ``name``."""
+        n_a = self.counts[name][key]
+        n = n_a + n_b.astype(np.int32)
+        if n.max(initial=0) > COUNT_MAX:
+            raise OverflowError(f"more than {COUNT_MAX} days in a {self.by} group")
+        if self.variance:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                delta = np.where(n_b > 0, s_b / n_b, 0) - np.where(n_a > 0, self.sums[name][key] / n_a, 0)
+                self.m2[name][key] += m2_b + np.where(n > 0, delta ** 2 * n_a * n_b / n, 0)
+        self.counts[name][key] = n
+        self.sums[name][key] += s_b
+
+    def _add_block(self, name, groups, values, rows):
+        """Fold the daily ``values`` (time first) of latitude ``rows`` of variable ``name``."""
+        for g in np.unique(groups):
+            batch = values[groups == g]
+            n_b = (~np.isnan(batch)).sum(axis=0, dtype=np.int32)
+            s_b = np.nansum(batch, axis=0, dtype=np.float64)
+            m2_b = None
+            if self.variance:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean_b = s_b / n_b
+                m2_b = np.nansum((batch - mean_b) ** 2, axis=0, dtype=np.float64)
+            self._fold(name, (g, rows), n_b, s_b, m2_b)
+
+    def add(self, ds, variables=None):
+        """Fold the daily fields of ``ds`` (with a ``time`` dimension) into the running state."""
+        fold_dataset(ds, [self], variables)
+        return self
+
+    def merge(self, other):
+        """Fold another accumulator (built from different files) into this one."""
+        if other.by != self.by or other.variance != self.variance:
+            raise ValueError("can only merge accumulators with the same grouping and variance setting")
+        if self.coords is None:
+            self.coords = other.coords
+        for name in other.counts:
+            if name not in self.counts:
+                self._init_variable(name, other.counts[name].shape[1:])
+                self.dims = other.dims
+            for g in range(len(self.labels)):
+                self._fold(name, g, other.counts[name][g], other.sums[name][g],
+                           other.m2[name][g] if self.variance else None)
+        return self
+
+    def result(self):
+        """Climatology as a Dataset with a ``by`` dimension (mean, plus ``{var}_var`` if tracked).
+
+        Groups that never received data (e.g. seasons outside the years
+        processed) are left out.
+        """
+        out = {}
+        present = np.zeros(len(self.labels), dtype=bool)
+        for name in self.counts:
+            counts = self.counts[name]
+            present |= counts.reshape(len(self.labels), -1).sum(axis=1) > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[name] = ((self.by,) + self.dims, np.where(counts > 0, self.sums[name] / counts, np.nan))
+                if self.variance:
+                    out[f"{name}_var"] = ((self.by,) + self.dims,
+                                          np.where(counts > 1, self.m2[name] / (counts - 1), np.nan))
+        coords = {self.by: self.labels, **{dim: self.coords[dim] for dim in self.dims if dim in self.coords}}
+        return xr.Dataset(out, coords=coords).isel({self.by: present})
+
+    def to_dataset(self):
+        """Raw running state, for saving and resuming later with ``from_dataset``."""
+        state = {}
+        for name in self.counts:
+            state[f"{name}_count"] = ((self.by,) + self.dims, self.counts[name])
+            state[f"{name}_sum"] = ((self.by,) + self.dims, self.sums[name])
+            if self.variance:
+                state[f"{name}_m2"] = ((self.by,) + self.dims, self.m2[name])
+        coords = {self.by: self.labels, **{dim: self.coords[dim] for dim in self.dims if dim in self.coords}}
+        return xr.Dataset(state, coords=coords, attrs={'grouping': self.by, 'variance': int(self.variance)})
+
+    @classmethod
+    def from_dataset(cls, state):
+        """Accumulator resumed from a ``to_dataset`` state."""
+        acc = cls(by=state.attrs['grouping'], variance=bool(state.attrs['variance']))
+        acc.coords = {dim: state[dim].values for dim in state.dims if dim != acc.by and dim in state.coords}
+        for key in state.data_vars:
+            if key.endswith('_count'):
+                name = key[:-len('_count')]
+                acc.dims = state[key].dims[1:]
+                acc.counts[name] = state[key].values.astype(np.int16)
+                acc.sums[name] = state[f"{name}_sum"].values.astype(np.float32)
+                if acc.variance:
+                    acc.m2[name] = state[f"{name}_m2"].values.astype(np.float32)
+        return acc
+
+
+def fold_dataset(ds, accumulators, variables=None):
+    """Fold ``ds`` into every accumulator, reading each variable once in blocks of ``BLOCK_ROWS`` rows."""
+    time_dim = 'time' if 'time' in ds.dims else next(iter(ds.dims))
+    groups = [GROUPINGS[acc.by][1](ds.indexes[time_dim]) for acc in accumulators]
+    for name in variables or list(ds.data_vars):
+        field = ds[name].transpose(time_dim, ...)
+        for acc in accumulators:
+            if acc.coords is None:
+                acc.coords = {dim: ds[dim].values for dim in ds.dims if dim != time_dim and dim in ds.coords}
+            if name not in acc.counts:
+                acc._init_variable(name, field.shape[1:])
+                acc.dims = field.dims[1:]
+        for start in range(0, field.shape[1], BLOCK_ROWS):
+            rows = slice(start, start + BLOCK_ROWS)
+            values = field[:, rows].values
+            for acc, acc_groups in zip(accumulators, groups):
+                acc._add_block(name, acc_groups, values, rows)
+
+
+def accumulate_files(paths, groupings=('season',), variance=False, variables=None):
+    """Fold daily files into one accumulator per grouping, reading each file once."""
+    accumulators = {by: ClimatologyAccumulator(by, variance=variance) for by in groupings}
+    for path in paths:
+        with stage('open'):
+            ds = xr.open_dataset(path)
+        with ds, stage('reduction'):
+            fold_dataset(ds, list(accumulators.values()), variables)
+        count('files_read')
+    return accumulators
+
+
+def accumulate_parallel(paths, groupings=('season',), variance=False, variables=None, workers=1,
+                        **scheduler_options):
+    """``accumulate_files`` split over ``workers`` processes and merged at the end."""
+    from climdrivers.scheduler import run_tasks
+
+    paths = list(paths)
+    workers = max(1, min(workers, len(paths)))
+    shards = [(paths[i::workers],) for i in range(workers)]
+    partials = run_tasks(partial(accumulate_files, groupings=groupings, variance=variance,
+                                 variables=variables),
+                         shards, workers=workers, **scheduler_options)
+    merged = partials[0]
+    for part in partials[1:]:
+        for by, acc in part.items():
+            merged[by].merge(acc)
+    return merged
+
+
+def climatology_file(output_folder, grouping, product='eld'):
+    """``climatologies[_{product}][_{grouping}].nc``, e.g. ``climatologies_temp_month.nc``.
+
+    The ELD product and the season grouping are left out of the name, so the
+    original ELD files keep theirs (``climatologies.nc``, ``climatologies_month.nc``).
+    """
+    parts = ([] if product == 'eld' else [product]) + ([] if grouping == 'season' else [grouping])
+    return os.path.join(output_folder, '_'.join(['climatologies'] + parts) + '.nc')
+
+
+def state_file(output_folder, grouping, product='eld'):
+    """Saved accumulator state of a climatology, e.g. ``climatologies_state.nc``."""
+    return climatology_file(output_folder, grouping, product)[:-len('.nc')] + '_state.nc'
+
+
+def build_climatologies(config, years=None):
+    """Write the configured climatologies of the daily product over ``years``.
+
+    ``years`` defaults to the ``climatology_years`` base period.
+
+    Groupings whose file is up to date for the same input files are skipped.
+    The others fold only their new files into the saved state when it is
+    still valid, and are rebuilt from every file otherwise. Returns the
+    paths written.
+    """
+    from climdrivers.catalog import Catalog
+    from climdrivers.manifest import Manifest, atomic_path
+
+    from climdrivers.config import parse_range
+
+    if years is None:
+        years = parse_range(config['climatology_years'])
+    manifest = Manifest(config['manifest'])
+    input_files = Catalog(config['daily_folder']).scan().files(config['climatology_product'],
+                                                               years=years)
+    if not input_files:
+        print(f"No {config['climatology_product']} daily files in the climatology years")
+        return []
+    product = config['climatology_product']
+    params = {'product': product, 'variance': bool(config['variance'])}
+
+    # Files to fold into each grouping: only the new ones if its saved state covers the rest
+    folder = config['output_folder']
+    plans = {}
+    for grouping in config['groupings']:
+        if manifest.is_current(climatology_file(folder, grouping, product), input_files, params=params):
+            continue
+        saved = state_file(folder, grouping, product)
+        added = manifest.added_inputs(saved, input_files, params=params)
+        plans[grouping] = (input_files, None) if added is None else (added, saved)
+    if not plans:
+        print("Climatologies are up to date")
+        return []
+
+    # Groupings with the same files share a pass; each file is read once per pass
+    passes = {}
+    for grouping, (files, _) in plans.items():
+        passes.setdefault(tuple(files), []).append(grouping)
+    accumulators = {}
+    for files, groupings in passes.items():
+        start_time = time.time()
+        accumulators.update(accumulate_parallel(files, groupings=groupings, variance=config['variance'],
+                                                workers=config['workers'], backend=config['backend'],
+                                                memory_limit=config['memory_limit'],
+                                                threads_per_worker=config['threads_per_worker'],
+                                                address_space_limit=config['address_space_limit']))
+        print(f'Accumulated {len(files)} files for {", ".join(groupings)}, '
+              f'took {round(time.time() - start_time)} seconds!')
+
+    written = []
+    for grouping, acc in accumulators.items():
+        saved = plans[grouping][1]
+        if saved is not None:
+            acc = ClimatologyAccumulator.from_dataset(xr.load_dataset(saved)).merge(acc)
+        climatology = acc.result()
+
+        # Fix longitudes to -180–180 if needed
+        if climatology.longitude.max() > 180:
+            climatology = climatology.assign_coords(longitude=((climatology.longitude + 180) % 360 - 180))
+
+        # Keep only seasons in correct order
+        if grouping == 'season':
+            climatology = climatology.sel(season=[s for s in SEASONS if s in climatology.season])
+
+        output_file = climatology_file(folder, grouping, product)
+        with stage('write', grouping=grouping):
+            with atomic_path(output_file) as tmp_path:
+                climatology.to_netcdf(tmp_path)
+            with atomic_path(state_file(folder, grouping, product)) as tmp_path:
+                acc.to_dataset().to_netcdf(tmp_path)
+        manifest.record(output_file, input_files, params=params)
+        manifest.record(state_file(folder, grouping, product), input_files, params=params)
+        written.append(output_file)
+
+        print(f"Saved {grouping} climatology → {output_file}"
+              f"{' (new files folded into the saved state)' if saved else ''}")
+    return written
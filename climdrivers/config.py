@@ -0,0 +1,186 @@
+"""Run configuration shared by the command line and the extraction scripts.
+
+Settings start from ``DEFAULTS``, are overridden by an optional JSON file and
+then by command-line options. Years and months are inclusive ranges or lists
+such as ``"2000-2024"`` or ``"2001,2003,2005-2007"``. Runs can be split into
+shards (``index/count``) so each task of a cluster array job takes its own
+slice of the years or months.
+"""
+import json
+import os
+
+from climdrivers.output import DEFAULT_CHUNKS
+from climdrivers.rechunk import TIMESERIES_CHUNKS
+from climdrivers.thermo import W_REF, T_THRESHOLD
+
+DEFAULTS = {
+    # Paths
+    'raw_folder': '/dx03/data/cockburn_era5/downloads',
+    'daily_folder': '/dx03/data/cockburn_era5/daily_data',
+    'output_folder': '/dx03/data/cockburn_era5',
+    'shapefile': '/home/ccockburn/natural_earth_shapefiles/ne_110m_admin_0_countries.shp',
+    'cache_folder': '/dx03/data/cockburn_era5/cache',
+    # Completed monthly tables and climatologies
+    'manifest': '/dx03/data/cockburn_era5/manifest.json',
+    # Completed daily files; None means manifest.json in daily_folder
+    'daily_manifest': None,
+
+    # Time slice
+    'years': '2000-2024',
+    'months': '1-12',
+
+    # Daily extraction
+    'products': ['temp', 'q', 'eld', 'dh'],
+    'W_ref': W_REF,
+    'T_threshold': T_THRESHOLD,
+    # Bases of the exact degree-hours in the 'dh' product (°C, kJ/kg)
+    'cdh_bases': [19],
+    'qdh_bases': [22],
+    # ELD sensitivity grid of the 'eldsweep' product (every W_ref with every T_threshold)
+    'sweep_W_refs': [0.0106, W_REF, 0.0126],
+    'sweep_T_thresholds': [24.6, T_THRESHOLD, 26.6],
+    'read_chunks': {'time': 'auto'},
+    'output_format': 'netcdf',
+    # Storage type of the daily fields: 'float32', or 'int16' to pack them
+    # with a fixed scale and offset (see climdrivers/output.py)
+    'dtype': 'float32',
+    'compression': 'zlib',
+    'complevel': 4,
+    'disk_chunks': dict(DEFAULT_CHUNKS),
+
+    # Time-series copies of the daily archive (see climdrivers/rechunk.py);
+    # None means 'timeseries' in daily_folder
+    'timeseries_folder': None,
+    'timeseries_chunks': dict(TIMESERIES_CHUNKS),
+    # Most memory one rechunk tile may take
+    'rechunk_memory': '2GB',
+
+    # Monthly country tables
+    'metrics': ['cdd', 'qdd', 'eld', 'cdh', 'qdh'],
+    't_bases': [19],
+    'q_bases': [22],
+    # 'point', 'area' or 'population'
+    'aggregation_mode': 'point',
+    # Population-count rasters (GeoTIFF/NetCDF) for 'population' mode: one path,
+    # or {year: path}, each month using the latest raster at or before its year
+    'population_rasters': {},
+    'population_variable': None,
+    # Spatial subset (see climdrivers/subset.py): skip cells outside every
+    # country, and/or limit a run to a box [lat_min, lat_max, lon_min, lon_max]
+    # or a list of countries. Box and country runs name their monthly outputs
+    # with 'region'; give them their own daily_folder too
+    'land_mask': False,
+    'bbox': None,
+    'countries': None,
+    'region': None,
+    # Most memory a month's daily data and degree days may take in the
+    # monthly pass (e.g. '4GB'); files are then read and reduced in latitude
+    # bands. None reads each file whole
+    'monthly_memory': None,
+    # Other polygon layers to aggregate over, from the same monthly cell
+    # statistics (see climdrivers/regions.py): {layer: {'shapefile': path,
+    # 'name_column': column, 'parents': [columns, innermost first]}}, e.g.
+    # {'states': {'shapefile': '.../ne_10m_admin_1_states_provinces.shp',
+    # 'name_column': 'name', 'parents': ['admin']}}
+    'region_layers': {},
+    # Parquet store the yearly tables are also written to (None to skip)
+    'panel_folder': '/dx03/data/cockburn_era5/panel',
+
+    # Climatologies
+    'climatology_product': 'eld',
+    # Base period; 'update' only folds in new daily files from these years
+    'climatology_years': '2001-2023',
+    # 'dayofyear' is also available, but holds 366 grids per variable
+    'groupings': ['season', 'month'],
+    'variance': False,
+
+    # Append mode (see climdrivers/update.py): raw files changed within the
+    # last settle_seconds are left for the next round; 'update --watch'
+    # checks for new downloads every watch_interval seconds
+    'settle_seconds': 300,
+    'watch_interval': 3600,
+
+    # Parallelism
+    'workers': 4,
+    'backend': 'process',
+    'threads_per_worker': 2,
+    # Resident memory per dask-backend worker, enforced by the dask nanny
+    'memory_limit': '32GB',
+    # Hard RLIMIT_AS cap per process-backend worker (None for none). It counts
+    # virtual memory, so set it well above the expected resident memory
+    'address_space_limit': None,
+
+    # Instrumentation (see climdrivers/instrument.py): JSON lines log of every
+    # stage, Prometheus textfile of the run's totals, and 'cprofile' or 'dask'
+    # profiles written to profile_folder (None means 'profiles' in output_folder)
+    'metrics_log': None,
+    'prometheus_file': None,
+    'profile': None,
+    'profile_folder': None,
+}
+
+
+def load_config(path=None, **overrides):
+    """Defaults updated from the JSON file at ``path`` and then from ``overrides``."""
+    config = dict(DEFAULTS)
+    updates = {}
+    if path is not None:
+        with open(path) as f:
+            updates.update(json.load(f))
+    updates.update({key: value for key, value in overrides.items() if value is not None})
+    unknown = sorted(set(updates) - set(DEFAULTS))
+    if unknown:
+        raise ValueError(f"unknown config keys: {', '.join(unknown)}")
+    config.update(updates)
+    if config['daily_manifest'] is None:
+        config['daily_manifest'] = os.path.join(config['daily_folder'], 'manifest.json')
+    return config
+
+
+def parse_range(spec):
+    """Sorted integers from ``"2000-2024"``, ``"1,3,5-7"``, an int or a list of either."""
+    if isinstance(spec, int):
+        return [spec]
+    if isinstance(spec, (list, tuple, range)):
+        return sorted({value for item in spec for value in parse_range(item)})
+    values = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part[1:]:
+            first, last = part.split('-', 1)
+            values.update(range(int(first), int(last) + 1))
+        else:
+            values.add(int(part))
+    return sorted(values)
+
+
+def parse_shard(spec):
+    """(index, count) from ``"index/count"`` (0-based) or ``"auto"`` (array job environment)."""
+    if spec is None:
+        return 0, 1
+    if spec == 'auto':
+        return shard_from_env()
+    index, count = (int(part) for part in spec.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"shard index must be in 0..{count - 1}, got {index}")
+    return index, count
+
+
+def shard_from_env():
+    """(index, count) of the current SLURM or SGE array task; (0, 1) outside an array job."""
+    env = os.environ
+    if 'SLURM_ARRAY_TASK_ID' in env:
+        first = int(env.get('SLURM_ARRAY_TASK_MIN', 0))
+        return int(env['SLURM_ARRAY_TASK_ID']) - first, int(env['SLURM_ARRAY_TASK_COUNT'])
+    if env.get('SGE_TASK_ID', 'undefined') != 'undefined':
+        first, last = int(env['SGE_TASK_FIRST']), int(env['SGE_TASK_LAST'])
+        step = int(env.get('SGE_TASK_STEPSIZE', 1))
+        return (int(env['SGE_TASK_ID']) - first) // step, (last - first) // step + 1
+    return 0, 1
+
+
+def shard(units, index, count):
+    """Every ``count``-th unit starting at ``index``, so shards interleave years evenly."""
+    return list(units)[index::count]
@@ -0,0 +1,59 @@
+"""Country-name crosswalk to ISO 3166 alpha-3 codes.
+
+The monthly panels use Natural Earth ``ADMIN`` names, the World Bank exports
+their own names (with ISO codes alongside) and AC_saturation.csv mostly
+follows Natural Earth. Codes from the World Bank files cover most names;
+``ALIASES`` covers the spellings that differ and territories the World Bank
+does not report.
+"""
+import pandas as pd
+
+# Natural Earth / AC_saturation name -> ISO alpha-3 (or Natural Earth's ADM0_A3
+# where there is no ISO code)
+ALIASES = {
+    'Antarctica': 'ATA',
+    'Brunei': 'BRN',
+    'Democratic Republic of the Congo': 'COD',
+    'East Timor': 'TLS',
+    'Falkland Islands': 'FLK',
+    'French Southern and Antarctic Lands': 'ATF',
+    'Gambia': 'GMB',
+    'Ivory Coast': 'CIV',
+    'Laos': 'LAO',
+    'North Korea': 'PRK',
+    'Northern Cyprus': 'CYN',
+    'Palestine': 'PSE',
+    'Republic of the Congo': 'COG',
+    'Somaliland': 'SOL',
+    'Syria': 'SYR',
+    'Taiwan': 'TWN',
+    'The Bahamas': 'BHS',
+    'United Republic of Tanzania': 'TZA',
+    'Venezuela': 'VEN',
+    'Western Sahara': 'ESH',
+    'Yemen': 'YEM',
+    'eSwatini': 'SWZ',
+}
+
+
+def crosswalk(*frames):
+    """Name -> code lookup from ``ALIASES`` and any (name, code) DataFrames given.
+
+    Each frame needs ``name`` and ``code`` columns, e.g. the distinct pairs
+    of a World Bank export.
+    """
+    lookup = {}
+    for frame in frames:
+        lookup.update(zip(frame['name'], frame['code']))
+    lookup.update(ALIASES)
+    return lookup
+
+
+def to_codes(names, lookup):
+    """Codes for a Series of names; raises ``KeyError`` listing any name without one."""
+    names = pd.Series(names)
+    unique = pd.Series(names.unique())
+    missing = sorted(str(name) for name in unique[~unique.isin(list(lookup))])
+    if missing:
+        raise KeyError(f"no country code for: {', '.join(missing)}")
+    return names.map(lookup)
@@ -0,0 +1,373 @@
+"""Grid-to-country index for aggregating ERA5 fields over country polygons.
+
+The ERA5 grid never changes between months, so the point-in-polygon join
+against the country shapefile is done once per (grid, shapefile) pair and
+cached on disk. Each monthly aggregation is then an ``np.bincount`` over the
+flattened field instead of a Point/sjoin pass.
+
+Three aggregation modes are supported:
+
+* ``'point'`` -- a cell belongs to every country its centre intersects and all
+  cells count equally. This reproduces the original sjoin + groupby output.
+* ``'area'`` -- every cell contributes to each country it overlaps, weighted
+  by the overlapping fraction of the cell times cos(latitude). Small
+  countries that contain no cell centre are still covered.
+* ``'population'`` -- the area-mode overlaps, with means weighted by the
+  overlapping fraction times the cell's population (see
+  ``climdrivers.population``). Sums still use the overlap fraction only.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+AGGREGATION_MODES = ('point', 'area', 'population')
+
+
+def convert_longitudes(lon):
+    """Convert longitudes from 0-360 to -180-180."""
+    return (lon + 180) % 360 - 180
+
+
+def grid_hash(lat_values, lon_values):
+    """Hash of the grid coordinates, used as part of the cache key."""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(lat_values, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(lon_values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def shapefile_hash(shapefile_path):
+    """Hash of a shapefile and its sidecar files (.shx, .dbf, .prj, ...)."""
+    h = hashlib.sha1()
+    folder = os.path.dirname(os.path.abspath(shapefile_path))
+    stem = os.path.splitext(os.path.basename(shapefile_path))[0]
+    for name in sorted(os.listdir(folder)):
+        if os.path.splitext(name)[0] == stem:
+            h.update(name.encode())
+            with open(os.path.join(folder, name), 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+class CountryIndex:
+    """Sparse cell -> country weights for one grid.
+
+    The index is stored as coordinate triplets: ``cells`` holds flat
+    (row-major over lat, lon) grid-cell positions, ``codes`` the position of
+    the matching country in ``names``, ``fractions`` the share of the cell
+    that lies in the country and ``weights`` the weight used for means. In
+    point mode both are 1 and a cell centre lying on a shared border appears
+    once per country, exactly as it did in the old
+    ``sjoin(..., op='intersects')``. ``names`` is sorted, so aggregated output
+    comes out in the same order as the old ``groupby(['Date', 'Country'])``.
+    """
+
+    def __init__(self, cells, codes, names, shape, fractions=None, weights=None):
+        self.cells = np.asarray(cells, dtype=np.int64)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.names = np.asarray(names, dtype=object)
+        self.shape = tuple(int(n) for n in shape)
+        if fractions is None:
+            fractions = np.ones(len(self.cells))
+        if weights is None:
+            weights = fractions
+        self.fractions = np.asarray(fractions, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    @property
+    def n_countries(self):
+        return len(self.names)
+
+    def _flat(self, field):
+        """``field`` with its last two (grid) axes flattened."""
+        field = np.asarray(field, dtype=np.float64)
+        if field.shape[-2:] != self.shape:
+            raise ValueError(f"field shape {field.shape} does not match grid {self.shape}")
+        return field.reshape(field.shape[:-2] + (-1,))
+
+    def reduce(self, field, weighted=True):
+        """Per-country (weighted sum, total weight) of a field, skipping NaN cells.
+
+        The last two axes of ``field`` are the grid; any leading axes (e.g. a
+        parameter sweep) are kept in front of the country axis. With
+        ``weighted=False`` cells are weighted by their overlap fraction only,
+        which is what country sums use.
+        """
+        values = self._flat(field)[..., self.cells]
+        leading = values.shape[:-1]
+        values = values.reshape(int(np.prod(leading)), len(self.cells))
+        valid = ~np.isnan(values)
+        w = np.broadcast_to(self.weights if weighted else self.fractions, values.shape)[valid]
+        # One bincount for all leading entries: entry i counts into countries i*n .. i*n + n-1
+        codes = (self.codes + self.n_countries * np.arange(len(values))[:, None])[valid]
+        size = len(values) * self.n_countries
+        sums = np.bincount(codes, weights=values[valid] * w, minlength=size)
+        totals = np.bincount(codes, weights=w, minlength=size)
+        return sums.reshape(leading + (-1,)), totals.reshape(leading + (-1,))
+
+    def cell_counts(self):
+        """Number of grid cells (fractional in area mode) assigned to each country."""
+        return np.bincount(self.codes, weights=self.fractions, minlength=self.n_countries)
+
+    def aggregate(self, date, columns):
+        """Country-level DataFrame from a list of ``(column, field, how)`` tuples.
+
+        ``how`` is ``'mean'`` or ``'sum'``. Countries that contain no grid cell
+        are dropped, as they were by the old sjoin + groupby. Fields may be
+        DataArrays with dimensions besides latitude and longitude (e.g.
+        ``W_ref`` and ``T_threshold`` of an ELD sweep). There is then one row
+        per country and combination of their coordinates, with a column per
+        dimension.
+        """
+        sums = CountrySums([(column, how) for column, _, how in columns])
+        sums.add(self, [field for _, field, _ in columns])
+        return sums.frame(date)
+
+    def weighted_by(self, cell_weights):
+        """Copy of the index whose means are weighted by overlap fraction times ``cell_weights``.
+
+        ``cell_weights`` is a grid-shaped array such as population counts.
+        """
+        weights = self.fractions * self._flat(cell_weights)[self.cells]
+        return CountryIndex(self.cells, self.codes, self.names, self.shape,
+                            fractions=self.fractions, weights=weights)
+
+    def cell_mask(self):
+        """Boolean grid of the cells that belong to at least one country."""
+        mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        mask[self.cells] = True
+        return mask.reshape(self.shape)
+
+    def restrict(self, names):
+        """Copy of the index holding only the countries in ``names``; raises ``KeyError`` for unknown names."""
+        missing = sorted(set(names) - set(self.names))
+        if missing:
+            raise KeyError(f"countries not in the index: {', '.join(missing)}")
+        keep_names = np.array(sorted(set(names)), dtype=object)
+        keep = np.isin(self.names[self.codes], keep_names)
+        codes = np.searchsorted(keep_names, self.names[self.codes[keep]])
+        return CountryIndex(self.cells[keep], codes, keep_names, self.shape,
+                            fractions=self.fractions[keep], weights=self.weights[keep])
+
+    def rollup(self, parent_of):
+        """Index of parent regions: every cell counts toward the parent (``parent_of[name]``) of its region.
+
+        Cells and weights are unchanged, so a parent's mean is the weighted
+        mean over the cells of all its regions.
+        """
+        parent_names = np.array([parent_of[name] for name in self.names], dtype=object)
+        parents = np.array(sorted(set(parent_names)), dtype=object)
+        codes = np.searchsorted(parents, parent_names)[self.codes]
+        return CountryIndex(self.cells, codes, parents, self.shape,
+                            fractions=self.fractions, weights=self.weights)
+
+    def crop(self, rows, cols, mask=None):
+        """Index for the window ``rows`` x ``cols`` of the grid, dropping cells outside it.
+
+        ``mask`` (window-shaped) also drops cells inside the window that are
+        not needed.
+        """
+        row_pos = np.full(self.shape[0], -1)
+        row_pos[rows] = np.arange(len(rows))
+        col_pos = np.full(self.shape[1], -1)
+        col_pos[cols] = np.arange(len(cols))
+        r, c = row_pos[self.cells // self.shape[1]], col_pos[self.cells % self.shape[1]]
+        keep = (r >= 0) & (c >= 0)
+        if mask is not None:
+            keep[keep] = mask[r[keep], c[keep]]
+        cells = r[keep] * len(cols) + c[keep]
+        return CountryIndex(cells, self.codes[keep], self.names, (len(rows), len(cols)),
+                            fractions=self.fractions[keep], weights=self.weights[keep])
+
+    def save(self, path):
+        """Write the index to a compressed .npz file."""
+        from climdrivers.manifest import atomic_path
+
+        # A unique temporary name, so workers building the same index at once do not collide
+        with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, cells=self.cells, codes=self.codes,
+                                names=self.names.astype(str), shape=np.asarray(self.shape),
+                                fractions=self.fractions, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['cells'], data['codes'], data['names'].astype(object), data['shape'],
+                       fractions=data['fractions'], weights=data['weights'])
+
+
+class CountrySums:
+    """Running per-country sums of ``(column, how)`` columns, added up part of the grid at a time.
+
+    Each ``add`` takes the fields of one part of the grid (e.g. a latitude
+    band) with the index cropped to it. Means are only divided out in
+    ``frame``, so a month processed band by band gives the same table as one
+    processed whole, up to the order of the additions. Every part must come
+    from the same index (same names and extra dimensions).
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.names = None
+        self.extra = None
+        self.counts = None
+        self.sums = []
+
+    def add(self, index, fields):
+        """Add the reductions of ``fields`` (one per column) over the cells of ``index``."""
+        fields, extra = _extra_dims_first(fields)
+        if self.names is None:
+            self.names, self.extra = index.names, extra
+            self.counts = np.zeros(index.n_countries)
+            self.sums = [None] * len(self.columns)
+        self.counts += index.cell_counts()
+        for i, ((_, how), field) in enumerate(zip(self.columns, fields)):
+            if how not in ('mean', 'sum'):
+                raise ValueError(f"unknown aggregation '{how}'")
+            # Sums use overlap fractions only; means are weighted (see CountryIndex.reduce)
+            part = index.reduce(field, weighted=how == 'mean')
+            self.sums[i] = part if self.sums[i] is None else (self.sums[i][0] + part[0],
+                                                               self.sums[i][1] + part[1])
+
+    def frame(self, date):
+        """Country-level DataFrame of everything added so far, as ``CountryIndex.aggregate`` makes it."""
+        present = self.counts > 0
+        combinations = int(np.prod([len(values) for _, values in self.extra]))
+        data = {'Date': pd.Timestamp(date), 'Country': np.repeat(self.names[present], combinations)}
+        grids = np.meshgrid(*(values for _, values in self.extra), indexing='ij')
+        for (dim, _), grid in zip(self.extra, grids):
+            data[dim] = np.tile(grid.ravel(), int(present.sum()))
+        for (column, how), (sums, totals) in zip(self.columns, self.sums):
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = sums / totals
+            else:
+                values = sums
+            # Country-major rows: each country's combinations together
+            data[column] = values.reshape(combinations, -1)[:, present].T.ravel()
+        return pd.DataFrame(data)
+
+
+def _extra_dims_first(fields):
+    """Fields as arrays with dimensions besides latitude/longitude first, and [(dim, values)] of those.
+
+    DataArray fields are broadcast against each other, so a field without a
+    swept dimension repeats along it. Plain arrays must be 2-D.
+    """
+    if not any(hasattr(field, 'dims') for field in fields):
+        return fields, []
+    import xarray as xr
+
+    broadcast = xr.broadcast(*fields)
+    extra = [dim for dim in broadcast[0].dims if dim not in ('latitude', 'longitude')]
+    arrays = [da.transpose(*extra, 'latitude', 'longitude').values for da in broadcast]
+    return arrays, [(dim, broadcast[0][dim].values) for dim in extra]
+
+
+def cell_edges(values):
+    """Lower and upper edges of regularly spaced cells centred on ``values``."""
+    step = abs(values[1] - values[0]) if len(values) > 1 else 1.0
+    return values - step / 2, values + step / 2
+
+
+def _point_pairs(lat_values, lon_values, countries, name_column):
+    """(cell, name) pairs for every cell centre that intersects a country."""
+    lon2d, lat2d = np.meshgrid(lon_values, lat_values)
+    cells = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon2d.ravel(), lat2d.ravel()),
+                             crs=countries.crs)
+    joined = gpd.sjoin(cells, countries[[name_column, 'geometry']], how='inner',
+                       predicate='intersects')
+    joined = joined.dropna(subset=[name_column])
+    return joined.index.values, joined[name_column].values, np.ones(len(joined))
+
+
+def _area_pairs(lat_values, lon_values, countries, name_column):
+    """(cell, name, overlap fraction) for every cell that overlaps a country."""
+    lat_lo, lat_hi = (np.clip(e, -90, 90) for e in cell_edges(lat_values))
+    lon_lo, lon_hi = cell_edges(lon_values)
+    lon_lo2d, lat_lo2d = np.meshgrid(lon_lo, lat_lo)
+    lon_hi2d, lat_hi2d = np.meshgrid(lon_hi, lat_hi)
+    boxes = shapely.box(lon_lo2d.ravel(), np.minimum(lat_lo2d, lat_hi2d).ravel(),
+                        lon_hi2d.ravel(), np.maximum(lat_lo2d, lat_hi2d).ravel())
+    cell_area = shapely.area(boxes)
+    tree = shapely.STRtree(boxes)
+
+    cells, names, fractions = [], [], []
+    for name, geom in zip(countries[name_column], countries.geometry):
+        if geom is None or pd.isna(name):
+            continue
+        hits = tree.query(geom, predicate='intersects')
+        overlap = shapely.area(shapely.intersection(boxes[hits], geom))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(cell_area[hits] > 0, overlap / cell_area[hits], 0.0)
+        keep = fraction > 0
+        cells.append(hits[keep])
+        names.append(np.full(keep.sum(), name, dtype=object))
+        fractions.append(fraction[keep])
+
+    if not cells:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0)
+    return np.concatenate(cells), np.concatenate(names), np.concatenate(fractions)
+
+
+def build_country_index(lat_values, lon_values, countries, name_column='ADMIN', mode='point'):
+    """Build the cell -> country index for a grid.
+
+    Longitudes may be given on 0-360; they are converted to -180-180 before
+    the join, as the monthly scripts did. See the module docstring for
+    ``mode``.
+    """
+    if mode not in AGGREGATION_MODES:
+        raise ValueError(f"unknown aggregation mode '{mode}', expected one of {AGGREGATION_MODES}")
+    lat_values = np.asarray(lat_values, dtype=np.float64)
+    lon_values = convert_longitudes(np.asarray(lon_values, dtype=np.float64))
+    shape = (len(lat_values), len(lon_values))
+
+    if mode == 'population':
+        raise ValueError("build the 'area' index and apply population with CountryIndex.weighted_by")
+    if mode == 'point':
+        cells, cell_names, fractions = _point_pairs(lat_values, lon_values, countries, name_column)
+        weights = fractions
+    else:
+        cells, cell_names, fractions = _area_pairs(lat_values, lon_values, countries, name_column)
+        cell_lat = lat_values[cells // shape[1]]
+        weights = fractions * np.clip(np.cos(np.deg2rad(cell_lat)), 0, None)
+
+    names = np.array(sorted(set(cell_names)), dtype=object)
+    codes = np.searchsorted(names, cell_names)
+    return CountryIndex(cells, codes, names, shape, fractions=fractions, weights=weights)
+
+
+def load_country_index(lat_values, lon_values, shapefile_path, cache_dir,
+                       name_column='ADMIN', mode='point', population=None):
+    """Return the cached index for this grid, shapefile and mode, building it if needed.
+
+    Population mode needs ``population`` on the same grid. It reuses the
+    cached area index and only recomputes the weights.
+    """
+    if mode == 'population':
+        if population is None:
+            raise ValueError("population mode needs a population grid")
+        index = load_country_index(lat_values, lon_values, shapefile_path, cache_dir,
+                                   name_column=name_column, mode='area')
+        return index.weighted_by(population)
+
+    key = hashlib.sha1(
+        f"{grid_hash(lat_values, lon_values)}:{shapefile_hash(shapefile_path)}:{name_column}:{mode}".encode()
+    ).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f"country_index_{mode}_{key}.npz")
+
+    if os.path.exists(cache_file):
+        return CountryIndex.load(cache_file)
+
+    countries = gpd.read_file(shapefile_path)
+    index = build_country_index(lat_values, lon_values, countries, name_column=name_column, mode=mode)
+    os.makedirs(cache_dir, exist_ok=True)
+    index.save(cache_file)
+    print(f"Built {mode} country index for {index.n_countries} countries → {cache_file}")
+    return index
@@ -0,0 +1,253 @@
+"""Fused daily extraction from hourly ERA5 temperature and dew point.
+
+Each monthly ``2t``/``2d`` file pair is opened once and every daily product
+(temperature, moist enthalpy, ELD, heat stress) is built from one dask graph.
+The hourly variables come from the ``climdrivers.derived`` registry, so the
+Kelvin conversion, vapor pressure, humidity ratio and enthalpy are computed
+a single time and the hourly data is read in a single pass. The ``eldsweep`` product adds
+ELD for a whole grid of (W_ref, T_threshold) values to that same pass.
+"""
+import os
+import re
+from functools import partial
+
+import numpy as np
+import xarray as xr
+
+from climdrivers.derived import DAILY, HourlyFields
+from climdrivers.instrument import count, stage
+from climdrivers.output import DEFAULT_CHUNKS, FORMATS, write_datasets
+from climdrivers.thermo import W_REF, T_THRESHOLD, calculate_enthalpy, kelvin_to_celsius
+
+# product name (as used in era5_daily_{product}_{year}_{month}.nc) -> variables
+PRODUCTS = {
+    'temp': ['T_mean', 'T_min', 'T_max'],
+    'q': ['Q_mean', 'Q_min', 'Q_max'],
+    'eld': ['ELD', 'Q_mean', 'Q_min', 'Q_max', 'Qb_mean'],
+    # Heat stress: relative humidity, heat index, wet-bulb temperature and humidex
+    'heat': ['RH_mean', 'RH_min', 'HI_mean', 'HI_max', 'Tw_mean', 'Tw_max', 'humidex_max'],
+    'dh': ['CDH', 'QDH'],
+    # ELD sensitivity sweep, along W_ref and T_threshold dimensions
+    'eldsweep': ['ELD_sweep', 'Qb_sweep', 'Q_mean'],
+}
+# Products built by default; 'eldsweep' also needs its sweep grid
+STANDARD_PRODUCTS = tuple(product for product in PRODUCTS if product != 'eldsweep')
+
+
+def temp_file_for(dew_file):
+    """Name of the 2 m temperature file paired with a dew point file."""
+    return dew_file.replace("2d", "2t").replace("168", "167")
+
+
+def file_year_month(file):
+    """(year, month) strings from the YYYYMMDD stamp in an ERA5 filename."""
+    match = re.search(r'(\d{4})(\d{2})\d{2}', file)
+    if match is None:
+        raise ValueError(f"no YYYYMMDD date in {file}")
+    return match.groups()
+
+
+def daily_output_path(output_folder, product, year, month, fmt='netcdf'):
+    """Path of a daily product file in the output folder."""
+    return os.path.join(output_folder, f"era5_daily_{product}_{year}_{int(month):02d}{FORMATS[fmt]}")
+
+
+def daily_outputs(dew_path, output_folder, products=STANDARD_PRODUCTS, fmt='netcdf'):
+    """Paths of the daily product files built from one hourly file pair."""
+    year, month = file_year_month(os.path.basename(dew_path))
+    return [daily_output_path(output_folder, product, year, month, fmt) for product in products]
+
+
+def degree_hours(hourly, bases, dim):
+    """Daily sums of hourly exceedances of each base, stacked along ``dim``."""
+    daily = [(hourly - base).clip(min=0).resample(time="1D").sum() for base in bases]
+    return xr.concat(daily, dim=dim).assign_coords({dim: [float(b) for b in bases]}).transpose('time', dim, ...)
+
+
+def parameter(values, dim, dtype):
+    """Swept values as a ``dim`` coordinate, one dask chunk per value.
+
+    The data takes the hourly fields' dtype, so each sweep entry is computed
+    exactly like the single-value product.
+    """
+    values = [float(v) for v in values]
+    return xr.DataArray(np.asarray(values, dtype=dtype), dims=dim, coords={dim: values}).chunk({dim: 1})
+
+
+def eld_sweep(T, Q, W_refs, T_thresholds):
+    """Daily ELD (W_ref x T_threshold) and mean Qb (W_ref) from hourly T and Q.
+
+    The parameters broadcast block by block, one value per chunk, so memory
+    per task is the same as for a single ELD.
+    """
+    W_ref = parameter(W_refs, 'W_ref', T.dtype)
+    T_threshold = parameter(T_thresholds, 'T_threshold', T.dtype)
+    Qb = calculate_enthalpy(T, W_ref)
+    Q_diff = (Q - Qb).where((T > T_threshold) & (Q > Qb), 0)
+    ELD = (Q_diff.resample(time="1D").sum() / 24).transpose('time', 'W_ref', 'T_threshold', ...)
+    return ELD, Qb.resample(time="1D").mean().transpose('time', 'W_ref', ...)
+
+
+def daily_fields(T, Td, W_ref=W_REF, T_threshold=T_THRESHOLD, cdh_bases=(), qdh_bases=(), sweep=None,
+                 fields=None):
+    """Lazy daily fields from hourly temperature and dew point in °C.
+
+    ``fields`` names the ``climdrivers.derived.DAILY`` fields to build (by
+    default those of the temp, q and eld products). With
+    ``cdh_bases``/``qdh_bases``, exact cooling degree-hours (°C h) and
+    enthalpy degree-hours (kJ/kg h) above each base are added from the same
+    hourly fields, so they cost no extra read. ``sweep`` (W_ref values,
+    T_threshold values) adds ``ELD_sweep`` and ``Qb_sweep`` in the same way.
+    """
+    hourly = HourlyFields(T, Td, W_ref=W_ref, T_threshold=T_threshold)
+    if fields is None:
+        fields = [name for product in ('temp', 'q', 'eld') for name in PRODUCTS[product]]
+    daily = xr.Dataset(hourly.daily(list(dict.fromkeys(fields))))
+    if len(cdh_bases):
+        daily["CDH"] = degree_hours(hourly['T'], cdh_bases, 'cdh_base')
+        daily["CDH"].attrs['units'] = 'degC h'
+    if len(qdh_bases):
+        daily["QDH"] = degree_hours(hourly['Q'], qdh_bases, 'qdh_base')
+        daily["QDH"].attrs['units'] = 'kJ/kg h'
+    if sweep is not None:
+        daily["ELD_sweep"], daily["Qb_sweep"] = eld_sweep(hourly['T'], hourly['Q'], *sweep)
+    return daily
+
+
+def open_month(dew_path, temp_path, chunks=None):
+    """Open an hourly file pair lazily; returns (T, Td) in °C."""
+    chunks = chunks or {"time": "auto"}
+    ds_dew = xr.open_dataset(dew_path, chunks=chunks)
+    ds_temp = xr.open_dataset(temp_path, chunks=chunks)
+    return kelvin_to_celsius(ds_temp["VAR_2T"]), kelvin_to_celsius(ds_dew["VAR_2D"])
+
+
+def spatial_read_chunks(path, name, disk_chunks=None):
+    """Latitude/longitude read blocks made of whole stored chunks, close to the output chunk shape.
+
+    A block that cut through stored chunks would decompress them once per
+    block. Files stored as one chunk per field can therefore only be read
+    whole.
+    """
+    with xr.open_dataset(path) as ds:
+        stored = dict(zip(ds[name].dims, ds[name].encoding.get('chunksizes') or ds[name].shape))
+    target = disk_chunks or DEFAULT_CHUNKS
+    return {dim: stored[dim] * max(1, round(target.get(dim, stored[dim]) / stored[dim]))
+            for dim in ('latitude', 'longitude')}
+
+
+def process_month(dew_path, temp_path, output_folder, products=STANDARD_PRODUCTS, chunks=None,
+                  fmt='netcdf', W_ref=W_REF, T_threshold=T_THRESHOLD, cdh_bases=(), qdh_bases=(),
+                  disk_chunks=None, subset=None, sweep=None, **write_options):
+    """Compute and write the requested daily products for one month in one pass.
+
+    ``chunks`` is the dask chunking used to read the hourly files and
+    ``disk_chunks`` the chunk shape on disk; ``write_options`` (dtype,
+    compression, complevel) are passed to ``climdrivers.output.write_datasets``. Files are written under
+    temporary names and renamed once complete, so an interrupted run never
+    leaves a truncated product behind. With a ``climdrivers.subset.SpatialSubset``
+    only its window is read, blocks without a needed cell are skipped and
+    other cells are stored as NaN. ``sweep`` is the (W_ref values,
+    T_threshold values) grid of the ``eldsweep`` product, which needs one.
+    """
+    if 'eldsweep' in products and sweep is None:
+        raise ValueError("the 'eldsweep' product needs a sweep grid (W_ref values, T_threshold values)")
+    if subset is not None:
+        # Read in spatial blocks, so blocks without a needed cell can be skipped
+        chunks = {**spatial_read_chunks(temp_path, 'VAR_2T', disk_chunks), **(chunks or {"time": "auto"})}
+    with stage('open'):
+        T, Td = open_month(dew_path, temp_path, chunks=chunks)
+        if subset is not None:
+            T, Td = subset.crop(T), subset.crop(Td)
+    # Only the registry fields some requested product holds are built
+    fields = [name for product in products for name in PRODUCTS[product] if name in DAILY]
+    daily = daily_fields(T, Td, W_ref=W_ref, T_threshold=T_threshold, cdh_bases=cdh_bases,
+                         qdh_bases=qdh_bases, sweep=sweep if 'eldsweep' in products else None,
+                         fields=fields)
+    if subset is not None:
+        daily = subset.mask_dataset(daily)
+
+    datasets = [daily[[name for name in PRODUCTS[product] if name in daily]] for product in products]
+    paths = daily_outputs(dew_path, output_folder, products, fmt)
+
+    # One compute for all products, so shared intermediates are evaluated once; reading,
+    # resampling and writing all happen here (the stage's dask task times tell them apart)
+    with stage('write'):
+        written = write_datasets(datasets, paths, fmt=fmt, chunks=disk_chunks, **write_options)
+    count('months_computed')
+    count('files_written', len(written))
+    return written
+
+
+def run_daily(config, months):
+    """Write the configured daily products for the (year, month) pairs in ``months``.
+
+    Months whose inputs and outputs are unchanged since the last run (per the
+    daily manifest) are skipped; the rest are spread over the configured
+    workers.
+    """
+    from climdrivers.manifest import Manifest
+    from climdrivers.scheduler import month_file_pairs, run_tasks
+    from climdrivers.subset import spatial_subset, subset_settings
+
+    products = config['products']
+    fmt = config['output_format']
+    output_folder = config['daily_folder']
+    manifest = Manifest(config['daily_manifest'])
+
+    def params_for(product):
+        """Settings recorded with a product; only non-default ones, so existing entries stay valid."""
+        params = {}
+        if product == 'eld' and (config['W_ref'], config['T_threshold']) != (W_REF, T_THRESHOLD):
+            params.update(W_ref=config['W_ref'], T_threshold=config['T_threshold'])
+        if product == 'dh':
+            params.update(cdh_bases=list(config['cdh_bases']), qdh_bases=list(config['qdh_bases']))
+        if product == 'eldsweep':
+            params.update(W_refs=list(config['sweep_W_refs']),
+                          T_thresholds=list(config['sweep_T_thresholds']))
+        if config['dtype'] != 'float32':
+            params['dtype'] = config['dtype']
+        if subset_settings(config):
+            params['subset'] = subset_settings(config)
+        return params or None
+
+    wanted = {(int(year), int(month)) for year, month in months}
+    pairs = [args for args in month_file_pairs(config['raw_folder'], sorted({y for y, _ in wanted}))
+             if tuple(int(v) for v in file_year_month(os.path.basename(args[0]))) in wanted]
+
+    # Cells to compute (None for the whole grid), from the hourly files' grid
+    subset = None
+    if subset_settings(config) and pairs:
+        with xr.open_dataset(pairs[0][0]) as ds:
+            subset = spatial_subset(config, ds['latitude'].values, ds['longitude'].values)
+        print(f"Computing {subset.n_cells} cells in a {len(subset.lat)} x {len(subset.lon)} window")
+
+    def stale_products(dew_path, temp_path):
+        outputs = daily_outputs(dew_path, output_folder, products, fmt)
+        return [product for product, output in zip(products, outputs)
+                if not manifest.is_current(output, [dew_path, temp_path], params=params_for(product))]
+
+    def record(args, output_files):
+        dew_path, temp_path, _, task_products = args
+        for product, output in zip(task_products, output_files):
+            manifest.record(output, [dew_path, temp_path], params=params_for(product))
+
+    # Each month only rebuilds the products that are missing or out of date
+    tasks = []
+    for dew_path, temp_path in pairs:
+        stale = stale_products(dew_path, temp_path)
+        if stale:
+            tasks.append((dew_path, temp_path, output_folder, stale))
+    print(f"Processing {len(tasks)} months on {config['workers']} {config['backend']} workers "
+          f"({len(pairs) - len(tasks)} already up to date)...")
+
+    # Each task reads its 2t/2d pair once and writes its products from one graph
+    run_tasks(partial(process_month, chunks=config['read_chunks'], fmt=fmt, W_ref=config['W_ref'],
+                      T_threshold=config['T_threshold'], cdh_bases=config['cdh_bases'],
+                      qdh_bases=config['qdh_bases'], dtype=config['dtype'],
+                      compression=config['compression'], complevel=config['complevel'],
+                      disk_chunks=config['disk_chunks'], subset=subset,
+                      sweep=(config['sweep_W_refs'], config['sweep_T_thresholds'])),
+              tasks, workers=config['workers'], backend=config['backend'],
+              memory_limit=config['memory_limit'], threads_per_worker=config['threads_per_worker'],
+              address_space_limit=config['address_space_limit'], on_done=record)
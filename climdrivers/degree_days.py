@@ -0,0 +1,97 @@
+"""Degree-day kernel shared by the CDD and QDD extractions.
+
+Daily degree days from daily max/mean/min use the four-branch Spangler /
+UK Met Office approximation that ``calculate_cdd`` and ``calculate_qdd``
+implemented with boolean masks:
+
+* max <= base                 -> 0
+* mean <= base < max          -> (max - base) / 4
+* min < base < mean           -> (max - base) / 2 - (base - min) / 4
+* min >= base                 -> mean - base
+
+The kernel evaluates the branches per element in a single pass. With numba
+installed it is a compiled ufunc; otherwise ``np.select`` runs over
+fixed-size blocks and writes into the preallocated output, so temporaries
+stay bounded. Several base temperatures can be evaluated from one read of
+the inputs.
+"""
+import numpy as np
+import xarray as xr
+
+try:
+    from numba import vectorize
+except ImportError:  # numba is optional
+    vectorize = None
+
+# Elements per block in the NumPy fallback
+BLOCK_SIZE = 1 << 20
+
+
+def _degree_day(t_max, t_mean, t_min, base):
+    if t_min >= base:
+        return t_mean - base
+    if t_min < base < t_mean:
+        return (t_max - base) / 2 - (base - t_min) / 4
+    if t_mean <= base < t_max:
+        return (t_max - base) / 4
+    return 0.0  # no branch applies, e.g. NaN inputs
+
+
+if vectorize is not None:
+    _degree_day_ufunc = vectorize(['float32(float32, float32, float32, float32)',
+                                   'float64(float64, float64, float64, float64)'],
+                                  nopython=True, cache=True)(_degree_day)
+else:
+    _degree_day_ufunc = None
+
+
+def _degree_days_numpy(t_max, t_mean, t_min, base, out):
+    """Blocked ``np.select`` fallback writing into ``out``."""
+    flat_out = out.reshape(-1)
+    flat_max, flat_mean, flat_min = (a.reshape(-1) for a in (t_max, t_mean, t_min))
+    for start in range(0, flat_out.size, BLOCK_SIZE):
+        sl = slice(start, start + BLOCK_SIZE)
+        mx, me, mn = flat_max[sl], flat_mean[sl], flat_min[sl]
+        flat_out[sl] = np.select(
+            [mn >= base, (mn < base) & (base < me), (me <= base) & (base < mx)],
+            [me - base, (mx - base) / 2 - (base - mn) / 4, (mx - base) / 4],
+            0,
+        )
+    return out
+
+
+def degree_days(t_max, t_mean, t_min, base=19):
+    """Daily degree days above ``base``.
+
+    ``base`` may be a scalar (result has the input shape) or a sequence of
+    base temperatures (result gets a new leading axis, one slice per base).
+    """
+    t_max, t_mean, t_min = np.broadcast_arrays(*(np.asarray(a) for a in (t_max, t_mean, t_min)))
+    dtype = np.result_type(t_max, t_mean, t_min, np.float32)
+    t_max, t_mean, t_min = (np.ascontiguousarray(a, dtype=dtype) for a in (t_max, t_mean, t_min))
+
+    bases = np.atleast_1d(np.asarray(base, dtype=dtype))
+    out = np.empty((len(bases),) + t_max.shape, dtype=dtype)
+    for i, b in enumerate(bases):
+        if _degree_day_ufunc is not None:
+            _degree_day_ufunc(t_max, t_mean, t_min, b, out=out[i])
+        else:
+            _degree_days_numpy(t_max, t_mean, t_min, b, out[i])
+    return out[0] if np.ndim(base) == 0 else out
+
+
+def degree_days_dataarray(t_max, t_mean, t_min, bases):
+    """Degree days for each of ``bases`` as a DataArray with a trailing ``base`` dimension.
+
+    Works on dask-backed inputs block by block.
+    """
+    bases = [float(b) for b in np.atleast_1d(bases)]
+    out = xr.apply_ufunc(
+        lambda mx, me, mn: np.moveaxis(degree_days(mx, me, mn, bases), 0, -1),
+        t_max, t_mean, t_min,
+        output_core_dims=[['base']],
+        dask='parallelized',
+        dask_gufunc_kwargs={'output_sizes': {'base': len(bases)}},
+        output_dtypes=[np.result_type(t_max.dtype, np.float32)],
+    )
+    return out.assign_coords(base=bases)
@@ -0,0 +1,149 @@
+"""Registry of variables derived from hourly 2 m temperature and dew point.
+
+Every hourly variable declares the variables it is computed from, and the
+parameters it takes (``W_ref``, ``T_threshold``, ``P``), in ``HOURLY``.
+``HourlyFields`` builds a month's variables lazily on first request and
+keeps each one, so a shared subexpression is a single node of the dask
+graph. Vapor pressure, for instance, feeds W, Q, RH and humidex but is
+computed once per chunk. Daily fields (``DAILY``) are an hourly variable
+plus a reduction over each day. They are what the daily products are made
+of, so all of them come out of the same read of the hourly files.
+
+To add a candidate driver, register its hourly formula and its daily fields,
+and list them in a product of ``climdrivers.daily.PRODUCTS``::
+
+    @hourly('THI', 'T', 'RH')
+    def _thi(T, RH):
+        return 0.8 * T + RH / 100 * (T - 14.4) + 46.4
+
+    DAILY['THI_max'] = ('THI', 'max')
+"""
+from climdrivers.thermo import (W_REF, T_THRESHOLD, calculate_vapor_pressure, calculate_enthalpy,
+                                heat_index, humidex, humidity_ratio, relative_humidity,
+                                wet_bulb_temperature)
+
+# name -> inputs, parameters, formula and units of an hourly variable
+HOURLY = {}
+# Inputs every month starts from: hourly 2 m temperature and dew point in °C
+BASE_VARIABLES = ('T', 'Td')
+DEFAULT_PARAMS = {'W_ref': W_REF, 'T_threshold': T_THRESHOLD, 'P': 1013.25}
+
+
+def hourly(name, *inputs, params=(), units=None):
+    """Decorator registering ``func(*inputs, **params)`` as the hourly variable ``name``."""
+    def register(func):
+        HOURLY[name] = {'inputs': inputs, 'params': params, 'func': func, 'units': units}
+        return func
+    return register
+
+
+@hourly('e', 'Td', units='hPa')
+def _vapor_pressure(Td):
+    # Actual vapor pressure: the saturation pressure at the dew point
+    return calculate_vapor_pressure(Td)
+
+
+@hourly('es', 'T', units='hPa')
+def _saturation_vapor_pressure(T):
+    return calculate_vapor_pressure(T)
+
+
+@hourly('W', 'e', params=('P',), units='kg/kg')
+def _humidity_ratio(e, P):
+    return humidity_ratio(e, P)
+
+
+@hourly('Q', 'T', 'W', units='kJ/kg')
+def _enthalpy(T, W):
+    return calculate_enthalpy(T, W)
+
+
+@hourly('Qb', 'T', params=('W_ref',), units='kJ/kg')
+def _reference_enthalpy(T, W_ref):
+    return calculate_enthalpy(T, W_ref)
+
+
+@hourly('Q_excess', 'T', 'Q', 'Qb', params=('T_threshold',), units='kJ/kg')
+def _excess_enthalpy(T, Q, Qb, T_threshold):
+    # Excess enthalpy only where T > T_threshold and Q > Qb
+    return (Q - Qb).where((T > T_threshold) & (Q > Qb), 0)
+
+
+@hourly('RH', 'e', 'es', units='%')
+def _relative_humidity(e, es):
+    return relative_humidity(e, es)
+
+
+@hourly('HI', 'T', 'RH', units='degC')
+def _heat_index(T, RH):
+    return heat_index(T, RH)
+
+
+@hourly('Tw', 'T', 'RH', units='degC')
+def _wet_bulb(T, RH):
+    return wet_bulb_temperature(T, RH)
+
+
+@hourly('humidex', 'T', 'e', units='degC')
+def _humidex(T, e):
+    return humidex(T, e)
+
+
+# Reductions of the hourly values of each day; ELD is the daily sum over hours normalised by 24
+REDUCTIONS = {
+    'mean': lambda days: days.mean(),
+    'min': lambda days: days.min(),
+    'max': lambda days: days.max(),
+    'sum': lambda days: days.sum(),
+    'sum/24': lambda days: days.sum() / 24,
+}
+
+# daily field -> (hourly variable, reduction over each day)
+DAILY = {
+    'T_mean': ('T', 'mean'),
+    'T_min': ('T', 'min'),
+    'T_max': ('T', 'max'),
+    'Q_mean': ('Q', 'mean'),
+    'Q_min': ('Q', 'min'),
+    'Q_max': ('Q', 'max'),
+    'Qb_mean': ('Qb', 'mean'),
+    'ELD': ('Q_excess', 'sum/24'),
+    'RH_mean': ('RH', 'mean'),
+    'RH_min': ('RH', 'min'),
+    'HI_mean': ('HI', 'mean'),
+    'HI_max': ('HI', 'max'),
+    'Tw_mean': ('Tw', 'mean'),
+    'Tw_max': ('Tw', 'max'),
+    'humidex_max': ('humidex', 'max'),
+}
+
+
+class HourlyFields:
+    """One month's hourly variables, each built lazily once from ``T`` and ``Td`` (°C)."""
+
+    def __init__(self, T, Td, **params):
+        self.fields = dict(zip(BASE_VARIABLES, (T, Td)))
+        self.params = {**DEFAULT_PARAMS, **params}
+
+    def __getitem__(self, name):
+        if name not in self.fields:
+            if name not in HOURLY:
+                raise KeyError(f"unknown hourly variable '{name}' (registered: {', '.join(HOURLY)})")
+            spec = HOURLY[name]
+            field = spec['func'](*(self[source] for source in spec['inputs']),
+                                 **{key: self.params[key] for key in spec['params']})
+            if spec['units'] and hasattr(field, 'attrs'):
+                field.attrs['units'] = spec['units']
+            self.fields[name] = field
+        return self.fields[name]
+
+    def daily(self, names):
+        """Lazy daily fields ``names`` (keys of ``DAILY``), one day-resampling per hourly variable."""
+        resampled = {}
+        out = {}
+        for name in names:
+            source, how = DAILY[name]
+            if source not in resampled:
+                resampled[source] = self[source].resample(time="1D")
+            out[name] = REDUCTIONS[how](resampled[source])
+        return out
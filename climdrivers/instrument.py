@@ -0,0 +1,324 @@
+"""Stage timers, counters and memory/I/O tracking for the extractions.
+
+Code marks its stages with ``with stage('open'):`` (also ``compute``,
+``reduction``, ``spatial_join``, ``aggregate``, ``write``...). Each stage
+records:
+
+* wall and CPU time (CPU over all of the process's threads, so CPU well
+  below wall time times the thread count means the stage was waiting)
+* bytes read and written by the process, from the OS I/O counters, so reads
+  from shared storage count whether or not they hit the page cache
+* resident memory at the end and any growth of the process's peak memory
+* time spent in dask tasks, split by kind: reading (chunk loads, including
+  whatever dask fused into them), writing (stores) and everything else
+
+``count(name, n)`` adds to named counters. Tasks run through
+``climdrivers.scheduler.run_tasks`` record into their own ``Recorder``, per
+thread, so tasks running at the same time in one process stay apart. The
+worker sends it back with the task's result and it is merged in the parent.
+With ``metrics_log`` set, every stage and task is also appended to a JSON
+lines file as it finishes. With ``prometheus_file`` set, the run's totals are
+written in the Prometheus textfile format at the end. ``profile`` attaches
+cProfile to every task, or the dask performance report to a ``dask``
+backend run.
+"""
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psutil
+
+_process = None
+
+# Settings shipped to every worker with its task (see configure)
+_settings = {'metrics_log': None, 'profile': None, 'profile_folder': None, 'run': None, 'command': None}
+
+
+def _current_process():
+    """psutil handle for this process (re-created after a fork)."""
+    global _process
+    if _process is None or _process.pid != os.getpid():
+        _process = psutil.Process()
+    return _process
+
+
+def _peak_rss():
+    """Peak resident memory of this process so far, in bytes (0 where unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _io():
+    """(bytes read, bytes written) by this process so far."""
+    try:
+        counters = _current_process().io_counters()
+    except (AttributeError, psutil.Error):  # not available on macOS
+        return 0, 0
+    return (getattr(counters, 'read_chars', counters.read_bytes),
+            getattr(counters, 'write_chars', counters.write_bytes))
+
+
+def _sample():
+    read, written = _io()
+    return {'time': time.perf_counter(), 'cpu': time.process_time(), 'read': read, 'written': written,
+            'peak': _peak_rss()}
+
+
+def _task_kind(key):
+    """'read', 'write' or 'compute' for a dask task key."""
+    name = key[0] if isinstance(key, tuple) else key
+    name = str(name)
+    if name.startswith(('original-', 'open_dataset')):
+        return 'read'
+    if name.startswith(('store', 'finalize_store')):
+        return 'write'
+    return 'compute'
+
+
+class Recorder:
+    """Per-stage totals and named counters for one process or task."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, name, values):
+        totals = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0,
+                                               'read_bytes': 0, 'written_bytes': 0,
+                                               'rss_bytes': 0, 'peak_rss_bytes': 0, 'dask': {}})
+        totals['calls'] += values.get('calls', 1)
+        for key in ('seconds', 'cpu_seconds', 'read_bytes', 'written_bytes'):
+            totals[key] += values[key]
+        for key in ('rss_bytes', 'peak_rss_bytes'):
+            totals[key] = max(totals[key], values[key])
+        for kind, seconds in values.get('dask', {}).items():
+            totals['dask'][kind] = totals['dask'].get(kind, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        return {'stages': self.stages, 'counters': self.counters}
+
+    def merge(self, snapshot):
+        """Add a snapshot from another recorder (e.g. a worker's task)."""
+        for name, values in snapshot['stages'].items():
+            self.add(name, values)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+
+
+# The process's recorder; a task swaps in its own, for its thread only, so
+# tasks running side by side in one process each keep their own stages
+_root = Recorder()
+_local = threading.local()
+
+
+def _state():
+    """This thread's recorder, stack of open stages' dask times and task label."""
+    if not hasattr(_local, 'recorder'):
+        _local.recorder, _local.stack, _local.task = _root, [], None
+    return _local
+
+
+def recorder():
+    """The recorder stages currently go to."""
+    return _state().recorder
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name``."""
+    _state().recorder.count(name, n)
+
+
+def _emit(event):
+    """Append one event to the JSON lines log, if one is configured."""
+    if not _settings['metrics_log']:
+        return
+    event = {'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+             'run': _settings['run'], 'command': _settings['command'], 'pid': os.getpid(), **event}
+    # One short write per line, so lines from concurrent workers do not interleave
+    with open(_settings['metrics_log'], 'a') as f:
+        f.write(json.dumps(event, default=str) + '\n')
+
+
+class _DaskTaskTimer:
+    """dask callback adding each task's run time to the innermost open stage."""
+
+    def __init__(self):
+        from dask.callbacks import Callback
+        self._starts = {}
+        self._lock = threading.Lock()
+        self.callback = Callback(pretask=self._pretask, posttask=self._posttask)
+
+    def _pretask(self, key, dsk, state):
+        self._starts[key] = time.perf_counter()
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        start = self._starts.pop(key, None)
+        stack = _state().stack
+        if start is None or not stack:
+            return
+        kind = _task_kind(key)
+        with self._lock:
+            dask_times = stack[-1]
+            dask_times[kind] = dask_times.get(kind, 0.0) + time.perf_counter() - start
+
+
+_dask_timer = None
+
+
+@contextmanager
+def stage(name, **labels):
+    """Time a stage; ``labels`` (e.g. year, month) go into its log event."""
+    global _dask_timer
+    if _dask_timer is None:
+        _dask_timer = _DaskTaskTimer()
+        _dask_timer.callback.register()
+    state = _state()
+    dask_times = {}
+    state.stack.append(dask_times)
+    start = _sample()
+    try:
+        yield
+    finally:
+        state.stack.pop()
+        end = _sample()
+        values = {'seconds': end['time'] - start['time'], 'cpu_seconds': end['cpu'] - start['cpu'],
+                  'read_bytes': end['read'] - start['read'],
+                  'written_bytes': end['written'] - start['written'],
+                  'rss_bytes': _current_process().memory_info().rss, 'peak_rss_bytes': end['peak'],
+                  'dask': dask_times}
+        state.recorder.add(name, values)
+        _emit({'event': 'stage', 'stage': name, 'task': state.task, **labels,
+               **{key: value for key, value in values.items() if key != 'dask'},
+               'peak_growth_bytes': end['peak'] - start['peak'],
+               'dask_seconds': {kind: round(s, 6) for kind, s in dask_times.items()}})
+
+
+def configure(config, command=None):
+    """Set this run's logging and profiling options from a config (see climdrivers.config)."""
+    if config.get('profile') not in (None, 'cprofile', 'dask'):
+        raise ValueError(f"unknown profile '{config['profile']}', expected 'cprofile' or 'dask'")
+    if config.get('profile') == 'dask' and config.get('backend') != 'dask':
+        raise ValueError("the dask performance report needs backend 'dask'")
+    folder = config.get('profile_folder') or os.path.join(config['output_folder'], 'profiles')
+    _settings.update(metrics_log=config.get('metrics_log'), profile=config.get('profile'),
+                     profile_folder=folder, run=uuid.uuid4().hex[:12], command=command)
+    if _settings['metrics_log']:
+        os.makedirs(os.path.dirname(os.path.abspath(_settings['metrics_log'])), exist_ok=True)
+    if _settings['profile']:
+        os.makedirs(folder, exist_ok=True)
+    _emit({'event': 'start', 'argv': sys.argv})
+
+
+def settings():
+    """Options to ship to worker processes along with their tasks."""
+    return dict(_settings)
+
+
+def profile_path(name, suffix):
+    """File in the profile folder for ``name`` (a task label, made safe for a filename)."""
+    safe = re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or 'task'
+    return os.path.join(_settings['profile_folder'], f"{safe}-{os.getpid()}{suffix}")
+
+
+@contextmanager
+def task(label, worker_settings=None):
+    """Record a scheduler task into its own recorder; yields it, for the caller to snapshot.
+
+    Applies ``worker_settings`` (from ``settings()`` in the parent) in this
+    process, and with ``profile='cprofile'`` writes the task's profile to
+    the profile folder.
+    """
+    if worker_settings is not None:
+        _settings.update(worker_settings)
+    state = _state()
+    outer = state.recorder, state.task
+    task_recorder = Recorder()
+    state.recorder, state.task = task_recorder, label
+    profiler = cProfile.Profile() if _settings['profile'] == 'cprofile' else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield task_recorder
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(_settings['profile_folder'], exist_ok=True)
+            profiler.dump_stats(profile_path(label, '.prof'))
+        _emit({'event': 'task', 'task': label, 'seconds': time.perf_counter() - start,
+               'counters': task_recorder.counters})
+        state.recorder, state.task = outer
+
+
+def summary_lines(snapshot=None):
+    """Per-stage totals as printable lines."""
+    snapshot = snapshot or recorder().snapshot()
+    lines = [f"{'stage':<14}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'read MB':>10}{'written MB':>11}"
+             f"{'peak MB':>9}  dask task s (read/compute/write)"]
+    for name, s in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds']):
+        dask_times = '/'.join(f"{s['dask'].get(kind, 0):.1f}" for kind in ('read', 'compute', 'write'))
+        lines.append(f"{name:<14}{s['calls']:>7}{s['seconds']:>10.2f}{s['cpu_seconds']:>10.2f}"
+                     f"{s['read_bytes'] / 2 ** 20:>10.1f}{s['written_bytes'] / 2 ** 20:>11.1f}"
+                     f"{s['peak_rss_bytes'] / 2 ** 20:>9.0f}  {dask_times}")
+    lines += [f"{name}: {n}" for name, n in sorted(snapshot['counters'].items())]
+    return lines
+
+
+def prometheus_text(snapshot=None, command=None):
+    """The totals in the Prometheus text exposition format."""
+    snapshot = snapshot or recorder().snapshot()
+    command = command or _settings['command'] or ''
+    metrics = [
+        ('stage_calls_total', 'counter', 'Times each stage ran', 'calls'),
+        ('stage_seconds_total', 'counter', 'Wall time spent in each stage', 'seconds'),
+        ('stage_cpu_seconds_total', 'counter', 'CPU time (all threads) spent in each stage', 'cpu_seconds'),
+        ('stage_read_bytes_total', 'counter', 'Bytes read during each stage', 'read_bytes'),
+        ('stage_written_bytes_total', 'counter', 'Bytes written during each stage', 'written_bytes'),
+        ('stage_peak_rss_bytes', 'gauge', 'Largest peak resident memory at the end of a stage', 'peak_rss_bytes'),
+    ]
+    lines = []
+    for name, kind, help_text, key in metrics:
+        lines += [f"# HELP climdrivers_{name} {help_text}", f"# TYPE climdrivers_{name} {kind}"]
+        lines += [f'climdrivers_{name}{{command="{command}",stage="{stage_name}"}} {values[key]}'
+                  for stage_name, values in sorted(snapshot['stages'].items())]
+    lines += ["# HELP climdrivers_stage_dask_task_seconds_total Time in dask tasks by kind",
+              "# TYPE climdrivers_stage_dask_task_seconds_total counter"]
+    lines += [f'climdrivers_stage_dask_task_seconds_total{{command="{command}",stage="{stage_name}",'
+              f'kind="{kind}"}} {seconds}'
+              for stage_name, values in sorted(snapshot['stages'].items())
+              for kind, seconds in sorted(values['dask'].items())]
+    lines += ["# HELP climdrivers_events_total Named counters", "# TYPE climdrivers_events_total counter"]
+    lines += [f'climdrivers_events_total{{command="{command}",name="{name}"}} {n}'
+              for name, n in sorted(snapshot['counters'].items())]
+    lines += ["# HELP climdrivers_last_run_timestamp_seconds End of the last run",
+              "# TYPE climdrivers_last_run_timestamp_seconds gauge",
+              f'climdrivers_last_run_timestamp_seconds{{command="{command}"}} {time.time():.0f}']
+    return '\n'.join(lines) + '\n'
+
+
+def finish(prometheus_file=None):
+    """Print the run's per-stage summary, log it and write the Prometheus textfile if asked."""
+    snapshot = recorder().snapshot()
+    if not snapshot['stages']:
+        return
+    print('\n'.join(summary_lines(snapshot)))
+    _emit({'event': 'summary', **snapshot})
+    if prometheus_file:
+        from climdrivers.manifest import atomic_path
+        with atomic_path(prometheus_file) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write(prometheus_text(snapshot))
@@ -0,0 +1,175 @@
+"""Manifest of completed outputs, so reruns only redo what is out of date.
+
+Each entry maps an output (a file, or a named part of one such as a single
+month of a yearly CSV) to the fingerprints of the inputs it was built from
+and the code version that built it. An output is up to date when it still
+exists, its inputs are unchanged and the version matches. Several processes
+(e.g. the tasks of an array job) can share one manifest: saves are locked and
+merged with whatever the others wrote in the meantime.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from climdrivers import __version__
+
+
+def fingerprint(path, use_hash=False):
+    """Size and mtime of a file, plus its sha1 when ``use_hash`` is set."""
+    stat = os.stat(path)
+    info = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if use_hash:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        info['sha1'] = h.hexdigest()
+    return info
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def _locked(path):
+    """Hold an exclusive lock on ``path.lock`` (no-op where fcntl is unavailable)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_entries(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+@contextmanager
+def atomic_path(path, directory=False):
+    """Yield a temporary path next to ``path`` and move it into place on success.
+
+    With ``directory=True`` the temporary path is a directory (e.g. a Zarr
+    store) and an existing directory at ``path`` is replaced.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    base, ext = os.path.splitext(os.path.basename(path))
+    if directory:
+        tmp_path = tempfile.mkdtemp(prefix=f".{base}.", suffix=f".tmp{ext}", dir=folder)
+    else:
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{base}.", suffix=f".tmp{ext}", dir=folder)
+        os.close(fd)
+    try:
+        yield tmp_path
+        # mkstemp/mkdtemp create private files (0600/0700); give outputs the usual umask modes
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, (0o777 if directory else 0o666) & ~umask)
+        if directory and os.path.isdir(path):
+            _remove(path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove(tmp_path)
+
+
+class Manifest:
+    """JSON record of completed outputs, rewritten atomically on every update."""
+
+    def __init__(self, path, version=__version__, use_hash=False):
+        self.path = path
+        self.version = version
+        self.use_hash = use_hash
+        self.entries = _read_entries(path)
+        # Keys changed by this process since the last save
+        self._changed = set()
+
+    @staticmethod
+    def _key(output, part=None):
+        key = os.path.abspath(output)
+        return f"{key}#{part}" if part is not None else key
+
+    def _fingerprints(self, inputs):
+        return {os.path.abspath(p): fingerprint(p, self.use_hash) for p in inputs}
+
+    def is_current(self, output, inputs, part=None, params=None):
+        """True if ``output`` (or its ``part``) exists and was built from these inputs by this version.
+
+        ``params`` (e.g. non-default thresholds) must also match what was recorded.
+        """
+        entry = self.entries.get(self._key(output, part))
+        if entry is None or entry['version'] != self.version or not os.path.exists(output):
+            return False
+        if entry.get('params') != params:
+            return False
+        try:
+            return entry['inputs'] == self._fingerprints(inputs)
+        except FileNotFoundError:
+            return False
+
+    def added_inputs(self, output, inputs, part=None, params=None):
+        """Inputs not yet recorded for ``output``, or None if it has to be rebuilt from scratch.
+
+        For outputs that inputs can be folded into one at a time (such as
+        climatology sums): every input recorded last time must still be
+        listed and unchanged, and ``params`` and the version must match.
+        """
+        entry = self.entries.get(self._key(output, part))
+        if entry is None or entry['version'] != self.version or not os.path.exists(output):
+            return None
+        if entry.get('params') != params:
+            return None
+        try:
+            current = self._fingerprints(inputs)
+        except FileNotFoundError:
+            return None
+        if any(current.get(path) != recorded for path, recorded in entry['inputs'].items()):
+            return None
+        return [path for path in inputs if os.path.abspath(path) not in entry['inputs']]
+
+    def record(self, output, inputs, part=None, params=None):
+        """Mark ``output`` (or its ``part``) as built from ``inputs`` and save the manifest."""
+        key = self._key(output, part)
+        self.entries[key] = {'version': self.version, 'inputs': self._fingerprints(inputs)}
+        if params is not None:
+            self.entries[key]['params'] = params
+        self._changed.add(key)
+        self.save()
+
+    def forget(self, output, part=None):
+        """Drop an entry so the output is rebuilt next time."""
+        key = self._key(output, part)
+        if self.entries.pop(key, None) is not None:
+            self._changed.add(key)
+            self.save()
+
+    def save(self):
+        """Write this process's changes on top of the manifest currently on disk."""
+        with _locked(self.path):
+            entries = _read_entries(self.path)
+            for key in self._changed:
+                if key in self.entries:
+                    entries[key] = self.entries[key]
+                else:
+                    entries.pop(key, None)
+            with atomic_path(self.path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+            self.entries = entries
+            self._changed.clear()
@@ -0,0 +1,507 @@
+"""Monthly country tables (CDD, QDD, ELD, heat stress, degree-hours) from the daily archive.
+
+Each metric reads one daily product per month, reduces it to per-cell
+monthly statistics and aggregates those over the cells of each country. One
+CSV is written per year (and per base value for the degree-day metrics),
+rewritten after every month so an interrupted run resumes where it stopped.
+With ``monthly_memory`` set, each daily file is read and reduced in
+latitude bands that fit it, and the per-country sums are added up band by
+band, so a month of a fine grid never has to be held in memory at once.
+The same cell statistics are also aggregated over every configured polygon
+layer and its parent levels (``region_layers``, see climdrivers.regions),
+into tables of their own.
+"""
+import os
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import psutil
+from dask.utils import parse_bytes
+
+from climdrivers.catalog import Catalog, open_file
+from climdrivers.cell_stats import CELL_STATS, monthly_cell_stats
+from climdrivers.country_index import CountrySums, load_country_index
+from climdrivers.degree_days import degree_days_dataarray
+from climdrivers.instrument import count, stage
+from climdrivers.manifest import Manifest, atomic_path
+from climdrivers.population import load_population_grid, raster_for_year
+from climdrivers.regions import load_region_layer
+from climdrivers.subset import spatial_subset, subset_settings
+
+# metric -> daily product, swept base values (config key, dimension), degree days
+# computed here (variable, (max, mean, min) inputs), cell statistics and output
+# columns (column, statistic, country reduction)
+METRICS = {
+    'cdd': {
+        'product': 'temp',
+        'bases': ('t_bases', 'base'),
+        'degree_days': ('cdd', ('T_max', 'T_mean', 'T_min')),
+        'stats': ['cdd_sum', 'avg_temp', 'avg_max_temp', 'avg_min_temp'],
+        'columns': [('cdd_sum_avg', 'cdd_sum', 'mean'),
+                    ('cdd_sum_sum', 'cdd_sum', 'sum'),
+                    ('avg_temp', 'avg_temp', 'mean'),
+                    ('avg_max_temp', 'avg_max_temp', 'mean'),
+                    ('avg_min_temp', 'avg_min_temp', 'mean')],
+    },
+    'qdd': {
+        'product': 'q',
+        'bases': ('q_bases', 'base'),
+        'degree_days': ('qdd', ('Q_max', 'Q_mean', 'Q_min')),
+        'stats': ['qdd', 'avg_Q'],
+        'columns': [('qdd_avg', 'qdd', 'mean'),
+                    ('qdd_sum', 'qdd', 'sum'),
+                    ('avg_Q', 'avg_Q', 'mean')],
+    },
+    'eld': {
+        'product': 'eld',
+        'bases': None,
+        'degree_days': None,
+        'stats': ['avg_ELD', 'avg_Q', 'avg_Qb'],
+        'columns': [('avg_ELD', 'avg_ELD', 'mean'),
+                    ('avg_Q', 'avg_Q', 'mean'),
+                    ('avg_Qb', 'avg_Qb', 'mean')],
+    },
+    # ELD for every (W_ref, T_threshold) of the 'eldsweep' product: one row per
+    # country and parameter pair
+    'eld_sweep': {
+        'product': 'eldsweep',
+        'bases': None,
+        'degree_days': None,
+        'stats': ['avg_ELD_sweep', 'avg_Q', 'avg_Qb_sweep'],
+        'columns': [('avg_ELD', 'avg_ELD_sweep', 'mean'),
+                    ('avg_Q', 'avg_Q', 'mean'),
+                    ('avg_Qb', 'avg_Qb_sweep', 'mean')],
+    },
+    # Heat-stress indices of the 'heat' daily product (see climdrivers.derived)
+    'heat': {
+        'product': 'heat',
+        'bases': None,
+        'degree_days': None,
+        'stats': ['avg_RH', 'avg_HI', 'avg_HI_max', 'avg_Tw_max', 'avg_humidex_max'],
+        'columns': [('avg_RH', 'avg_RH', 'mean'),
+                    ('avg_HI', 'avg_HI', 'mean'),
+                    ('avg_HI_max', 'avg_HI_max', 'mean'),
+                    ('avg_Tw_max', 'avg_Tw_max', 'mean'),
+                    ('avg_humidex_max', 'avg_humidex_max', 'mean')],
+    },
+    # Exact degree-hours, already summed per day in the 'dh' daily product
+    'cdh': {
+        'product': 'dh',
+        'bases': ('cdh_bases', 'cdh_base'),
+        'degree_days': None,
+        'stats': ['cdh_sum'],
+        'columns': [('cdh_sum_avg', 'cdh_sum', 'mean'),
+                    ('cdh_sum_sum', 'cdh_sum', 'sum')],
+    },
+    'qdh': {
+        'product': 'dh',
+        'bases': ('qdh_bases', 'qdh_base'),
+        'degree_days': None,
+        'stats': ['qdh_sum'],
+        'columns': [('qdh_sum_avg', 'qdh_sum', 'mean'),
+                    ('qdh_sum_sum', 'qdh_sum', 'sum')],
+    },
+}
+
+
+def monitor_memory(step=""):
+    """Prints the current memory usage."""
+    process = psutil.Process(os.getpid())
+    print(f"Memory usage after {step}: {process.memory_info().rss / 1024 ** 2:.2f} MB")
+
+
+def metric_bases(metric, config):
+    """Base values swept for ``metric`` ([None] for metrics without degree days)."""
+    bases = METRICS[metric]['bases']
+    return list(config[bases[0]]) if bases else [None]
+
+
+def metric_variables(metric):
+    """Daily variables a metric reads from its product file."""
+    spec = METRICS[metric]
+    computed, sources = spec['degree_days'] or (None, ())
+    return sorted(set(sources) | {CELL_STATS[stat][0] for stat in spec['stats']} - {computed})
+
+
+def stored_latitude_chunk(ds):
+    """Latitude rows per stored chunk of a daily file (1 when it is not chunked on disk)."""
+    for da in ds.data_vars.values():
+        chunks = da.encoding.get('chunksizes') or da.encoding.get('chunks')
+        if chunks and 'latitude' in da.dims:
+            return int(chunks[da.get_axis_num('latitude')])
+    return 1
+
+
+def band_bytes_per_row(ds, spec, n_cols, n_bases):
+    """Estimated peak memory of one latitude row of ``n_cols`` cells while a month is reduced.
+
+    The daily inputs, the degree days of ``n_bases`` base values, and as much
+    again for the copies made while gathering cells and reducing them.
+    """
+    n_cells = ds.sizes['latitude'] * ds.sizes['longitude']
+    per_cell = sum(da.nbytes for da in ds.data_vars.values()) / n_cells
+    if spec['degree_days']:
+        source = ds[spec['degree_days'][1][0]]
+        per_cell += source.nbytes / n_cells * n_bases
+    return 2 * per_cell * n_cols
+
+
+def latitude_bands(n_rows, bytes_per_row, max_memory=None, first_row=0, stored_rows=1):
+    """Slices of ``n_rows`` rows, each within ``max_memory`` (one band when it is None).
+
+    Bands are a whole number of stored latitude chunks when one fits, so no
+    chunk is decompressed twice, and never less than one row. Band edges
+    fall on multiples of the band height in grid rows (row 0 being grid row
+    ``first_row``), i.e. on the file's chunk boundaries.
+    """
+    if not max_memory:
+        return [slice(0, n_rows)]
+    height = max(1, int(parse_bytes(max_memory) // bytes_per_row))
+    if height >= stored_rows:
+        height = height // stored_rows * stored_rows
+    bands, start = [], 0
+    while start < n_rows:
+        stop = min(n_rows, ((first_row + start) // height + 1) * height - first_row)
+        bands.append(slice(start, stop))
+        start = stop
+    return bands
+
+
+def table_name(metric, config, base=None):
+    """Name of a metric's tables, e.g. ``cdd_base19`` or ``qdd`` (the first QDD base keeps the plain name)."""
+    if METRICS[metric]['bases'] is None:
+        # ELD tables keep the capitalised name of the original scripts
+        return {'eld': 'ELD', 'eld_sweep': 'ELD_sweep'}.get(metric, metric)
+    if metric == 'qdd' and base == metric_bases(metric, config)[0]:
+        return 'qdd'
+    return f"{metric}_base{base:g}"
+
+
+def name_suffix(config):
+    """Suffix for non-point aggregation modes and regional runs, e.g. ``_area`` or ``_area_europe``.
+
+    A ``bbox`` or ``countries`` run only covers part of the world, so its
+    outputs need a ``region`` name to keep them apart from the global ones.
+    """
+    mode = config['aggregation_mode']
+    suffix = '' if mode == 'point' else f'_{mode}'
+    if config.get('bbox') or config.get('countries'):
+        if not config.get('region'):
+            raise ValueError("set 'region' to name the outputs of a bbox or countries run")
+        suffix += f"_{config['region']}"
+    return suffix
+
+
+def output_file(metric, year, config, base=None, target=None):
+    """Path of one year's table, named as the original scripts named it.
+
+    ``target`` is None for the country table, or (layer, level) for a region
+    layer's table, e.g. ``monthly_ELD_2010_states.csv`` and
+    ``monthly_ELD_2010_states_admin.csv`` for its roll-up to ``admin``.
+    """
+    layer = ''
+    if target is not None:
+        name, level = target
+        layer = f"_{name}" if level == 'region' else f"_{name}_{level}"
+    return os.path.join(config['output_folder'],
+                        f"monthly_{table_name(metric, config, base)}_{year}{name_suffix(config)}{layer}.csv")
+
+
+def region_targets(config):
+    """(layer, level) of every region-layer table: each layer's regions, then its parent levels."""
+    return [(name, level) for name, spec in (config['region_layers'] or {}).items()
+            for level in ['region'] + list(spec.get('parents') or [])]
+
+
+def panel_metric(metric, config, base=None):
+    """Metric partition of the Parquet panel store, e.g. ``cdd_base19`` or ``eld_area``."""
+    return f"{table_name(metric, config, base).lower()}{name_suffix(config)}"
+
+
+class YearTable:
+    """Country rows for one year's output CSV.
+
+    The CSV is rewritten after every month that is added, and each month is
+    recorded in the manifest against its daily input file, so an interrupted
+    run resumes at the next month and unchanged months are reused as-is.
+    Saved months that are not part of this run are kept.
+    """
+
+    def __init__(self, output_file, manifest):
+        self.output_file = output_file
+        self.manifest = manifest
+        # Rows already saved for this year, reused for months that are up to date; parsed
+        # exactly, so rewriting the table leaves reused months unchanged
+        self.previous = (pd.read_csv(output_file, parse_dates=['Date'], float_precision='round_trip')
+                         if os.path.exists(output_file) else None)
+        self.results = []
+        # Rows of the months computed in this run
+        self.computed = []
+
+    def reuse(self, date, inputs):
+        """Keep the saved rows for ``date`` if its inputs are unchanged; True on success."""
+        if self.previous is None or not self.manifest.is_current(self.output_file, inputs,
+                                                                 part=f"{date:%Y-%m}"):
+            return False
+        done = self.previous[self.previous['Date'] == date]
+        if not len(done):
+            return False
+        self.results.append(done)
+        return True
+
+    def add(self, rows, date, inputs):
+        """Append a computed month, save the table and record the month."""
+        self.results.append(rows)
+        self.computed.append(rows)
+        self.save()
+        self.manifest.record(self.output_file, inputs, part=f"{date:%Y-%m}")
+
+    def frame(self):
+        """The year's rows in date order: this run's months plus any other saved months."""
+        frames = list(self.results)
+        if self.previous is not None:
+            dates = set(pd.concat([pd.to_datetime(rows['Date']) for rows in frames]))
+            frames.insert(0, self.previous[~self.previous['Date'].isin(dates)])
+        table = pd.concat(frames, ignore_index=True)
+        return table.iloc[pd.to_datetime(table['Date']).argsort(kind='stable')]
+
+    def save(self):
+        """Write the rows gathered so far; returns False if there are none."""
+        if not self.results:
+            return False
+        with atomic_path(self.output_file) as tmp_path:
+            self.frame().to_csv(tmp_path, index=False)
+        return True
+
+
+def extract_year(metric, year, config, months=range(1, 13), catalog=None):
+    """Build (or bring up to date) one year's tables for ``metric``; returns their paths."""
+    spec = METRICS[metric]
+    catalog = catalog or Catalog(config['daily_folder']).scan()
+    manifest = Manifest(config['manifest'])
+
+    # One resumable output table per base value, for the countries and for every region layer level
+    tables = {(base, target): YearTable(output_file(metric, year, config, base, target), manifest)
+              for base in metric_bases(metric, config) for target in [None] + region_targets(config)}
+
+    # Population-weighted means use the raster for this year, which is then an input too
+    mode = config['aggregation_mode']
+    raster = raster_for_year(config['population_rasters'], year) if mode == 'population' else None
+    population = None
+
+    # Cells to compute (see climdrivers.subset), set up from the first daily file's grid
+    subset = None
+    use_subset = subset_settings(config) is not None
+    # Region layers, loaded on first use
+    layers = {}
+
+    for month in months:
+        print(metric, year, ':', month)
+        start_time = time.time()
+        file_path = catalog.path(spec['product'], year, month)
+        if file_path is None:
+            continue
+
+        date = pd.Timestamp(year=year, month=month, day=1)
+        inputs = [file_path] + ([raster] if raster else [])
+        pending = [key for key, table in tables.items() if not table.reuse(date, inputs)]
+        if not pending:
+            print(metric, year, ':', month, ' up to date')
+            count('months_reused')
+            continue
+
+        # Open the daily file
+        with stage('open', metric=metric, year=year, month=month):
+            ds = open_file(file_path)[metric_variables(metric)]
+            lat_values, lon_values = ds['latitude'].values, ds['longitude'].values
+            if use_subset and subset is None:
+                subset = spatial_subset(config, lat_values, lon_values)
+
+        # Population on the ERA5 grid (regridded on first use and cached)
+        if raster and population is None:
+            with stage('regrid', raster=raster):
+                population = load_population_grid(raster, lat_values, lon_values,
+                                                  config['cache_folder'], config['population_variable'])
+
+        # Cached grid-to-country and grid-to-region indices (built on first use); a
+        # region layer's parent levels are roll-ups of its region index
+        with stage('spatial_join', mode=mode):
+            indices = {}
+            for target in dict.fromkeys(target for _, target in pending):
+                if target is None:
+                    indices[target] = load_country_index(lat_values, lon_values, config['shapefile'],
+                                                         config['cache_folder'], mode=mode, population=population)
+                    continue
+                name, level = target
+                if name not in layers:
+                    layers[name] = load_region_layer(lat_values, lon_values, name, config['region_layers'][name],
+                                                     config['cache_folder'], mode=mode, population=population)
+                indices[target] = layers[name].level_index(level)
+
+        # Latitude bands of the window (the whole grid without a subset) that fit the memory cap
+        bases = list(dict.fromkeys(base for base, _ in pending))
+        rows = subset.rows if subset is not None else np.arange(len(lat_values))
+        n_cols = len(subset.cols) if subset is not None else len(lon_values)
+        bands = latitude_bands(len(rows), band_bytes_per_row(ds, spec, n_cols, len(bases)),
+                               config['monthly_memory'], first_row=int(rows[0]),
+                               stored_rows=stored_latitude_chunk(ds))
+
+        # Per-country sums, added up band by band
+        sums = {key: CountrySums([(column, how) for column, _, how in spec['columns']]) for key in pending}
+        for band in bands:
+            if subset is not None:
+                band_subset = subset.band(band)
+                if not band_subset.mask.any():
+                    continue
+            with stage('read', metric=metric, year=year, month=month):
+                if subset is not None:
+                    # Only the window is read, and only the needed cells are computed
+                    cells = band_subset.gather(band_subset.crop(ds).load())
+                else:
+                    cells = ds.isel(latitude=band).load()
+
+            # Daily degree days for every pending base value at once
+            if spec['degree_days']:
+                name, sources = spec['degree_days']
+                with stage('compute', metric=metric, year=year, month=month):
+                    cells[name] = degree_days_dataarray(*(cells[v] for v in sources), bases)
+
+            # Per-cell monthly values, computed once for every column that uses them
+            with stage('reduction', metric=metric, year=year, month=month):
+                stats = monthly_cell_stats(cells, spec['stats']).load()
+                if subset is not None:
+                    stats = band_subset.scatter(stats)
+            del cells
+
+            # Average and sum over the cells of each country (or region) in the band
+            with stage('aggregate', metric=metric, year=year, month=month):
+                for target in dict.fromkeys(target for _, target in pending):
+                    if subset is None:
+                        index = indices[target].crop(rows[band], np.arange(n_cols))
+                    elif target is None:
+                        index = band_subset.crop_index(indices[target])
+                    else:
+                        index = indices[target].crop(band_subset.rows, band_subset.cols, band_subset.mask)
+                    for base, key_target in pending:
+                        if key_target == target:
+                            fields = stats.sel({spec['bases'][1]: base}) if base is not None else stats
+                            sums[base, target].add(index, [fields[stat] for _, stat, _ in spec['columns']])
+
+        # Monitor memory usage
+        monitor_memory(step=f"processing {year}-{month:02d}")
+
+        for base, target in pending:
+            results = sums[base, target].frame(date)
+            if target is not None:
+                results = layers[target[0]].table(results, target[1])
+
+            # Save after every month so an interrupted run resumes at the next month
+            with stage('write', metric=metric, year=year, month=month):
+                tables[base, target].add(results, date, inputs)
+        count('months_computed')
+
+        print(metric, year, ':', month, ' (', time.time() - start_time, ')')
+
+    # Tables were saved month by month; upsert the country tables' new months into the Parquet panel store
+    written = [table.output_file for table in tables.values() if table.computed]
+    if config['panel_folder']:
+        from climdrivers.panel import PanelStore
+
+        store = PanelStore(config['panel_folder'])
+        for (base, target), table in tables.items():
+            if target is not None or not table.results:
+                continue
+            name = panel_metric(metric, config, base)
+            with stage('write', metric=metric, year=year):
+                # A year missing from the store gets all its rows, otherwise only the recomputed months
+                if year not in store.years(name):
+                    store.write(name, table.frame())
+                elif table.computed:
+                    store.write(name, pd.concat(table.computed, ignore_index=True))
+    return written
+
+
+def stale_tasks(config, metrics, years, months=range(1, 13), catalog=None):
+    """(metric, year) tasks with a month whose table is missing or older than its daily file."""
+    catalog = catalog or Catalog(config['daily_folder']).scan()
+    manifest = Manifest(config['manifest'])
+    tasks = []
+    for metric in metrics:
+        outputs = [(base, target) for base in metric_bases(metric, config)
+                   for target in [None] + region_targets(config)]
+        for year in years:
+            raster = (raster_for_year(config['population_rasters'], year)
+                      if config['aggregation_mode'] == 'population' else None)
+            for month in months:
+                file_path = catalog.path(METRICS[metric]['product'], year, month)
+                if file_path is None:
+                    continue
+                inputs = [file_path] + ([raster] if raster else [])
+                if not all(manifest.is_current(output_file(metric, year, config, base, target), inputs,
+                                               part=f"{year}-{month:02d}") for base, target in outputs):
+                    tasks.append((metric, year))
+                    break
+    return tasks
+
+
+def build_indices(config, tasks, months=range(1, 13), catalog=None):
+    """Build the cached grid indices the ``(metric, year)`` tasks will load, once, before they start.
+
+    Workers then only read the cache instead of each building the same index.
+    """
+    catalog = catalog or Catalog(config['daily_folder']).scan()
+    paths = (catalog.path(METRICS[metric]['product'], year, month) for metric, year in tasks for month in months)
+    file_path = next((path for path in paths if path is not None), None)
+    if file_path is None:
+        return
+    with open_file(file_path) as ds:
+        lat_values, lon_values = ds['latitude'].values, ds['longitude'].values
+    mode = config['aggregation_mode']
+    # Population mode weights the area index; subsets are built from it too
+    modes = {'area' if mode == 'population' else mode} | ({'area'} if subset_settings(config) else set())
+    with stage('spatial_join'):
+        for index_mode in sorted(modes):
+            load_country_index(lat_values, lon_values, config['shapefile'], config['cache_folder'], mode=index_mode)
+        for name, spec in (config['region_layers'] or {}).items():
+            load_region_layer(lat_values, lon_values, name, spec, config['cache_folder'],
+                              mode='area' if mode == 'population' else mode)
+
+
+def run_monthly(config, metrics, years, months=range(1, 13), stale_only=False):
+    """``extract_year`` for every metric and year, with years spread over the configured workers.
+
+    Tasks are whole years, so two workers never write the same CSV. With
+    ``stale_only`` only the years with a month to compute are run.
+    """
+    from climdrivers.scheduler import run_tasks
+
+    # Scan the archive once here rather than in every worker
+    catalog = Catalog(config['daily_folder']).scan()
+    if stale_only:
+        tasks = stale_tasks(config, metrics, years, months, catalog)
+        print(f"{len(tasks)} monthly tables to update")
+    else:
+        tasks = [(metric, year) for metric in metrics for year in years]
+    build_indices(config, tasks, months, catalog)
+    run_tasks(partial(extract_year, config=config, months=list(months), catalog=catalog),
+              tasks, workers=config['workers'], backend=config['backend'],
+              memory_limit=config['memory_limit'], threads_per_worker=config['threads_per_worker'],
+              address_space_limit=config['address_space_limit'])
+
+
+def import_tables(config, metrics, years):
+    """Load existing yearly CSVs into the Parquet panel store; returns the metrics written."""
+    from climdrivers.panel import PanelStore, read_panel_csv
+
+    store = PanelStore(config['panel_folder'])
+    written = set()
+    for metric in metrics:
+        for base in metric_bases(metric, config):
+            for year in years:
+                path = output_file(metric, year, config, base)
+                if os.path.exists(path):
+                    store.write(panel_metric(metric, config, base), read_panel_csv(path))
+                    written.add(panel_metric(metric, config, base))
+    return sorted(written)
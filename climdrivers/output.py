@@ -0,0 +1,173 @@
+"""Chunked, compressed NetCDF/Zarr output for the daily products.
+
+Datasets are written straight from their dask graphs: nothing is
+``.compute()``-d beforehand, so a month is streamed to disk chunk by chunk
+instead of being materialised in memory first. Several datasets can be
+written with one compute, which keeps intermediates they share from being
+evaluated twice.
+
+Fields are stored as float32 by default. ``dtype='int16'`` packs each
+variable in ``PACKED_RANGES`` into 16-bit integers with a fixed CF
+``scale_factor``/``add_offset``, which halves the archive again. The
+resolution is 0.003 °C for temperatures and 0.006 kJ/kg for enthalpies.
+Every month uses the same encoding, so the files concatenate cleanly.
+Values outside a range are clipped to it. Every file carries the package
+version in its ``climdrivers_version`` attribute.
+"""
+import os
+from contextlib import ExitStack
+
+import dask
+import numpy as np
+
+from climdrivers import __version__
+from climdrivers.manifest import atomic_path
+
+FORMATS = {'netcdf': '.nc', 'zarr': '.zarr'}
+COMPRESSIONS = (None, 'zlib', 'blosc_lz4', 'blosc_zstd')
+
+# On-disk chunk shape for daily fields (clipped to the dimension sizes); about
+# 5 MB of float32 per chunk on the 0.25° grid
+DEFAULT_CHUNKS = {'time': 31, 'latitude': 145, 'longitude': 288}
+
+# Physical range of each daily variable packed by dtype='int16' (units as written)
+PACKED_RANGES = {
+    **{name: (-100.0, 70.0) for name in ('T_mean', 'T_min', 'T_max')},
+    **{name: (-110.0, 290.0) for name in ('Q_mean', 'Q_min', 'Q_max', 'Qb_mean', 'Qb_sweep')},
+    'ELD': (0.0, 200.0),
+    'ELD_sweep': (0.0, 200.0),
+    **{name: (0.0, 100.0) for name in ('RH_mean', 'RH_min')},
+    # The Rothfusz regression behind the heat index runs far above air temperature in hot, humid air
+    **{name: (-100.0, 150.0) for name in ('HI_mean', 'HI_max', 'humidex_max')},
+    **{name: (-100.0, 70.0) for name in ('Tw_mean', 'Tw_max')},
+    'CDH': (0.0, 2000.0),
+    'QDH': (0.0, 7000.0),
+}
+# Packed integers span -32767..32767; -32768 marks missing cells
+PACKED_FILL = -32768
+
+
+def packing(name):
+    """CF encoding that packs variable ``name`` into int16, or None if it has no fixed range."""
+    if name not in PACKED_RANGES:
+        return None
+    low, high = PACKED_RANGES[name]
+    return {'dtype': 'int16', 'scale_factor': np.float32((high - low) / 65534),
+            'add_offset': np.float32((high + low) / 2), '_FillValue': np.int16(PACKED_FILL)}
+
+
+def disk_chunks(da, chunks=None):
+    """Chunk shape for ``da``: ``chunks`` per dimension, clipped to its size."""
+    chunks = DEFAULT_CHUNKS if chunks is None else chunks
+    shape = []
+    for dim, size in zip(da.dims, da.shape):
+        chunk = chunks.get(dim, size)
+        shape.append(size if chunk in (-1, None) else min(int(chunk), size))
+    return tuple(shape)
+
+
+def clip_to_packing(ds):
+    """``ds`` with every variable in ``PACKED_RANGES`` clipped to its range."""
+    return ds.assign({name: ds[name].clip(*PACKED_RANGES[name], keep_attrs=True)
+                      for name in ds.data_vars if name in PACKED_RANGES})
+
+
+def packed_as_float32(ds):
+    """``ds`` with int16-packed variables as float32, as NetCDF decodes them (Zarr gives float64)."""
+    packed = [name for name, da in ds.data_vars.items()
+              if np.dtype(da.encoding.get('dtype', da.dtype)) == np.int16 and da.dtype == np.float64]
+    return ds.assign({name: ds[name].astype(np.float32) for name in packed}) if packed else ds
+
+
+def _zarr_compressor(compression, complevel):
+    """Encoding key and compressor for ``compression`` in the installed zarr version."""
+    import zarr
+    zarr3 = int(zarr.__version__.split('.')[0]) >= 3
+    if compression is None:
+        # Otherwise zarr would apply its own default codec
+        return ('compressors', None) if zarr3 else ('compressor', None)
+    if compression == 'zlib':
+        if zarr3:
+            # The Zarr 3 spec's DEFLATE codec (zlib's stream in a gzip wrapper)
+            from zarr.codecs import GzipCodec
+            return 'compressors', [GzipCodec(level=complevel)]
+        from numcodecs import Zlib
+        return 'compressor', Zlib(level=complevel)
+    cname = 'zstd' if compression == 'blosc_zstd' else 'lz4'
+    if zarr3:
+        from zarr.codecs import BloscCodec
+        return 'compressors', [BloscCodec(cname=cname, clevel=complevel, shuffle='shuffle')]
+    from numcodecs import Blosc
+    return 'compressor', Blosc(cname=cname, clevel=complevel, shuffle=Blosc.SHUFFLE)
+
+
+def encoding_for(ds, fmt='netcdf', dtype='float32', compression='zlib', complevel=4, chunks=None):
+    """Per-variable encoding: storage dtype, chunk shape and compression.
+
+    ``compression`` is applied as asked in both formats. For Zarr, ``'zlib'``
+    is numcodecs' ``Zlib`` in Zarr 2 stores and the spec's gzip codec (the
+    same DEFLATE compression) in Zarr 3 stores, at ``complevel``. ``None``
+    leaves Zarr chunks uncompressed rather than taking zarr's default codec.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format '{fmt}', expected one of {tuple(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression '{compression}', expected one of {COMPRESSIONS}")
+
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        enc = {'chunks' if fmt == 'zarr' else 'chunksizes': disk_chunks(da, chunks)}
+        if dtype == 'int16':
+            # Variables without a packing range stay float32
+            enc.update(packing(name) or {'dtype': 'float32'})
+        elif dtype is not None and np.issubdtype(da.dtype, np.floating):
+            enc['dtype'] = dtype
+        if fmt == 'netcdf':
+            if compression == 'zlib':
+                enc.update(zlib=True, complevel=complevel, shuffle=True)
+            elif compression is not None:
+                enc.update(compression=compression, complevel=complevel, shuffle=True)
+        else:
+            key, compressor = _zarr_compressor(compression, complevel)
+            enc[key] = compressor
+        encoding[name] = enc
+    return encoding
+
+
+def output_path(path, fmt='netcdf'):
+    """``path`` with the file extension for ``fmt``."""
+    return os.path.splitext(path)[0] + FORMATS[fmt]
+
+
+def write_datasets(datasets, paths, fmt='netcdf', dtype='float32', compression='zlib',
+                   complevel=4, chunks=None):
+    """Write several datasets with a single dask compute.
+
+    Each variable is rechunked to its on-disk chunk shape so dask streams
+    whole storage chunks, and every dataset is written under a temporary
+    name that is renamed into place once all writes have finished.
+    """
+    with ExitStack() as stack:
+        delayed = []
+        for ds, path in zip(datasets, paths):
+            ds = clip_to_packing(ds) if dtype == 'int16' else ds.copy()
+            ds.attrs['climdrivers_version'] = __version__
+            for name in list(ds.data_vars):
+                da = ds[name]
+                ds[name] = da.chunk(dict(zip(da.dims, disk_chunks(da, chunks))))
+            encoding = encoding_for(ds, fmt=fmt, dtype=dtype, compression=compression,
+                                    complevel=complevel, chunks=chunks)
+
+            tmp_path = stack.enter_context(atomic_path(path, directory=(fmt == 'zarr')))
+            if fmt == 'zarr':
+                delayed.append(ds.to_zarr(tmp_path, mode='w', encoding=encoding, compute=False))
+            else:
+                delayed.append(ds.to_netcdf(tmp_path, engine='netcdf4', encoding=encoding,
+                                            compute=False))
+        dask.compute(*delayed)
+    return list(paths)
+
+
+def write_dataset(ds, path, **kwargs):
+    """Write one dataset; see ``write_datasets`` for the options."""
+    return write_datasets([ds], [path], **kwargs)[0]
@@ -0,0 +1,143 @@
+"""Partitioned Parquet store of the monthly country panels.
+
+Tables are kept under ``{root}/metric={metric}/year={year}/part.parquet``
+with typed columns: ``Date`` as datetime64, ``Country`` as a categorical
+(dictionary-encoded in Parquet) and the values as float64. Writing a table
+replaces only the (metric, year) partitions it touches, merging on
+``(Date, Country)`` (plus the parameter columns of a sweep such as
+``eld_sweep``), so the store grows incrementally as years are extracted and
+reruns never duplicate rows. ``load_panels`` reads several metrics and
+joins them without parsing any text.
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+
+from climdrivers.manifest import atomic_path
+
+KEYS = ['Date', 'Country']
+# Parameter columns of sweep tables, which are row keys as well
+PARAMETER_KEYS = ['W_ref', 'T_threshold']
+
+
+def row_keys(columns):
+    """``KEYS`` plus the parameter columns among ``columns``."""
+    return KEYS + [c for c in PARAMETER_KEYS if c in columns]
+
+
+def typed_frame(df):
+    """``df`` with datetime64 ``Date``, categorical ``Country`` and float values.
+
+    Empty unnamed columns (e.g. from a trailing comma in a CSV header) are
+    dropped.
+    """
+    df = df.loc[:, [c for c in df.columns
+                    if not (str(c).startswith('Unnamed') and df[c].isna().all())]].copy()
+    if df['Date'].dtype != 'datetime64[ns]':
+        df['Date'] = pd.to_datetime(df['Date']).astype('datetime64[ns]')
+    if not isinstance(df['Country'].dtype, pd.CategoricalDtype):
+        df['Country'] = df['Country'].astype(str).astype('category')
+    for column in df.columns.difference(KEYS):
+        if df[column].dtype != 'float64':
+            df[column] = pd.to_numeric(df[column]).astype('float64')
+    return df
+
+
+def read_panel_csv(path):
+    """Typed frame from a panel CSV such as ``Temporary_FinalDatasets/monthly_cdd.csv``.
+
+    Dates in those files are written ``M/D/YY`` (``1/1/00`` is January 2000);
+    the yearly extraction CSVs use ISO dates. Columns without a header are
+    spreadsheet residue (monthly_qdd.csv has one) and are dropped.
+    """
+    df = pd.read_csv(path)
+    df = df.loc[:, [c for c in df.columns if not str(c).startswith('Unnamed')]]
+    try:
+        df['Date'] = pd.to_datetime(df['Date'], format='%m/%d/%y')
+    except ValueError:
+        df['Date'] = pd.to_datetime(df['Date'])
+    return typed_frame(df)
+
+
+class PanelStore:
+    """Monthly country tables partitioned by metric and year under ``root``."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def partition_path(self, metric, year):
+        return os.path.join(self.root, f"metric={metric}", f"year={int(year)}", "part.parquet")
+
+    def metrics(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(self.root)
+                      if name.startswith('metric='))
+
+    def years(self, metric):
+        folder = os.path.join(self.root, f"metric={metric}")
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(name.split('=', 1)[1]) for name in os.listdir(folder)
+                      if name.startswith('year='))
+
+    def write(self, metric, df):
+        """Upsert the rows of ``df`` into the metric's year partitions; returns the years written."""
+        df = typed_frame(df)
+        keys = row_keys(df.columns)
+        written = []
+        for year, rows in df.groupby(df['Date'].dt.year, sort=True):
+            path = self.partition_path(metric, year)
+            if os.path.exists(path):
+                existing = pq.read_table(path).to_pandas()
+                existing = existing[~existing.set_index(keys).index.isin(rows.set_index(keys).index)]
+                rows = typed_frame(pd.concat([existing, rows], ignore_index=True))
+            rows = rows.sort_values(keys, kind='stable').reset_index(drop=True)
+            rows['Country'] = rows['Country'].cat.remove_unused_categories()
+            table = pa.Table.from_pandas(rows, preserve_index=False)
+            with atomic_path(path) as tmp_path:
+                pq.write_table(table, tmp_path, compression='zstd')
+            written.append(int(year))
+        return written
+
+    def read(self, metric, years=None, columns=None, countries=None):
+        """One metric as a typed DataFrame, optionally limited to years, columns or countries."""
+        folder = os.path.join(self.root, f"metric={metric}")
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(f"no '{metric}' panel in {self.root}")
+        dataset = pads.dataset(folder, format='parquet', partitioning='hive')
+        condition = None
+        if years is not None:
+            condition = pads.field('year').isin([int(y) for y in years])
+        if countries is not None:
+            country_filter = pads.field('Country').isin(list(countries))
+            condition = country_filter if condition is None else condition & country_filter
+        if columns is not None:
+            keys = row_keys(dataset.schema.names)
+            columns = keys + [c for c in columns if c not in keys]
+        table = dataset.to_table(columns=columns, filter=condition)
+        if 'year' in table.column_names:
+            table = table.drop(['year'])
+        return typed_frame(table.to_pandas())
+
+
+def load_panels(root, metrics=('cdd_base19', 'eld', 'qdd'), years=None, how='outer'):
+    """Join several metrics on (Date, Country) into one panel.
+
+    Columns that appear in more than one metric (e.g. ``avg_Q``) keep the
+    first metric's name; later copies get a ``_{metric}`` suffix.
+    """
+    store = PanelStore(root)
+    frames = [(metric, store.read(metric, years=years)) for metric in metrics]
+    countries = sorted(set().union(*(df['Country'].cat.categories for _, df in frames)))
+    panel = None
+    for metric, df in frames:
+        df['Country'] = df['Country'].cat.set_categories(countries)
+        if panel is None:
+            panel = df
+        else:
+            panel = panel.merge(df, on=KEYS, how=how, suffixes=('', f'_{metric}'))
+    return panel.sort_values(KEYS, kind='stable').reset_index(drop=True)
@@ -0,0 +1,98 @@
+"""Gridded population on the ERA5 grid, for population-weighted country means.
+
+A population-count raster (GeoTIFF via rioxarray, or NetCDF) is summed onto
+the ERA5 grid once, by adding each source cell to the ERA5 cell that
+contains its centre, and cached as ``.npy``. Counts are conserved, so the
+source should be at least as fine as the ERA5 grid (GPW/WorldPop/GHS
+rasters are). The source is read in blocks of rows, so global 30"
+rasters never have to fit in memory.
+
+Rasters can be given per year (``{2000: path, 2005: path, ...}``); each
+month uses the latest raster at or before its year.
+"""
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from climdrivers.country_index import grid_hash
+from climdrivers.manifest import atomic_path
+
+# Source rows read at a time
+BLOCK_ROWS = 512
+
+_LAT_NAMES = ('latitude', 'lat', 'y')
+_LON_NAMES = ('longitude', 'lon', 'x')
+
+
+def read_population(path, variable=None):
+    """Population counts from a GeoTIFF or NetCDF as a lazy (latitude, longitude) DataArray."""
+    if path.lower().endswith(('.tif', '.tiff')):
+        try:
+            import rioxarray
+        except ImportError:
+            raise ImportError("reading GeoTIFF population rasters needs rioxarray") from None
+        da = rioxarray.open_rasterio(path, masked=True, chunks={'x': 4096, 'y': BLOCK_ROWS})
+    else:
+        ds = xr.open_dataset(path, chunks={})
+        da = ds[variable or next(iter(ds.data_vars))]
+    lat_dim = next(d for d in da.dims if d in _LAT_NAMES)
+    lon_dim = next(d for d in da.dims if d in _LON_NAMES)
+    extra = [d for d in da.dims if d not in (lat_dim, lon_dim)]
+    da = da.isel({d: 0 for d in extra}, drop=True)
+    return da.rename({lat_dim: 'latitude', lon_dim: 'longitude'}).transpose('latitude', 'longitude')
+
+
+def regrid_population(population, lat_values, lon_values):
+    """Sum source population cells into the ERA5 cells containing their centres."""
+    lat_values = np.asarray(lat_values, dtype=np.float64)
+    lon_values = np.asarray(lon_values, dtype=np.float64)
+    n_lat, n_lon = len(lat_values), len(lon_values)
+    dlat = lat_values[1] - lat_values[0]
+    dlon = lon_values[1] - lon_values[0]
+
+    src_lon = np.asarray(population['longitude'].values, dtype=np.float64)
+    cols = np.rint(((src_lon - lon_values[0]) % 360) / dlon).astype(np.int64) % n_lon
+    src_lat = np.asarray(population['latitude'].values, dtype=np.float64)
+
+    out = np.zeros(n_lat * n_lon)
+    for start in range(0, len(src_lat), BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, len(src_lat))
+        rows = np.rint((src_lat[start:stop] - lat_values[0]) / dlat).astype(np.int64)
+        inside = (rows >= 0) & (rows < n_lat)
+        if not inside.any():
+            continue
+        block = np.asarray(population.isel(latitude=slice(start, stop)).values, dtype=np.float64)
+        block = np.where(np.isfinite(block) & (block > 0), block, 0.0)[inside]
+        flat = (rows[inside][:, None] * n_lon + cols[None, :]).ravel()
+        out += np.bincount(flat, weights=block.ravel(), minlength=out.size)
+    return out.reshape(n_lat, n_lon)
+
+
+def raster_for_year(rasters, year):
+    """Path of the raster for ``year``: the latest at or before it, else the earliest."""
+    if isinstance(rasters, str):
+        return rasters
+    years = sorted(int(y) for y in rasters)
+    if not years:
+        raise ValueError("no population rasters configured")
+    chosen = max((y for y in years if y <= int(year)), default=years[0])
+    return rasters[chosen] if chosen in rasters else rasters[str(chosen)]
+
+
+def load_population_grid(path, lat_values, lon_values, cache_dir, variable=None):
+    """Population on the ERA5 grid from ``path``, regridded on first use and cached."""
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{grid_hash(lat_values, lon_values)}:{os.path.abspath(path)}:"
+                       f"{stat.st_size}:{stat.st_mtime_ns}:{variable}".encode()).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f"population_{key}.npy")
+    if os.path.exists(cache_file):
+        return np.load(cache_file)
+
+    grid = regrid_population(read_population(path, variable), lat_values, lon_values)
+    with atomic_path(cache_file) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, grid)
+    print(f"Regridded population {os.path.basename(path)} ({grid.sum():.4g} people) → {cache_file}")
+    return grid
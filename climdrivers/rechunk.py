@@ -0,0 +1,134 @@
+"""Time-contiguous copies of the daily archive for per-cell time-series reads.
+
+Daily files hold one month each, chunked (31, 145, 288), so the 25-year
+series of a single cell touches 300 files and decompresses 300 chunks of
+42,000 cells. ``rechunk_product`` copies a product into one Zarr store
+chunked the other way round: whole time series in small spatial tiles
+(``TIMESERIES_CHUNKS``).
+
+Like rechunker, the copy never holds more than ``max_memory``. The grid is
+cut into tiles whose edges are multiples of the target chunks and whose whole
+time series fits the budget. Each tile is read from the monthly files and
+written into its region of the store. Tiles are as large as the budget
+allows, which keeps repeated decompression of the monthly chunks low.
+"""
+import os
+from functools import partial
+
+from dask.utils import parse_bytes
+
+from climdrivers.instrument import count, stage
+from climdrivers.manifest import atomic_path
+from climdrivers.output import clip_to_packing, encoding_for, packed_as_float32
+
+# Target chunks of the time-series stores (-1: the whole dimension); about
+# 37 MB of float32 per chunk for 25 years of days
+TIMESERIES_CHUNKS = {'time': -1, 'latitude': 32, 'longitude': 32}
+
+
+def timeseries_path(folder, product, years):
+    """Path of a product's time-series store for ``years``."""
+    return os.path.join(folder, f"era5_daily_{product}_{years[0]}-{years[-1]}.zarr")
+
+
+def plan_tiles(n_lat, n_lon, bytes_per_cell, chunks, max_memory):
+    """(latitude, longitude) slices covering the grid, each within ``max_memory``.
+
+    Tiles are whole rows when a chunk-high band fits, otherwise chunk-high
+    strips. Either way their edges fall on target chunk boundaries, and a
+    tile is never smaller than one chunk.
+    """
+    lat_chunk = min(n_lat, chunks['latitude'])
+    lon_chunk = min(n_lon, chunks['longitude'])
+    cells = max(1, int(max_memory // bytes_per_cell))
+    if cells >= lat_chunk * n_lon:
+        lat_step, lon_step = cells // n_lon // lat_chunk * lat_chunk, n_lon
+    else:
+        lat_step, lon_step = lat_chunk, max(lon_chunk, cells // lat_chunk // lon_chunk * lon_chunk)
+    return [(slice(i, min(i + lat_step, n_lat)), slice(j, min(j + lon_step, n_lon)))
+            for i in range(0, n_lat, lat_step) for j in range(0, n_lon, lon_step)]
+
+
+def rechunk_product(product, years, catalog, folder, chunks=None, max_memory='2GB', dtype='float32',
+                    compression='zlib', complevel=4):
+    """Copy ``product`` over ``years`` from the monthly files into a time-series Zarr store in ``folder``.
+
+    Returns the path of the store.
+    """
+    path = timeseries_path(folder, product, years)
+    chunks = {**TIMESERIES_CHUNKS, **(chunks or {})}
+    with stage('open', product=product):
+        ds = catalog.open(product, start=f"{years[0]}-01-01", end=f"{years[-1]}-12-31T23:59")
+        # The monthly files' encodings (chunk shapes, packing) do not apply to the copy
+        ds = ds.drop_encoding()
+        if dtype == 'int16':
+            ds = clip_to_packing(ds)
+    encoding = encoding_for(ds, fmt='zarr', dtype=dtype, compression=compression, complevel=complevel,
+                            chunks=chunks)
+    n_lat, n_lon = ds.sizes['latitude'], ds.sizes['longitude']
+    bytes_per_cell = sum(da.nbytes for da in ds.data_vars.values()) / (n_lat * n_lon)
+    tiles = plan_tiles(n_lat, n_lon, bytes_per_cell, chunks, parse_bytes(max_memory))
+    # Variables without a spatial dimension are written with the metadata, not per region
+    static = [name for name, var in ds.variables.items()
+              if not {'latitude', 'longitude'} & set(var.dims)]
+
+    with atomic_path(path, directory=True) as tmp_path:
+        with stage('write', product=product):
+            # Metadata and coordinates only, so the monthly dask chunks need not match the store's
+            ds.to_zarr(tmp_path, mode='w', encoding=encoding, compute=False, safe_chunks=False)
+        for lat, lon in tiles:
+            with stage('read', product=product):
+                tile = ds.isel(latitude=lat, longitude=lon).drop_vars(static).load()
+            with stage('write', product=product):
+                tile.to_zarr(tmp_path, region={'latitude': lat, 'longitude': lon})
+            count('tiles_written')
+    print(f"Rechunked {product} ({ds.sizes['time']} days) in {len(tiles)} tiles → {path}")
+    return path
+
+
+def open_timeseries(path, variables=None):
+    """Lazily open a time-series store, one dask chunk per stored chunk."""
+    import xarray as xr
+
+    ds = packed_as_float32(xr.open_zarr(path))
+    return ds if variables is None else ds[list(variables)]
+
+
+def run_rechunk(config, years):
+    """Write a time-series store for every configured product in the daily archive.
+
+    Stores that are up to date with their monthly files (per the daily
+    manifest) are skipped.
+    """
+    from climdrivers.catalog import Catalog
+    from climdrivers.manifest import Manifest
+    from climdrivers.scheduler import run_tasks
+
+    catalog = Catalog(config['daily_folder']).scan()
+    manifest = Manifest(config['daily_manifest'])
+    folder = config['timeseries_folder'] or os.path.join(config['daily_folder'], 'timeseries')
+    params = {'chunks': {**TIMESERIES_CHUNKS, **(config['timeseries_chunks'] or {})},
+              'dtype': config['dtype']}
+
+    tasks = []
+    for product in config['products']:
+        inputs = catalog.files(product, years=years)
+        if not inputs:
+            continue
+        present = sorted({catalog.entries[os.path.basename(p)]['year'] for p in inputs})
+        path = timeseries_path(folder, product, present)
+        if not manifest.is_current(path, inputs, params=params):
+            tasks.append((product, present))
+    print(f"Rechunking {len(tasks)} products into {folder}...")
+
+    def record(args, path):
+        product, present = args
+        manifest.record(path, catalog.files(product, years=present), params=params)
+
+    # One product per worker; each copies its tiles one after the other
+    run_tasks(partial(rechunk_product, catalog=catalog, folder=folder,
+                      chunks=config['timeseries_chunks'], max_memory=config['rechunk_memory'], dtype=config['dtype'],
+                      compression=config['compression'], complevel=config['complevel']),
+              tasks, workers=min(config['workers'], max(1, len(tasks))), backend=config['backend'],
+              memory_limit=config['memory_limit'], threads_per_worker=config['threads_per_worker'],
+              address_space_limit=config['address_space_limit'], on_done=record)
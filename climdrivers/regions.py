@@ -0,0 +1,113 @@
+"""Aggregation over any polygon layer, with roll-ups through a region hierarchy.
+
+A layer is a polygon file, such as admin-1 states or utility balancing
+areas, with a name column. It may also have parent columns that place each
+polygon in a hierarchy, e.g. ``['admin']`` (the country) for Natural Earth
+admin-1 states. Its sparse cell -> region index is built and cached exactly
+like the country index: a point-in-polygon join in point mode, an STRtree of
+cell boxes in area mode.
+
+A roll-up to a parent level keeps every cell and weight of the region index
+and maps each region's code to its parent. A parent mean is therefore the
+weighted mean over all its regions' cells. As long as the regions do not
+overlap, this matches an index built from the merged polygons. Each layer
+and level only costs a sparse reduction of the monthly cell statistics,
+which are computed once per month for all layers.
+
+Regions are keyed by their name and their parents, joined with ``SEPARATOR``,
+so two states with the same name in different countries stay apart.
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from climdrivers.country_index import CountryIndex, build_country_index, grid_hash, shapefile_hash
+from climdrivers.manifest import atomic_path
+
+SEPARATOR = ' | '
+
+
+def region_key(values):
+    """Index key of a region from its name followed by its parents' names."""
+    return SEPARATOR.join(str(v) for v in values)
+
+
+class RegionLayer:
+    """Region index of a polygon layer and the names along its hierarchy.
+
+    ``hierarchy`` has one row per region key with the ``name_column`` and
+    ``parents`` columns of the layer.
+    """
+
+    def __init__(self, name, index, hierarchy, name_column, parents=()):
+        self.name = name
+        self.index = index
+        self.hierarchy = hierarchy
+        self.name_column = name_column
+        self.parents = list(parents)
+
+    def levels(self):
+        """Level names: the regions themselves, then each parent column."""
+        return ['region'] + self.parents
+
+    def level_index(self, level):
+        """Index of ``level``: the region index, or its roll-up to a parent column."""
+        if level == 'region':
+            return self.index
+        depth = self.parents.index(level)
+        columns = self.parents[depth:]
+        parent_of = dict(zip(self.hierarchy.index,
+                             (region_key(row) for row in self.hierarchy[columns].itertuples(index=False))))
+        return self.index.rollup(parent_of)
+
+    def table(self, rows, level):
+        """Aggregated rows (keyed in ``Country``) as Region plus the level's parent columns."""
+        columns = [self.name_column] + self.parents if level == 'region' else \
+            self.parents[self.parents.index(level):]
+        parts = rows['Country'].astype(str).str.split(SEPARATOR, regex=False, expand=True)
+        parts.columns = ['Region'] + columns[1:]
+        return pd.concat([rows[['Date']], parts, rows.drop(columns=['Date', 'Country'])], axis=1)
+
+
+def load_region_layer(lat_values, lon_values, name, spec, cache_dir, mode='point', population=None):
+    """``RegionLayer`` for a ``region_layers`` entry, with its index cached in ``cache_dir``.
+
+    ``spec`` holds ``shapefile``, ``name_column`` and optional ``parents``.
+    Population mode weights the cached area index with ``population``.
+    """
+    path = spec['shapefile']
+    name_column = spec['name_column']
+    parents = list(spec.get('parents') or [])
+    key = hashlib.sha1(
+        f"{grid_hash(lat_values, lon_values)}:{shapefile_hash(path)}:{name_column}:{parents}:"
+        f"{'area' if mode == 'population' else mode}".encode()
+    ).hexdigest()[:16]
+    stem = os.path.join(cache_dir, f"region_index_{name}_{'area' if mode == 'population' else mode}_{key}")
+
+    # The .npz is written last, so once it exists the hierarchy next to it is complete
+    if os.path.exists(stem + '.npz'):
+        index = CountryIndex.load(stem + '.npz')
+        hierarchy = pd.read_csv(stem + '.csv', index_col=0, keep_default_na=False)
+    else:
+        import geopandas as gpd
+
+        regions = gpd.read_file(path)
+        regions = regions[regions[name_column].notna()].copy()
+        regions['_key'] = [region_key(row) for row in
+                           regions[[name_column] + parents].itertuples(index=False)]
+        hierarchy = (pd.DataFrame(regions[['_key', name_column] + parents])
+                     .drop_duplicates('_key').set_index('_key').sort_index())
+        index = build_country_index(lat_values, lon_values, regions, name_column='_key',
+                                    mode='area' if mode == 'population' else mode)
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_path(stem + '.csv') as tmp_path:
+            hierarchy.to_csv(tmp_path)
+        index.save(stem + '.npz')
+        print(f"Built {mode} index for {index.n_countries} regions of layer '{name}' → {stem}.npz")
+
+    if mode == 'population':
+        if population is None:
+            raise ValueError("population mode needs a population grid")
+        index = index.weighted_by(population)
+    return RegionLayer(name, index, hierarchy, name_column, parents)
@@ -0,0 +1,189 @@
+"""Per-country regressions over the analysis panel, solved for all countries at once.
+
+Each country's months are laid out on a common time axis. This gives stacked
+design matrices ``X`` (countries x months x terms) and responses ``Y``
+(countries x months). Missing months become zero rows with ``mask`` False,
+and a zero row leaves a least-squares fit unchanged. One batched QR
+decomposition then fits every country together, instead of one model per
+country in a loop. Columns are scaled to unit norm per country before the
+solve, so GDP in dollars and an intercept can share a matrix.
+
+Confidence intervals come from a moving-block bootstrap over months, which
+keeps the autocorrelation of monthly residuals within each block.
+Replicates run in fixed-size batches, each with its own seed, spread over
+``climdrivers.scheduler.run_tasks`` workers. The intervals are therefore
+the same for any number of workers.
+"""
+import warnings
+from functools import partial
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from climdrivers.instrument import stage
+
+# Replicates per bootstrap task
+BOOTSTRAP_BATCH = 50
+
+
+class Design:
+    """Stacked per-country design: ``X`` (G x T x k), ``Y`` (G x T) and ``mask`` (G x T)."""
+
+    def __init__(self, X, Y, mask, countries, dates, terms):
+        self.X = X
+        self.Y = Y
+        self.mask = mask
+        self.countries = countries
+        self.dates = dates
+        self.terms = terms
+
+    @classmethod
+    def from_frame(cls, frame, y, terms, intercept=True, month_effects=False, log_y=False,
+                   group='code'):
+        """Design of ``y`` on the ``terms`` columns of a panel frame indexed or keyed by (``group``, Date).
+
+        ``month_effects`` adds dummies for February to December. Rows with a
+        missing value (or a non-positive ``y`` when ``log_y``) are left out.
+        """
+        df = frame.reset_index() if group not in frame.columns else frame
+        df = df[[group, 'Date', y] + [t for t in terms if t != y]]
+        y_values = df[y].to_numpy(dtype=np.float64)
+        term_values = df[list(terms)].to_numpy(dtype=np.float64)
+        valid = np.isfinite(y_values) & np.isfinite(term_values).all(axis=1)
+        if log_y:
+            valid &= y_values > 0
+            y_values = np.log(np.where(valid, y_values, 1))
+
+        columns = [term_values]
+        names = list(terms)
+        if intercept:
+            columns.insert(0, np.ones((len(df), 1)))
+            names.insert(0, 'intercept')
+        if month_effects:
+            months = pd.DatetimeIndex(df['Date']).month.to_numpy()
+            columns.append((months[:, None] == np.arange(2, 13)).astype(np.float64))
+            names += [f'month_{m}' for m in range(2, 13)]
+        rows = np.hstack(columns)
+
+        countries, g = np.unique(df[group].astype(str).to_numpy()[valid], return_inverse=True)
+        dates, t = np.unique(df['Date'].to_numpy()[valid], return_inverse=True)
+        X = np.zeros((len(countries), len(dates), len(names)))
+        Y = np.zeros((len(countries), len(dates)))
+        mask = np.zeros((len(countries), len(dates)), dtype=bool)
+        X[g, t] = rows[valid]
+        Y[g, t] = y_values[valid]
+        mask[g, t] = True
+        return cls(X, Y, mask, countries, pd.DatetimeIndex(dates), names)
+
+
+def batched_lstsq(X, Y, mask):
+    """Least squares for every country with one batched QR solve.
+
+    Returns (coefficients G x k, standard errors G x k, R² G, observations
+    G). Countries whose design is rank deficient, or that have no residual
+    degrees of freedom, get NaN.
+    """
+    X = X * mask[..., None]
+    Y = Y * mask
+    n = mask.sum(axis=1)
+    k = X.shape[-1]
+
+    # Unit-norm columns per country; all-zero columns keep a scale of 1 and show up as rank deficient
+    scale = np.sqrt((X ** 2).sum(axis=1))
+    scale[scale == 0] = 1
+    Q, R = np.linalg.qr(X / scale[:, None, :])
+    diag = np.abs(np.diagonal(R, axis1=1, axis2=2))
+    solvable = (diag > 1e-8).all(axis=1) & (n > k)
+    R[~solvable] = np.eye(k)
+
+    R_inv = np.linalg.inv(R)
+    beta = (R_inv @ (np.swapaxes(Q, 1, 2) @ Y[..., None]))[..., 0]
+    residuals = (Y - ((X / scale[:, None, :]) @ beta[..., None])[..., 0]) * mask
+    ssr = (residuals ** 2).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma2 = ssr / (n - k)
+        # Var(beta) = sigma² (R'R)^-1 = sigma² R^-1 R^-T, so the variances are the row sums of R^-1 squared
+        se = np.sqrt(sigma2[:, None] * (R_inv ** 2).sum(axis=2)) / scale
+        y_mean = Y.sum(axis=1) / n
+        sst = (((Y - y_mean[:, None]) * mask) ** 2).sum(axis=1)
+        r2 = 1 - ssr / sst
+    beta = beta / scale
+    beta[~solvable] = se[~solvable] = r2[~solvable] = np.nan
+    return beta, se, r2, n
+
+
+def block_indices(rng, n_times, block, n_replicates):
+    """Moving-block resamples of ``range(n_times)``, one row per replicate."""
+    block = max(1, min(block, n_times))
+    n_blocks = -(-n_times // block)
+    starts = rng.integers(0, n_times - block + 1, size=(n_replicates, n_blocks))
+    return (starts[..., None] + np.arange(block)).reshape(n_replicates, -1)[:, :n_times]
+
+
+def bootstrap_batch(n_replicates, seed, X, Y, mask, block=12):
+    """Coefficients (replicates x G x k) of ``n_replicates`` block-bootstrap refits."""
+    rng = np.random.default_rng(seed)
+    indices = block_indices(rng, X.shape[1], block, n_replicates)
+    return np.stack([batched_lstsq(X[:, idx], Y[:, idx], mask[:, idx])[0] for idx in indices])
+
+
+def fit_countries(frame, y, terms, intercept=True, month_effects=False, log_y=False, n_boot=0, block=12,
+                  level=0.95, seed=0, workers=1, backend='process'):
+    """Per-country fits of ``y`` on ``terms``: one row per (code, term).
+
+    Columns are ``coef``, ``se``, ``ci_low``/``ci_high`` and per-country
+    ``r2`` and ``n``. The interval is the bootstrap percentile interval when
+    ``n_boot`` > 0 and the normal-theory one otherwise.
+    """
+    design = Design.from_frame(frame, y, terms, intercept=intercept, month_effects=month_effects,
+                               log_y=log_y)
+    with stage('fit', y=y):
+        beta, se, r2, n = batched_lstsq(design.X, design.Y, design.mask)
+
+    alpha = 1 - level
+    if n_boot:
+        from climdrivers.scheduler import run_tasks
+
+        # Batches have fixed sizes and seeds, so results do not depend on the number of workers
+        starts = range(0, n_boot, BOOTSTRAP_BATCH)
+        seeds = np.random.SeedSequence(seed).generate_state(len(starts))
+        tasks = [(min(BOOTSTRAP_BATCH, n_boot - first), int(s)) for first, s in zip(starts, seeds)]
+        with stage('bootstrap', y=y):
+            draws = np.concatenate(run_tasks(partial(bootstrap_batch, X=design.X, Y=design.Y,
+                                                     mask=design.mask, block=block),
+                                             tasks, workers=workers, backend=backend))
+        with warnings.catch_warnings():
+            # Countries that cannot be fitted are all-NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, high = np.nanquantile(draws, [alpha / 2, 1 - alpha / 2], axis=0)
+        low[np.isnan(beta)] = high[np.isnan(beta)] = np.nan
+    else:
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        low, high = beta - z * se, beta + z * se
+
+    G, k = beta.shape
+    return pd.DataFrame({
+        'code': np.repeat(design.countries, k),
+        'term': np.tile(design.terms, G),
+        'coef': beta.ravel(),
+        'se': se.ravel(),
+        'ci_low': low.ravel(),
+        'ci_high': high.ravel(),
+        'r2': np.repeat(r2, k),
+        'n': np.repeat(n, k),
+    })
+
+
+def fit_specifications(frame, specifications, **options):
+    """``fit_countries`` for each ``{name: {'y': ..., 'terms': [...], ...}}`` specification, stacked.
+
+    Per-specification settings override ``options``; the result has a
+    ``specification`` column.
+    """
+    results = []
+    for name, spec in specifications.items():
+        settings = {**options, **spec}
+        results.append(fit_countries(frame, **settings).assign(specification=name))
+    table = pd.concat(results, ignore_index=True)
+    return table[['specification'] + [c for c in table.columns if c != 'specification']]
@@ -0,0 +1,192 @@
+"""Fan month-level tasks out over a process pool or a local dask cluster.
+
+Each task is an independent month (one hourly file pair, one daily file...),
+so months run concurrently while each one still uses a small threaded dask
+scheduler for its own graph. Progress is printed in task order, whatever
+order the workers finish in. What a worker's task prints is buffered and
+printed by the parent with the task's progress line, so the output of
+concurrent tasks never interleaves.
+
+``memory_limit`` is enforced on resident memory by the dask backend's
+nanny. Process workers can instead be given ``address_space_limit``, a hard
+``RLIMIT_AS`` cap on virtual memory. That counts reserved but untouched
+pages (thread stacks, allocator arenas) too, so it has to sit well above the
+expected resident memory, and it is off by default.
+"""
+import io
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import dask
+from dask.utils import parse_bytes
+
+from climdrivers import instrument
+from climdrivers.daily import temp_file_for
+
+BACKENDS = ('serial', 'process', 'dask')
+
+
+def month_file_pairs(data_folder, years):
+    """(dew point, temperature) paths of the hourly files for the given years, sorted."""
+    years = [str(y) for y in years]
+    pairs = []
+    for file in sorted(os.listdir(data_folder)):
+        if file.endswith(".nc") and "2d" in file and any(year in file for year in years):
+            pairs.append((os.path.join(data_folder, file),
+                          os.path.join(data_folder, temp_file_for(file))))
+    return pairs
+
+
+def _init_worker(address_space_limit, threads_per_worker):
+    """Cap the worker's address space (if asked to) and size its dask thread pool."""
+    if address_space_limit:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (address_space_limit, address_space_limit))
+    dask.config.set(scheduler='threads', num_workers=threads_per_worker)
+
+
+class _TaskOutput:
+    """Worker ``sys.stdout``/``sys.stderr`` that sends each task thread's writes to its own buffer."""
+
+    local = threading.local()
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def _captured_output(buffer):
+    """Collect what this thread prints into ``buffer``."""
+    if not isinstance(sys.stdout, _TaskOutput):
+        sys.stdout = _TaskOutput(sys.stdout)
+    if not isinstance(sys.stderr, _TaskOutput):
+        sys.stderr = _TaskOutput(sys.stderr)
+    _TaskOutput.local.buffer = buffer
+    try:
+        yield
+    finally:
+        _TaskOutput.local.buffer = None
+
+
+def _run_task(func, args, threads_per_worker=None, worker_settings=None, capture=False):
+    """Run one task and report (result, elapsed seconds, formatted error or None, stage totals, output).
+
+    With ``threads_per_worker`` the task's own dask graph runs on a local
+    thread pool of that size rather than on whatever scheduler is ambient
+    (inside a distributed worker that would be the cluster itself). The
+    task's stages are recorded on their own (see ``climdrivers.instrument``)
+    and their totals returned for the parent to merge. With ``capture`` what
+    the task prints is returned too, for the parent to print in task order.
+    """
+    start_time = time.time()
+    output = io.StringIO()
+    with _captured_output(output) if capture else nullcontext(), \
+            instrument.task(_label(args), worker_settings) as recorder:
+        try:
+            if threads_per_worker:
+                with dask.config.set(scheduler='threads', num_workers=threads_per_worker):
+                    result = func(*args)
+            else:
+                result = func(*args)
+            outcome = (result, time.time() - start_time, None)
+        except Exception:
+            outcome = (None, time.time() - start_time, traceback.format_exc())
+    return outcome + (recorder.snapshot(), output.getvalue())
+
+
+def _label(args):
+    """Short description of a task for progress messages."""
+    if not args:
+        return ''
+    if isinstance(args[0], (list, tuple)):
+        return f"{len(args[0])} files"
+    if isinstance(args[0], str) and os.sep in args[0]:
+        return os.path.basename(args[0])
+    return ' '.join(str(arg) for arg in args)
+
+
+def _report(i, n, args, outcome, on_done):
+    result, elapsed, error, stages, output = outcome
+    instrument.recorder().merge(stages)
+    sys.stdout.write(output)
+    label = _label(args)
+    if error is None:
+        print(f"[{i + 1}/{n}] {label} done in {elapsed:.2f} seconds")
+        if on_done is not None:
+            on_done(args, result)
+    else:
+        print(f"[{i + 1}/{n}] {label} FAILED after {elapsed:.2f} seconds\n{error}")
+
+
+def run_tasks(func, tasks, workers=1, backend='process', memory_limit=None, threads_per_worker=1,
+              on_done=None, address_space_limit=None):
+    """Run ``func(*args)`` for every tuple in ``tasks`` and return the results in order.
+
+    ``backend`` is ``'serial'``, ``'process'`` (a ``ProcessPoolExecutor``) or
+    ``'dask'`` (a ``distributed.LocalCluster``). ``memory_limit`` (bytes or a
+    string such as ``'16GB'``) is the resident memory of each dask worker and
+    ``address_space_limit`` the address space of each process worker (see
+    above). ``on_done(args, result)``
+    is called in this process, in task order, for every task that succeeds,
+    e.g. to update a manifest. Failed tasks are reported as they come up and
+    raised together once every task has finished.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend '{backend}', expected one of {BACKENDS}")
+    tasks = [tuple(args) for args in tasks]
+    n = len(tasks)
+    if not tasks:
+        return []
+    if isinstance(memory_limit, str):
+        memory_limit = parse_bytes(memory_limit)
+    if isinstance(address_space_limit, str):
+        address_space_limit = parse_bytes(address_space_limit)
+    if workers <= 1 and backend != 'dask':
+        backend = 'serial'
+
+    if backend == 'serial':
+        outcomes = []
+        for i, args in enumerate(tasks):
+            outcomes.append(_run_task(func, args))
+            _report(i, n, args, outcomes[-1], on_done)
+    elif backend == 'process':
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(address_space_limit, threads_per_worker)) as pool:
+            futures = [pool.submit(_run_task, func, args, None, instrument.settings(), True) for args in tasks]
+            outcomes = []
+            for i, (args, future) in enumerate(zip(tasks, futures)):
+                outcomes.append(future.result())
+                _report(i, n, args, outcomes[-1], on_done)
+    else:
+        from distributed import Client, LocalCluster, performance_report
+        settings = instrument.settings()
+        report = (performance_report(filename=instrument.profile_path('dask-report', '.html'))
+                  if settings['profile'] == 'dask' else nullcontext())
+        # One month in flight per worker, so each month gets the worker's whole memory_limit;
+        # threads_per_worker only sizes the month's own threaded scheduler (see _run_task)
+        with LocalCluster(n_workers=workers, threads_per_worker=1,
+                          memory_limit=memory_limit or 'auto', processes=True) as cluster, \
+                Client(cluster) as client, report:
+            futures = [client.submit(_run_task, func, args, threads_per_worker, settings, True, pure=False)
+                       for args in tasks]
+            outcomes = []
+            for i, (args, future) in enumerate(zip(tasks, futures)):
+                outcomes.append(future.result())
+                _report(i, n, args, outcomes[-1], on_done)
+
+    failed = [_label(args) for args, (_, _, error, _, _) in zip(tasks, outcomes) if error is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {n} tasks failed: {', '.join(failed)}")
+    return [outcome[0] for outcome in outcomes]
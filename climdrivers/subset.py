@@ -0,0 +1,193 @@
+"""Spatial subsets: read and compute only the part of the grid a run needs.
+
+A subset is a window of the grid (rows, and columns that may wrap around
+the 0/360 seam) plus a mask of the cells inside it that are needed. It is
+built once per grid from the cached area-mode country index:
+
+* ``land_mask``: the cells that overlap any country (about 30% of the
+  globe). The window stays the full grid, so daily files keep their shape.
+* ``countries``: the cells of those countries, in the smallest window holding them.
+* ``bbox`` (``[lat_min, lat_max, lon_min, lon_max]``, longitudes on
+  -180-180 or 0-360): the cells inside the box, in its window.
+
+The daily pass crops its reads to the window, never reads dask blocks
+without a needed cell and stores NaN for every cell outside the mask. The
+monthly tables crop each daily file to the window and compute degree days
+and cell statistics only on the needed cells, one latitude ``band`` of the
+window at a time when their memory is capped. Country values are unchanged
+by ``land_mask``, since country means only use the cells it keeps.
+"""
+import numpy as np
+import xarray as xr
+
+from climdrivers.country_index import convert_longitudes, load_country_index
+
+
+def subset_settings(config):
+    """The subset options of a config, or None when the whole grid is used."""
+    settings = {key: config[key] for key in ('land_mask', 'bbox', 'countries') if config.get(key)}
+    if 'bbox' in settings:
+        settings['bbox'] = [float(v) for v in settings['bbox']]
+        if len(settings['bbox']) != 4:
+            raise ValueError("bbox is [lat_min, lat_max, lon_min, lon_max]")
+    if 'countries' in settings:
+        settings['countries'] = sorted(settings['countries'])
+    return settings or None
+
+
+def _window(used, circular=False):
+    """Indices of the shortest run covering every True in ``used``, wrapping round if ``circular``."""
+    positions = np.flatnonzero(used)
+    n = len(used)
+    if not circular:
+        return np.arange(positions[0], positions[-1] + 1)
+    # The window is everything but the longest gap between used positions, wrap-around included
+    gaps = np.diff(np.append(positions, positions[0] + n))
+    if gaps.max() == 1:
+        return np.arange(n)
+    largest = int(np.argmax(gaps))
+    start = positions[(largest + 1) % len(positions)]
+    return (start + np.arange(n - gaps[largest] + 1)) % n
+
+
+def _indexer(positions):
+    """A slice for contiguous positions (cheap on lazily indexed files), the array otherwise."""
+    if len(positions) and np.all(np.diff(positions) == 1):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+class SpatialSubset:
+    """Window (``rows`` x ``cols`` of the full grid) and the needed cells inside it."""
+
+    def __init__(self, rows, cols, mask, lat_values, lon_values, countries=None):
+        self.rows = np.asarray(rows)
+        self.cols = np.asarray(cols)
+        self.mask = np.asarray(mask, dtype=bool)
+        self.grid = (np.asarray(lat_values), np.asarray(lon_values))
+        self.lat = self.grid[0][self.rows]
+        self.lon = self.grid[1][self.cols]
+        self.countries = countries
+
+    @property
+    def n_cells(self):
+        return int(self.mask.sum())
+
+    def band(self, rows):
+        """The subset restricted to the window rows ``rows`` (a slice), for work in latitude bands."""
+        return SpatialSubset(self.rows[rows], self.cols, self.mask[rows], *self.grid, countries=self.countries)
+
+    def crop(self, obj):
+        """The window of a Dataset or DataArray on the full grid."""
+        return obj.isel(latitude=_indexer(self.rows), longitude=_indexer(self.cols))
+
+    def crop_index(self, index):
+        """A full-grid ``CountryIndex`` cut to the window and the needed cells (and countries)."""
+        index = index.crop(self.rows, self.cols, self.mask)
+        if self.countries:
+            # Names were checked against the area index; small countries can have no point-mode cells
+            index = index.restrict([name for name in self.countries if name in set(index.names)])
+        return index
+
+    def gather(self, ds):
+        """The needed cells of a window-cropped dataset, along a single ``cell`` dimension."""
+        lat_idx, lon_idx = np.nonzero(self.mask)
+        cells = ds.isel(latitude=xr.DataArray(lat_idx, dims='cell'),
+                        longitude=xr.DataArray(lon_idx, dims='cell'))
+        # C order, so reductions over time add up in the same order as on the full grid
+        return cells.map(lambda da: da.copy(data=np.ascontiguousarray(da.values)), keep_attrs=True)
+
+    def scatter(self, ds):
+        """Inverse of ``gather``: back onto the window grid, with NaN for the cells not needed."""
+        lat_idx, lon_idx = np.nonzero(self.mask)
+        out = {}
+        for name, da in ds.data_vars.items():
+            dims = [d for d in da.dims if d != 'cell']
+            values = da.transpose(*dims, 'cell').values
+            grid = np.full(values.shape[:-1] + self.mask.shape, np.nan,
+                           dtype=np.result_type(values.dtype, np.float32))
+            grid[..., lat_idx, lon_idx] = values
+            out[name] = (dims + ['latitude', 'longitude'], grid)
+        coords = {name: coord for name, coord in ds.coords.items() if 'cell' not in coord.dims}
+        return xr.Dataset(out, coords={**coords, 'latitude': self.lat, 'longitude': self.lon})
+
+    def _masked(self, da):
+        """``da`` with NaN outside the mask, and blocks without a needed cell never computed."""
+        import dask.array
+
+        mask = xr.DataArray(self.mask, dims=('latitude', 'longitude'))
+        da = da.where(mask)
+        if da.chunks is None:
+            return da
+        lat_axis, lon_axis = da.get_axis_num('latitude'), da.get_axis_num('longitude')
+        lat_edges = np.cumsum((0,) + da.chunks[lat_axis])
+        lon_edges = np.cumsum((0,) + da.chunks[lon_axis])
+        keep = np.array([[self.mask[lat_edges[i]:lat_edges[i + 1], lon_edges[j]:lon_edges[j + 1]].any()
+                          for j in range(len(lon_edges) - 1)] for i in range(len(lat_edges) - 1)])
+        if keep.all():
+            return da
+        data = da.data
+
+        def piece(i, j):
+            index = [slice(None)] * data.ndim
+            index[lat_axis], index[lon_axis] = i, j
+            block = data.blocks[tuple(index)]
+            if keep[i, j]:
+                return block
+            return dask.array.full(block.shape, np.nan, dtype=data.dtype, chunks=block.chunks)
+
+        # Nested lists for dask.array.block: one level per axis, single entries off the grid axes
+        def nest(axis, i=None, j=None):
+            if axis == data.ndim:
+                return piece(i, j)
+            if axis == lat_axis:
+                return [nest(axis + 1, k, j) for k in range(keep.shape[0])]
+            if axis == lon_axis:
+                return [nest(axis + 1, i, k) for k in range(keep.shape[1])]
+            return [nest(axis + 1, i, j)]
+
+        return da.copy(data=dask.array.block(nest(0)))
+
+    def mask_dataset(self, ds):
+        """Apply the mask to every gridded variable of a window-cropped dataset."""
+        ds = ds.copy()
+        for name, da in ds.data_vars.items():
+            if 'latitude' in da.dims and 'longitude' in da.dims:
+                ds[name] = self._masked(da)
+        return ds
+
+
+def spatial_subset(config, lat_values, lon_values):
+    """The configured ``SpatialSubset`` of a grid, or None when the whole grid is used."""
+    settings = subset_settings(config)
+    if settings is None:
+        return None
+    lat_values = np.asarray(lat_values, dtype=np.float64)
+    lon_values = np.asarray(lon_values, dtype=np.float64)
+    needed = np.ones((len(lat_values), len(lon_values)), dtype=bool)
+
+    countries = settings.get('countries')
+    if settings.get('land_mask') or countries:
+        # Area-mode cells cover every cell any aggregation mode can use
+        index = load_country_index(lat_values, lon_values, config['shapefile'], config['cache_folder'],
+                                   mode='area')
+        needed = (index.restrict(countries) if countries else index).cell_mask()
+
+    if 'bbox' in settings:
+        lat_min, lat_max, lon_min, lon_max = settings['bbox']
+        lon = convert_longitudes(lon_values)
+        lon_min, lon_max = convert_longitudes(np.array([lon_min, lon_max]))
+        # A box whose western edge is east of its eastern edge crosses the date line
+        in_lon = ((lon >= lon_min) & (lon <= lon_max) if lon_min <= lon_max
+                  else (lon >= lon_min) | (lon <= lon_max))
+        needed &= ((lat_values >= lat_min) & (lat_values <= lat_max))[:, None] & in_lon[None, :]
+    if not needed.any():
+        raise ValueError(f"the spatial subset {settings} selects no grid cells")
+
+    if countries or 'bbox' in settings:
+        rows = _window(needed.any(axis=1))
+        cols = _window(needed.any(axis=0), circular=True)
+    else:
+        rows, cols = np.arange(len(lat_values)), np.arange(len(lon_values))
+    return SpatialSubset(rows, cols, needed[np.ix_(rows, cols)], lat_values, lon_values,
+                         countries=countries)
@@ -0,0 +1,70 @@
+"""Moist-air thermodynamics shared by the daily extractions."""
+import numpy as np
+
+# Reference humidity ratio for Qb (kg/kg dry air)
+W_REF = 0.0116
+# Temperature threshold for ELD (°C)
+T_THRESHOLD = 25.6
+
+
+def kelvin_to_celsius(T):
+    """Convert temperature from Kelvin to Celsius."""
+    return T - 273.15
+
+
+def calculate_vapor_pressure(T):
+    """Saturation vapor pressure (hPa) using temperature in Celsius."""
+    return 6.112 * np.exp((17.62 * T) / (243.12 + T))
+
+
+def humidity_ratio(e, P=1013.25):
+    """Humidity ratio W (kg/kg dry air) from vapor pressure and pressure (hPa)."""
+    return 0.622 * (e / (P - e))
+
+
+def calculate_specific_humidity_ratio(Td, P=1013.25):
+    """Compute humidity ratio W (kg/kg dry air) from dew point and pressure."""
+    e = calculate_vapor_pressure(Td)  # actual vapor pressure from dew point
+    return humidity_ratio(e, P)
+
+
+def calculate_enthalpy(T, W):
+    """Calculate moist air enthalpy (kJ/kg dry air)."""
+    return 1.006 * T + W * (2501 + 1.86 * T)
+
+
+def relative_humidity(e, es):
+    """Relative humidity (%) from actual and saturation vapor pressure, capped at 100."""
+    return np.minimum(100 * e / es, 100)
+
+
+def heat_index(T, RH):
+    """NWS heat index (°C) from temperature (°C) and relative humidity (%).
+
+    Steadman's simple formula below about 27 °C (80 °F), the Rothfusz
+    regression with its low- and high-humidity adjustments above it.
+    """
+    import xarray as xr
+
+    F = T * 1.8 + 32
+    simple = 0.5 * (F + 61 + (F - 68) * 1.2 + RH * 0.094)
+    full = (-42.379 + 2.04901523 * F + 10.14333127 * RH - 0.22475541 * F * RH
+            - 0.00683783 * F ** 2 - 0.05481717 * RH ** 2 + 0.00122874 * F ** 2 * RH
+            + 0.00085282 * F * RH ** 2 - 0.00000199 * F ** 2 * RH ** 2)
+    dry = (RH < 13) & (F >= 80) & (F <= 112)
+    full = full - xr.where(dry, (13 - RH) / 4 * np.sqrt(np.maximum(17 - abs(F - 95), 0) / 17), 0)
+    humid = (RH > 85) & (F >= 80) & (F <= 87)
+    full = full + xr.where(humid, (RH - 85) / 10 * (87 - F) / 5, 0)
+    HI = xr.where((simple + F) / 2 >= 80, full, simple)
+    return (HI - 32) / 1.8
+
+
+def wet_bulb_temperature(T, RH):
+    """Wet-bulb temperature (°C) at sea-level pressure from T (°C) and RH (%) (Stull, 2011)."""
+    return (T * np.arctan(0.151977 * np.sqrt(RH + 8.313659)) + np.arctan(T + RH)
+            - np.arctan(RH - 1.676331) + 0.00391838 * RH ** 1.5 * np.arctan(0.023101 * RH) - 4.686035)
+
+
+def humidex(T, e):
+    """Humidex (°C) from temperature (°C) and vapor pressure (hPa)."""
+    return T + 0.5555 * (e - 10)
@@ -0,0 +1,70 @@
+"""Append mode: bring every output up to date with the raw downloads, doing only the new work.
+
+``run_update`` chains the passes, each of which already skips up-to-date work:
+
+1. daily: months whose raw ``2d``/``2t`` pair is new or changed (per the
+   daily manifest);
+2. monthly: only the (metric, year) tables with a month older than its
+   daily file. Only those months are recomputed, and only their rows are
+   upserted into the Parquet panel store;
+3. climatologies: new daily files within the ``climatology_years`` base
+   period are folded into the saved per-group sums and counts (see
+   ``climdrivers.climatology``). Months outside it leave them untouched.
+
+A raw file modified within the last ``settle_seconds`` may still be
+downloading, so it is left for the next round, as is a month whose ``2t``
+file has not arrived yet. ``watch`` repeats the update every
+``watch_interval`` seconds.
+"""
+import os
+import time
+
+from climdrivers.daily import file_year_month
+from climdrivers.scheduler import month_file_pairs
+
+
+def settled_months(raw_folder, years, months=range(1, 13), settle_seconds=0, now=None):
+    """(ready, waiting) lists of the (year, month) raw pairs in ``years`` and ``months``.
+
+    A pair is ready when both files exist and neither changed in the last
+    ``settle_seconds``.
+    """
+    now = time.time() if now is None else now
+    years, months = {int(y) for y in years}, {int(m) for m in months}
+    ready, waiting = [], []
+    for dew_path, temp_path in month_file_pairs(raw_folder, sorted(years)):
+        year, month = (int(v) for v in file_year_month(os.path.basename(dew_path)))
+        if year not in years or month not in months:
+            continue
+        if (os.path.exists(temp_path)
+                and now - max(os.path.getmtime(dew_path), os.path.getmtime(temp_path)) >= settle_seconds):
+            ready.append((year, month))
+        else:
+            waiting.append((year, month))
+    return ready, waiting
+
+
+def run_update(config, years, months=range(1, 13)):
+    """One round of append mode over ``years`` and ``months``."""
+    from climdrivers.climatology import build_climatologies
+    from climdrivers.daily import run_daily
+    from climdrivers.monthly import run_monthly
+
+    ready, waiting = settled_months(config['raw_folder'], years, months, config['settle_seconds'])
+    if waiting:
+        print(f"Leaving {', '.join(f'{y}-{m:02d}' for y, m in waiting)} for the next round "
+              f"(still downloading)")
+    run_daily(config, ready)
+    if not os.path.isdir(config['daily_folder']):
+        print("No daily files yet")
+        return
+    run_monthly(config, config['metrics'], years, months, stale_only=True)
+    build_climatologies(config)
+
+
+def watch(config, years, months=range(1, 13)):
+    """``run_update`` every ``watch_interval`` seconds until interrupted."""
+    while True:
+        run_update(config, years, months)
+        print(f"Next check in {config['watch_interval']:g} seconds")
+        time.sleep(config['watch_interval'])
@@ -0,0 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from climdrivers import instrument
+
+
+def test_concurrent_tasks_keep_their_own_stages_and_counters():
+    n_tasks = 8
+    barrier = threading.Barrier(n_tasks)
+    root = instrument.recorder().snapshot()
+    root_calls = root['stages'].get('work', {}).get('calls', 0)
+
+    def run(i):
+        with instrument.task(f"task {i}") as recorder:
+            with instrument.stage('work'):
+                # Every task is inside its stage before any of them leaves it
+                barrier.wait(timeout=10)
+                instrument.count('n')
+            barrier.wait(timeout=10)
+            assert instrument.recorder() is recorder
+        return recorder.snapshot()
+
+    with ThreadPoolExecutor(max_workers=n_tasks) as pool:
+        snapshots = list(pool.map(run, range(n_tasks)))
+
+    for snapshot in snapshots:
+        assert snapshot['stages']['work']['calls'] == 1
+        assert snapshot['counters'] == {'n': 1}
+    merged = instrument.Recorder()
+    for snapshot in snapshots:
+        merged.merge(snapshot)
+    assert merged.stages['work']['calls'] == n_tasks
+    assert merged.counters == {'n': n_tasks}
+    # Nothing leaked into the process's own recorder
+    assert instrument.recorder().snapshot()['stages'].get('work', {}).get('calls', 0) == root_calls